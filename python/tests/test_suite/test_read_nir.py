@@ -1,4 +1,11 @@
 import os
+import asyncio
+import logging
+import gzip
+import datetime
+import threading
+import time
+import tracemalloc
 import pytest
 import numpy as np
 import trex_imager_readfile
@@ -507,3 +514,1864 @@ def test_read_first_frame_and_no_metadata(test_dict):
 
     # check dtype
     assert img.dtype == np.uint16
+
+
+@pytest.mark.nir
+@pytest.mark.parametrize("test_dict", [
+    {
+        "filename": "20220307_0605_gill_nir-216_8446.pgm",
+        "truncate_bytes": 1000,
+        "expected_error": "image data read failure",
+    },
+    {
+        "filename": "20220307_0605_gill_nir-216_8446.pgm",
+        "truncate_bytes": 131072 + 500,
+        "expected_error": "image data read failure",
+    },
+])
+def test_read_truncated_file(tmp_path, test_dict):
+    # write out a truncated copy of the file
+    with open("%s/%s" % (DATA_DIR, test_dict["filename"]), 'rb') as fp:
+        contents = fp.read()
+    truncated_filename = "%s/%s" % (tmp_path, test_dict["filename"])
+    with open(truncated_filename, 'wb') as fp:
+        fp.write(contents[:-test_dict["truncate_bytes"]])
+
+    # read file
+    img, meta, problematic_files = trex_imager_readfile.read_nir(truncated_filename, quiet=True)
+
+    # check that the file was flagged
+    assert len(problematic_files) == 1
+    assert problematic_files[0]["filename"] == truncated_filename
+    assert problematic_files[0]["error_message"].startswith(test_dict["expected_error"])
+    assert img.shape == (256, 256, 0)
+    assert len(meta) == 0
+
+
+@pytest.mark.nir
+def test_read_first_frame_matches_full_read():
+    # the first frame of a full read should be identical to a first_frame read
+    filename = "%s/20220307_0600_gill_nir-216_8446.pgm.gz" % (DATA_DIR)
+    img, meta, _ = trex_imager_readfile.read_nir(filename)
+    img_first, meta_first, _ = trex_imager_readfile.read_nir(filename, first_frame=True)
+    assert np.array_equal(img[:, :, 0], img_first[:, :, 0])
+    assert meta[0] == meta_first[0]
+
+    # frames should be stacked in file order
+    assert meta[0]["Image request start"] < meta[-1]["Image request start"]
+
+
+@pytest.mark.nir
+@pytest.mark.parametrize("workers", [2, 3])
+@pytest.mark.parametrize("backend", ["auto", "process", "thread"])
+def test_read_workers_match_single_worker(workers, backend):
+    # build file list
+    file_list = []
+    for f in ["20220307_0600_gill_nir-216_8446.pgm.gz", "20220307_0601_gill_nir-216_8446.pgm.gz", "20220307_0605_gill_nir-216_8446.pgm"]:
+        file_list.append("%s/%s" % (DATA_DIR, f))
+
+    # read with a single worker and with multiple workers
+    img, meta, _ = trex_imager_readfile.read_nir(file_list)
+    img_workers, meta_workers, _ = trex_imager_readfile.read_nir(file_list, workers=workers, backend=backend)
+
+    # check that the results are identical
+    assert img_workers.shape == img.shape
+    assert img_workers.dtype == img.dtype
+    assert np.array_equal(img_workers, img)
+    assert meta_workers == meta
+
+
+@pytest.mark.nir
+@pytest.mark.parametrize("backend", ["process", "thread"])
+def test_read_workers_auto(caplog, backend):
+    # build file list
+    file_list = []
+    for f in sorted(os.listdir(DATA_DIR)):
+        if (f.endswith(".pgm.gz") is True):
+            file_list.append("%s/%s" % (DATA_DIR, f))
+
+    # read with a single worker, and with the number of workers picked automatically
+    img, meta, _ = trex_imager_readfile.read_nir(file_list)
+    meta_only, _ = trex_imager_readfile.read_nir_metadata(file_list)
+    with caplog.at_level(logging.DEBUG, logger="trex_imager_readfile"):
+        img_auto, meta_auto, problematic_files = trex_imager_readfile.read_nir(file_list, workers="auto", backend=backend)
+        meta_only_auto, _ = trex_imager_readfile.read_nir_metadata(file_list, workers="auto", backend=backend)
+
+    # check that the results are identical, and that the choice was reported
+    assert len(problematic_files) == 0
+    assert np.array_equal(img_auto, img)
+    assert meta_auto == meta
+    assert meta_only_auto == meta_only
+    messages = [r.getMessage() for r in caplog.records if "workers=\"auto\"" in r.getMessage()]
+    assert len(messages) == 2
+    assert ("%s workers" % (backend)) in messages[0]
+
+
+@pytest.mark.nir
+@pytest.mark.parametrize("test_dict", [
+    {
+        "cpus": 64,
+        "cpu_quota": None,
+        "memory": None,
+        "backend": "thread",
+        "expected_workers": 3,  # one per MB of files
+    },
+    {
+        "cpus": 64,
+        "cpu_quota": 1.5,
+        "memory": None,
+        "backend": "thread",
+        "expected_workers": 2,  # container's CPU quota, rounded up
+    },
+    {
+        "cpus": 2,
+        "cpu_quota": 8,
+        "memory": None,
+        "backend": "thread",
+        "expected_workers": 2,  # CPU affinity
+    },
+    {
+        "cpus": 64,
+        "cpu_quota": None,
+        "memory": 12 * 1024 * 1024,
+        "backend": "thread",
+        "expected_workers": 2,  # room for two workers in half of the memory
+    },
+    {
+        "cpus": 64,
+        "cpu_quota": None,
+        "memory": 1024,
+        "backend": "thread",
+        "expected_workers": 1,  # always at least one worker
+    },
+    {
+        "cpus": 64,
+        "cpu_quota": None,
+        "memory": None,
+        "backend": "process",
+        "expected_workers": 1,  # too little data to be worth starting processes
+    },
+])
+def test_worker_count_auto(monkeypatch, test_dict):
+    # build file list (5 files of about 0.7MB each)
+    file_list = []
+    for f in sorted(os.listdir(DATA_DIR)):
+        if (f.endswith(".pgm.gz") is True):
+            file_list.append("%s/%s" % (DATA_DIR, f))
+
+    # fake the system's limits
+    engine = trex_imager_readfile._engine
+    monkeypatch.setattr(engine.os, "sched_getaffinity", lambda pid: set(range(0, test_dict["cpus"])), raising=False)
+    monkeypatch.setattr(engine, "__cgroup_cpu_quota", lambda: test_dict["cpu_quota"])
+    monkeypatch.setattr(engine, "__available_memory", lambda: test_dict["memory"])
+
+    # check the number of workers picked
+    assert engine.worker_count("auto", file_list, test_dict["backend"]) == test_dict["expected_workers"]
+    assert engine.worker_count(4, file_list, test_dict["backend"]) == 4
+
+
+@pytest.mark.nir
+@pytest.mark.parametrize("test_dict", [
+    {
+        "cgroup_files": {"/sys/fs/cgroup/cpu.max": "150000 100000"},
+        "expected_quota": 1.5,
+    },
+    {
+        "cgroup_files": {"/sys/fs/cgroup/cpu.max": "max 100000"},
+        "expected_quota": None,
+    },
+    {
+        "cgroup_files": {"/sys/fs/cgroup/cpu/cpu.cfs_quota_us": "400000", "/sys/fs/cgroup/cpu/cpu.cfs_period_us": "100000"},
+        "expected_quota": 4,
+    },
+    {
+        "cgroup_files": {"/sys/fs/cgroup/cpu/cpu.cfs_quota_us": "-1", "/sys/fs/cgroup/cpu/cpu.cfs_period_us": "100000"},
+        "expected_quota": None,
+    },
+    {
+        "cgroup_files": {},
+        "expected_quota": None,
+    },
+])
+def test_cgroup_cpu_quota(monkeypatch, test_dict):
+    engine = trex_imager_readfile._engine
+    monkeypatch.setattr(engine, "__read_cgroup_file", lambda filename: test_dict["cgroup_files"].get(filename))
+    assert getattr(engine, "__cgroup_cpu_quota")() == test_dict["expected_quota"]
+
+
+@pytest.mark.nir
+@pytest.mark.parametrize("large_file_position", [0, 2, 4])
+def test_read_workers_mixed_file_sizes(tmp_path, large_file_position):
+    # build file list, with a file that holds several files' worth of frames
+    file_list = []
+    for f in sorted(os.listdir(DATA_DIR)):
+        if (f.endswith(".pgm.gz") is True):
+            file_list.append("%s/%s" % (DATA_DIR, f))
+    img_large, _, _ = trex_imager_readfile.read_nir(file_list[0:3])
+    large_filename = "%s/20220307_0610_gill_nir-216_8446.pgm.gz" % (tmp_path)
+    with gzip.open(large_filename, 'wb') as fp_out:
+        for f in file_list[0:3]:
+            with gzip.open(f, 'rb') as fp_in:
+                fp_out.write(fp_in.read())
+    file_list.insert(large_file_position, large_filename)
+
+    # read with a single worker and with multiple workers, which read the largest file first
+    img, meta, _ = trex_imager_readfile.read_nir(file_list)
+    img_workers, meta_workers, problematic_files = trex_imager_readfile.read_nir(file_list, workers=3)
+
+    # check that the frames are in the order of the file list
+    assert len(problematic_files) == 0
+    assert img.shape == (256, 256, 80)
+    assert np.array_equal(img_workers, img)
+    assert meta_workers == meta
+    assert np.array_equal(img_workers[..., large_file_position * 10:large_file_position * 10 + 30], img_large)
+
+
+@pytest.mark.nir
+@pytest.mark.parametrize("backend", ["process", "thread"])
+def test_read_metadata_workers_match_single_worker(backend):
+    # build file list
+    file_list = []
+    for f in ["20220307_0600_gill_nir-216_8446.pgm.gz", "20220307_0601_gill_nir-216_8446.pgm.gz", "20220307_0605_gill_nir-216_8446.pgm"]:
+        file_list.append("%s/%s" % (DATA_DIR, f))
+
+    # read metadata with a single worker and with multiple workers
+    meta, _ = trex_imager_readfile.read_nir_metadata(file_list)
+    meta_workers, problematic_files = trex_imager_readfile.read_nir_metadata(file_list, workers=2, backend=backend)
+
+    # check that the results are identical
+    assert len(problematic_files) == 0
+    assert meta_workers == meta
+
+
+@pytest.mark.nir
+@pytest.mark.skipif(os.path.isdir("/dev/shm") is False, reason="shared memory segments aren't listed in /dev/shm")
+def test_read_workers_shared_memory_cleanup(monkeypatch):
+    # build file list
+    file_list = []
+    for f in ["20220307_0600_gill_nir-216_8446.pgm.gz", "20220307_0601_gill_nir-216_8446.pgm.gz", "20220307_0605_gill_nir-216_8446.pgm"]:
+        file_list.append("%s/%s" % (DATA_DIR, f))
+
+    # keep track of the segments allocated by these reads
+    #
+    # NOTE: other tests may be creating and removing segments at the same time (ie. with
+    # pytest-xdist), so only these ones are checked
+    from trex_imager_readfile import _engine
+    allocate_shared = getattr(_engine, "__allocate_shared")
+    segment_names = []
+
+    def recording_allocate_shared(shape, dtype):
+        images, shm = allocate_shared(shape, dtype)
+        segment_names.append(shm.name)
+        return images, shm
+
+    monkeypatch.setattr(_engine, "__allocate_shared", recording_allocate_shared)
+
+    # read with worker processes, the result is a normal array
+    img, _, _ = trex_imager_readfile.read_nir(file_list, workers=2, backend="process")
+    assert isinstance(img, np.ndarray)
+    assert img.shape == (256, 256, 30)
+    img_copy = img.copy()
+    img += 1
+    assert np.array_equal(img, img_copy + 1)
+    del img
+    assert len(segment_names) == 1
+    assert os.path.exists("/dev/shm/%s" % (segment_names[0].lstrip("/"))) is False
+
+    # interrupt a read part way through, the segment is still removed
+    class InterruptedPool:
+
+        def __init__(self, processes=None, initializer=None):
+            pass
+
+        def imap_unordered(self, func, tasks, chunksize=1):
+            raise KeyboardInterrupt
+
+        def terminate(self):
+            pass
+
+    monkeypatch.setattr("trex_imager_readfile._engine.Pool", InterruptedPool)
+    img, meta, problematic_files = trex_imager_readfile.read_nir(file_list, workers=2, backend="process")
+    assert img.shape == (0, 0, 0)
+    assert len(meta) == 0
+    assert len(problematic_files) == 0
+    assert len(segment_names) == 2
+    assert os.path.exists("/dev/shm/%s" % (segment_names[1].lstrip("/"))) is False
+
+
+@pytest.mark.nir
+@pytest.mark.parametrize("backend", ["auto", "process", "thread"])
+def test_reader(backend):
+    # build file list
+    file_list = []
+    for f in ["20220307_0600_gill_nir-216_8446.pgm.gz", "20220307_0601_gill_nir-216_8446.pgm.gz", "20220307_0605_gill_nir-216_8446.pgm"]:
+        file_list.append("%s/%s" % (DATA_DIR, f))
+    img, meta, _ = trex_imager_readfile.read_nir(file_list)
+
+    with trex_imager_readfile.Reader(workers=2, backend=backend) as reader:
+        # read a few times using the same workers
+        for _ in range(0, 3):
+            img_reader, meta_reader, problematic_files = reader.read_nir(file_list)
+            assert len(problematic_files) == 0
+            assert np.array_equal(img_reader, img)
+            assert meta_reader == meta
+        img_reader, _, _ = reader.read_nir(file_list, frames=slice(0, 2))
+        assert np.array_equal(img_reader, img[..., [0, 1, 10, 11, 20, 21]])
+        meta_reader, problematic_files = reader.read_nir_metadata(file_list)
+        assert len(problematic_files) == 0
+        assert meta_reader == meta
+
+        # read from several threads at once
+        results = [None] * 4
+
+        def read_thread(i):
+            results[i] = reader.read_nir(file_list[0:i % 3 + 1])
+
+        threads = [threading.Thread(target=read_thread, args=(i, )) for i in range(0, len(results))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        for i in range(0, len(results)):
+            assert np.array_equal(results[i][0], img[..., 0:(i % 3 + 1) * 10])
+
+        # workers and backend are set for the whole reader
+        with pytest.raises(TypeError):
+            reader.read_nir(file_list, workers=4)
+
+    # a closed reader can't be used
+    with pytest.raises(ValueError):
+        reader.read_nir(file_list)
+
+
+@pytest.mark.nir
+@pytest.mark.parametrize("verify", [True, False])
+def test_decompress_keep_buffer(tmp_path, verify):
+    from trex_imager_readfile import _decompress
+
+    # build files of different sizes, including one with several members
+    file_list = []
+    for f in ["20220307_0600_gill_nir-216_8446.pgm.gz", "20220307_0603_gill_nir-216_8446.pgm.gz"]:
+        file_list.append("%s/%s" % (DATA_DIR, f))
+    with open(file_list[0], "rb") as fp:
+        contents = fp.read()
+    with open("%s/members.pgm.gz" % (tmp_path), "wb") as fp:
+        fp.write(contents + contents)
+    with open("%s/small.pgm.gz" % (tmp_path), "wb") as fp:
+        fp.write(gzip.compress(b"P5\n"))
+    file_list = [file_list[0], "%s/members.pgm.gz" % (tmp_path), "%s/small.pgm.gz" % (tmp_path), file_list[1], file_list[0]]
+
+    # decompress the files one after another in a thread that keeps its buffer
+    results = []
+
+    def decompress_thread():
+        _decompress.keep_buffer()
+        for f in file_list:
+            results.append(_decompress.decompress_file(f, verify=verify)[0])
+
+    t = threading.Thread(target=decompress_thread)
+    t.start()
+    t.join()
+
+    # check that every file was decompressed in full
+    assert len(results) == len(file_list)
+    for i in range(0, len(file_list)):
+        with open(file_list[i], "rb") as fp:
+            assert results[i] == gzip.decompress(fp.read())
+
+
+@pytest.mark.nir
+def test_reader_interrupted(monkeypatch):
+    # build file list
+    file_list = []
+    for f in ["20220307_0600_gill_nir-216_8446.pgm.gz", "20220307_0601_gill_nir-216_8446.pgm.gz"]:
+        file_list.append("%s/%s" % (DATA_DIR, f))
+    img, _, _ = trex_imager_readfile.read_nir(file_list)
+
+    # the first pool started is interrupted part way through a read
+    class InterruptedPool:
+
+        def __init__(self):
+            self.stopped = False
+
+        def imap_unordered(self, func, tasks, chunksize=1):
+            raise KeyboardInterrupt
+
+        def close(self):
+            self.stopped = True
+
+        def terminate(self):
+            self.stopped = True
+
+    interrupted_pool = InterruptedPool()
+    create_pool = trex_imager_readfile._engine.create_pool
+    monkeypatch.setattr("trex_imager_readfile._engine.create_pool", lambda workers, backend, initializer=None: interrupted_pool)
+    with trex_imager_readfile.Reader(workers=2, backend="thread") as reader:
+        img_reader, meta_reader, _ = reader.read_nir(file_list)
+        assert img_reader.shape == (0, 0, 0)
+        assert len(meta_reader) == 0
+        assert interrupted_pool.stopped is True
+
+        # a new pool is started for the next read
+        monkeypatch.setattr("trex_imager_readfile._engine.create_pool", create_pool)
+        img_reader, _, problematic_files = reader.read_nir(file_list)
+        assert len(problematic_files) == 0
+        assert np.array_equal(img_reader, img)
+
+
+@pytest.mark.nir
+def test_reader_discarded_pool_in_use(monkeypatch):
+    # a pool that's discarded while other reads are using it is only stopped once they're done
+    class FakePool:
+
+        def __init__(self):
+            self.stopped = False
+
+        def close(self):
+            self.stopped = True
+
+        def join(self):
+            pass
+
+        def terminate(self):
+            self.stopped = True
+
+    monkeypatch.setattr("trex_imager_readfile._engine.create_pool", lambda workers, backend, initializer=None: FakePool())
+    reader = trex_imager_readfile.Reader(workers=2, backend="process")
+    pool = reader._pool("process")
+    assert reader._pool("process") is pool
+    reader._discard_pool("process", pool)
+    new_pool = reader._pool("process")
+    assert new_pool is not pool
+    reader._release_pool(pool)
+    assert pool.stopped is False
+    reader._release_pool(pool)
+    assert pool.stopped is True
+
+    # closing waits for the reads in progress
+    closed = threading.Event()
+    close_thread = threading.Thread(target=lambda: (reader.close(), closed.set()))
+    close_thread.start()
+    assert closed.wait(0.2) is False
+    assert new_pool.stopped is False
+    reader._release_pool(new_pool)
+    close_thread.join()
+    assert new_pool.stopped is True
+
+
+@pytest.mark.nir
+@pytest.mark.skipif(hasattr(os, "mkfifo") is False, reason="named pipes aren't supported")
+def test_reader_timeout_per_file(tmp_path, monkeypatch):
+    # build file list, with a named pipe that blocks anything opening it
+    file_list = []
+    for f in ["20220307_0600_gill_nir-216_8446.pgm.gz", "20220307_0601_gill_nir-216_8446.pgm.gz"]:
+        file_list.append("%s/%s" % (DATA_DIR, f))
+    img, _, _ = trex_imager_readfile.read_nir(file_list)
+    hung_filename = "%s/20220307_0602_gill_nir-216_8446.pgm.gz" % (tmp_path)
+    os.mkfifo(hung_filename)
+
+    # keep track of the process pools started (the files are probed on threads)
+    pools = []
+    create_pool = trex_imager_readfile._engine.create_pool
+
+    def recording_create_pool(workers, backend, initializer=None):
+        pool = create_pool(workers, backend, initializer=initializer)
+        if (backend == "process"):
+            pools.append(pool)
+        return pool
+
+    monkeypatch.setattr("trex_imager_readfile._engine.create_pool", recording_create_pool)
+
+    # the worker stuck on the hung file is killed once the read is done with its pool
+    #
+    # NOTE: metadata reads don't probe the files first, so it's a worker that gets stuck
+    try:
+        with trex_imager_readfile.Reader(workers=2, backend="process") as reader:
+            _, problematic_files = reader.read_nir_metadata([file_list[0], hung_filename], timeout_per_file=0.5, quiet=True)
+            assert len(problematic_files) == 1
+            assert len(pools) == 1
+            assert all([p.is_alive() is False for p in pools[0]._pool]) is True
+
+            # a new pool is started for the next read
+            img_reader, _, problematic_files = reader.read_nir(file_list)
+            assert len(pools) == 2
+            assert len(problematic_files) == 0
+            assert np.array_equal(img_reader, img)
+    finally:
+        # open the other end of the pipe, in case anything is still waiting on it
+        try:
+            os.close(os.open(hung_filename, os.O_WRONLY | os.O_NONBLOCK))
+        except OSError:
+            pass  # nothing has it open
+
+
+@pytest.mark.nir
+def test_reader_async():
+    # build file list
+    file_list = []
+    for f in ["20220307_0600_gill_nir-216_8446.pgm.gz", "20220307_0601_gill_nir-216_8446.pgm.gz"]:
+        file_list.append("%s/%s" % (DATA_DIR, f))
+    img, meta, _ = trex_imager_readfile.read_nir(file_list)
+
+    async def read_async(reader):
+        img_reader, meta_reader, _ = await reader.aread_nir(file_list)
+        frames = []
+        async with reader.aiter_nir_frames(file_list) as frame_iterator:
+            async for frame_img, frame_meta in frame_iterator:
+                frames.append((frame_img, frame_meta))
+        return img_reader, meta_reader, frames
+
+    with trex_imager_readfile.Reader(workers=2, backend="thread") as reader:
+        img_reader, meta_reader, frames = asyncio.run(read_async(reader))
+    assert np.array_equal(img_reader, img)
+    assert meta_reader == meta
+    assert len(frames) == img.shape[-1]
+    for i in range(0, len(frames)):
+        assert np.array_equal(frames[i][0], img[..., i])
+        assert frames[i][1] == meta[i]
+
+
+@pytest.mark.nir
+@pytest.mark.skipif(hasattr(os, "mkfifo") is False, reason="named pipes aren't supported")
+@pytest.mark.parametrize("workers", [1, 2])
+@pytest.mark.parametrize("backend", ["process", "thread"])
+def test_read_timeout_per_file(tmp_path, workers, backend):
+    # build file list, with a named pipe that blocks anything opening it (like a file on a
+    # hung network filesystem)
+    file_list = []
+    for f in ["20220307_0600_gill_nir-216_8446.pgm.gz", "20220307_0601_gill_nir-216_8446.pgm.gz"]:
+        file_list.append("%s/%s" % (DATA_DIR, f))
+    img, meta, _ = trex_imager_readfile.read_nir(file_list)
+    hung_filename = "%s/20220307_0602_gill_nir-216_8446.pgm.gz" % (tmp_path)
+    os.mkfifo(hung_filename)
+    file_list.insert(1, hung_filename)
+
+    # read files, giving up on the hung file
+    try:
+        img_timeout, meta_timeout, problematic_files = trex_imager_readfile.read_nir(
+            file_list,
+            workers=workers,
+            backend=backend,
+            timeout_per_file=0.5,
+            quiet=True,
+        )
+        meta_only, problematic_files_only = trex_imager_readfile.read_nir_metadata(
+            file_list,
+            workers=workers,
+            backend=backend,
+            timeout_per_file=0.5,
+            quiet=True,
+        )
+    finally:
+        # open the other end of the pipe, so that anything still waiting on it carries on
+        os.close(os.open(hung_filename, os.O_WRONLY | os.O_NONBLOCK))
+
+    # check that the other files were read
+    assert np.array_equal(img_timeout, img)
+    assert meta_timeout == meta
+    assert meta_only == meta
+    for p in [problematic_files, problematic_files_only]:
+        assert len(p) == 1
+        assert p[0]["filename"] == hung_filename
+        assert p[0]["error_message"] == "timed out after 0.5 seconds"
+
+
+@pytest.mark.nir
+@pytest.mark.parametrize("workers", [1, 2])
+def test_read_timeout_per_file_includes_probe(monkeypatch, workers):
+    # build file list (the slow file is the smallest, so it's read last)
+    file_list = []
+    for f in ["20220307_0601_gill_nir-216_8446.pgm.gz", "20220307_0600_gill_nir-216_8446.pgm.gz"]:
+        file_list.append("%s/%s" % (DATA_DIR, f))
+    img, meta, _ = trex_imager_readfile.read_nir(file_list[0:1])
+
+    # slow down the second file, so that its probe and its decode each fit in the timeout,
+    # but not both together
+    import trex_imager_readfile.nir as nir
+    probe_func = getattr(nir, "__nir_probe")
+    decode_func = getattr(nir, "__nir_readfile_worker")
+
+    def slow_probe(file, options):
+        if (file == file_list[1]):
+            time.sleep(1)
+        return probe_func(file, options)
+
+    def slow_decode(file, images, options):
+        if (file == file_list[1]):
+            time.sleep(1)
+        return decode_func(file, images, options)
+
+    monkeypatch.setattr(nir, "__nir_probe", slow_probe)
+    monkeypatch.setattr(nir, "__nir_readfile_worker", slow_decode)
+    img_timeout, meta_timeout, problematic_files = trex_imager_readfile.read_nir(
+        file_list,
+        workers=workers,
+        backend="thread",
+        timeout_per_file=1.5,
+        quiet=True,
+    )
+
+    # check that the second file was given up on
+    assert np.array_equal(img_timeout, img)
+    assert meta_timeout == meta
+    assert len(problematic_files) == 1
+    assert problematic_files[0]["filename"] == file_list[1]
+    assert problematic_files[0]["error_message"] == "timed out after 1.5 seconds"
+
+
+@pytest.mark.nir
+@pytest.mark.parametrize("workers", [1, 2])
+def test_read_limits_probe_error(monkeypatch, workers):
+    # build file list
+    file_list = []
+    for f in ["20220307_0600_gill_nir-216_8446.pgm.gz", "20220307_0601_gill_nir-216_8446.pgm.gz"]:
+        file_list.append("%s/%s" % (DATA_DIR, f))
+
+    # make the second file fail to probe
+    import trex_imager_readfile.nir as nir
+    probe_func = getattr(nir, "__nir_probe")
+
+    def failing_probe(file, options):
+        if (file == file_list[1]):
+            raise ValueError("probe failed")
+        return probe_func(file, options)
+
+    monkeypatch.setattr(nir, "__nir_probe", failing_probe)
+    _, _, problematic_files = trex_imager_readfile.read_nir(file_list, workers=workers, backend="thread", timeout_per_file=60, quiet=True)
+
+    # check that the probe's error is kept
+    assert len(problematic_files) == 1
+    assert problematic_files[0]["filename"] == file_list[1]
+    assert problematic_files[0]["error_message"] == "failed to process file: probe failed"
+
+
+@pytest.mark.nir
+@pytest.mark.parametrize("test_dict", [
+    {
+        "deadline": 0,
+        "cancelled": False,
+        "expected_error_message": "deadline passed before the file was read",
+    },
+    {
+        "deadline": -1.5,
+        "cancelled": False,
+        "expected_error_message": "deadline passed before the file was read",
+    },
+    {
+        "deadline": None,
+        "cancelled": True,
+        "expected_error_message": "read cancelled before the file was read",
+    },
+    {
+        "deadline": datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(minutes=5),
+        "cancelled": False,
+        "expected_error_message": None,
+    },
+    {
+        "deadline": 300,
+        "cancelled": False,
+        "expected_error_message": None,
+    },
+])
+@pytest.mark.parametrize("workers", [1, 2])
+def test_read_deadline_and_cancel(test_dict, workers):
+    # build file list
+    file_list = []
+    for f in ["20220307_0600_gill_nir-216_8446.pgm.gz", "20220307_0601_gill_nir-216_8446.pgm.gz", "20220307_0605_gill_nir-216_8446.pgm"]:
+        file_list.append("%s/%s" % (DATA_DIR, f))
+    img, meta, _ = trex_imager_readfile.read_nir(file_list)
+
+    # read files
+    cancel_event = threading.Event()
+    if (test_dict["cancelled"] is True):
+        cancel_event.set()
+    img_limited, meta_limited, problematic_files = trex_imager_readfile.read_nir(
+        file_list,
+        workers=workers,
+        deadline=test_dict["deadline"],
+        cancel_event=cancel_event,
+        quiet=True,
+    )
+
+    # check that every file was given up on, or read
+    if (test_dict["expected_error_message"] is None):
+        assert len(problematic_files) == 0
+        assert np.array_equal(img_limited, img)
+        assert meta_limited == meta
+    else:
+        assert img_limited.shape == (256, 256, 0)
+        assert len(meta_limited) == 0
+        assert [p["filename"] for p in problematic_files] == file_list
+        for p in problematic_files:
+            assert p["error_message"] == test_dict["expected_error_message"]
+
+
+@pytest.mark.nir
+@pytest.mark.parametrize("cancelled", [False, True])
+def test_read_cancel_event_no_pools(monkeypatch, cancelled):
+    # build file list
+    file_list = []
+    for f in ["20220307_0600_gill_nir-216_8446.pgm.gz", "20220307_0601_gill_nir-216_8446.pgm.gz"]:
+        file_list.append("%s/%s" % (DATA_DIR, f))
+
+    # with only a cancel event and one worker, no pools should be started
+    def no_pool(*args, **kwargs):
+        raise AssertionError("pool started")
+
+    monkeypatch.setattr("trex_imager_readfile._engine.ThreadPool", no_pool)
+    monkeypatch.setattr("trex_imager_readfile._engine.Pool", no_pool)
+    cancel_event = threading.Event()
+    if (cancelled is True):
+        cancel_event.set()
+    img, meta, problematic_files = trex_imager_readfile.read_nir(file_list, cancel_event=cancel_event, quiet=True)
+
+    # check that the files were read, or given up on
+    if (cancelled is True):
+        assert img.shape == (256, 256, 0)
+        assert [p["error_message"] for p in problematic_files] == ["read cancelled before the file was read"] * len(file_list)
+    else:
+        assert img.shape == (256, 256, 20)
+        assert len(problematic_files) == 0
+
+
+@pytest.mark.nir
+@pytest.mark.parametrize("test_dict", [
+    {
+        "timeout_per_file": 0,
+        "expected_error": ValueError,
+    },
+    {
+        "timeout_per_file": "10",
+        "expected_error": TypeError,
+    },
+    {
+        "deadline": "tomorrow",
+        "expected_error": TypeError,
+    },
+    {
+        "cancel_event": True,
+        "expected_error": TypeError,
+    },
+])
+def test_read_limits_invalid(test_dict):
+    kwargs = dict(test_dict)
+    expected_error = kwargs.pop("expected_error")
+    with pytest.raises(expected_error):
+        trex_imager_readfile.read_nir("%s/%s" % (DATA_DIR, "20220307_0600_gill_nir-216_8446.pgm.gz"), **kwargs)
+
+
+@pytest.mark.nir
+@pytest.mark.parametrize("workers", [1, 2])
+def test_aread(workers):
+    # build file list
+    file_list = []
+    for f in ["20220307_0600_gill_nir-216_8446.pgm.gz", "20220307_0601_gill_nir-216_8446.pgm.gz", "20220307_0605_gill_nir-216_8446.pgm"]:
+        file_list.append("%s/%s" % (DATA_DIR, f))
+    img, meta, _ = trex_imager_readfile.read_nir(file_list)
+
+    # read the files several times at once, with fewer reads allowed to run at once
+    async def read_all():
+        return await asyncio.gather(*[trex_imager_readfile.aread_nir(file_list, workers=workers) for _ in range(0, 4)])
+
+    max_concurrent_reads = trex_imager_readfile.get_max_concurrent_reads()
+    trex_imager_readfile.set_max_concurrent_reads(2)
+    try:
+        results = asyncio.run(read_all())
+    finally:
+        trex_imager_readfile.set_max_concurrent_reads(max_concurrent_reads)
+
+    # check the results
+    assert len(results) == 4
+    for img_async, meta_async, problematic_files in results:
+        assert len(problematic_files) == 0
+        assert np.array_equal(img_async, img)
+        assert meta_async == meta
+
+
+@pytest.mark.nir
+def test_aiter_frames():
+    # build file list
+    file_list = []
+    for f in ["20220307_0600_gill_nir-216_8446.pgm.gz", "bad_file.pgm.gz", "20220307_0605_gill_nir-216_8446.pgm"]:
+        file_list.append("%s/%s" % (DATA_DIR, f))
+    img, meta, problematic_files = trex_imager_readfile.read_nir(file_list, quiet=True)
+
+    # iterate over the frames
+    async def iterate():
+        frames = []
+        async with trex_imager_readfile.aiter_nir_frames(file_list, quiet=True) as iterator:
+            async for frame in iterator:
+                frames.append(frame)
+        return frames, iterator.problematic_files
+
+    frames, problematic_files_async = asyncio.run(iterate())
+
+    # check the frames
+    assert len(frames) == img.shape[-1]
+    for i in range(0, len(frames)):
+        assert np.array_equal(frames[i][0], img[:, :, i])
+        assert frames[i][1] == meta[i]
+    assert problematic_files_async == problematic_files
+
+    # stop iterating early
+    async def iterate_first():
+        async with trex_imager_readfile.aiter_nir_frames(file_list, quiet=True) as iterator:
+            async for frame in iterator:
+                return frame
+
+    frame = asyncio.run(iterate_first())
+    assert np.array_equal(frame[0], img[:, :, 0])
+    assert frame[1] == meta[0]
+
+
+@pytest.mark.nir
+@pytest.mark.skipif(hasattr(os, "mkfifo") is False, reason="named pipes aren't supported")
+def test_aread_cancel(tmp_path):
+    # build file list, with named pipes that block anything opening them
+    hung_filenames = ["%s/20220307_0602_gill_nir-216_8446.pgm.gz" % (tmp_path), "%s/20220307_0603_gill_nir-216_8446.pgm.gz" % (tmp_path)]
+    for f in hung_filenames:
+        os.mkfifo(f)
+    file_list = ["%s/20220307_0600_gill_nir-216_8446.pgm.gz" % (DATA_DIR)] + hung_filenames
+
+    # start reading, and cancel the read once it's stuck on the first pipe
+    async def read_cancelled():
+        task = asyncio.ensure_future(trex_imager_readfile.aread_nir(file_list))
+        await asyncio.sleep(0.5)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        # let the read carry on past the first pipe, it should give up on the second one
+        os.close(os.open(hung_filenames[0], os.O_WRONLY | os.O_NONBLOCK))
+
+        # check that the event loop and other reads still work (with one read at a time,
+        # this only finishes once the cancelled read has freed its thread)
+        return await asyncio.wait_for(trex_imager_readfile.aread_nir(file_list[0:1]), 60)
+
+    max_concurrent_reads = trex_imager_readfile.get_max_concurrent_reads()
+    trex_imager_readfile.set_max_concurrent_reads(1)
+    try:
+        img, meta, problematic_files = asyncio.run(read_cancelled())
+    finally:
+        trex_imager_readfile.set_max_concurrent_reads(max_concurrent_reads)
+
+        # open the other end of the pipes, so that anything still waiting on them carries on
+        for f in hung_filenames:
+            try:
+                os.close(os.open(f, os.O_WRONLY | os.O_NONBLOCK))
+            except OSError:
+                pass
+    assert img.shape == (256, 256, 10)
+    assert len(meta) == 10
+    assert len(problematic_files) == 0
+
+
+@pytest.mark.nir
+def test_aread_cancel_event_invalid():
+    with pytest.raises(TypeError):
+        asyncio.run(trex_imager_readfile.aread_nir("%s/%s" % (DATA_DIR, "20220307_0600_gill_nir-216_8446.pgm.gz"), cancel_event=threading.Event()))
+    with pytest.raises(TypeError):
+        trex_imager_readfile.aiter_nir_frames("%s/%s" % (DATA_DIR, "20220307_0600_gill_nir-216_8446.pgm.gz"), cancel_event=threading.Event())
+    with pytest.raises(ValueError):
+        trex_imager_readfile.set_max_concurrent_reads(0)
+
+
+@pytest.mark.nir
+@pytest.mark.parametrize("test_dict", [
+    {},
+    {"workers": 2, "backend": "process"},
+    {"workers": 2, "backend": "thread"},
+    {"output_dtype": "float32"},
+    {"no_metadata": True},
+    {"frames": slice(0, 3)},
+])
+def test_read_pipeline(test_dict):
+    # build file list
+    file_list = []
+    for f in sorted(os.listdir(DATA_DIR)):
+        file_list.append("%s/%s" % (DATA_DIR, f))
+
+    # read files, and read them again decoding PGM.gz files as a pipeline
+    img, meta, problematic_files = trex_imager_readfile.read_nir(file_list, **test_dict)
+    img_pipeline, meta_pipeline, problematic_files_pipeline = trex_imager_readfile.read_nir(file_list, pipeline=True, **test_dict)
+
+    # check that the results are identical
+    assert problematic_files_pipeline == problematic_files
+    assert img_pipeline.dtype == img.dtype
+    assert np.array_equal(img_pipeline, img)
+    assert meta_pipeline == meta
+
+
+@pytest.mark.nir
+@pytest.mark.parametrize("test_dict", [
+    {
+        "contents": "multiple_members",
+        "expected_success": True,
+        "expected_frames": 10,
+    },
+    {
+        "contents": "padded_members",
+        "expected_success": True,
+        "expected_frames": 10,
+    },
+    {
+        "contents": "equal_size_members",
+        "expected_success": True,
+        "expected_frames": 20,
+    },
+    {
+        "contents": "truncated_image_data",
+        "expected_success": False,
+    },
+    {
+        "contents": "truncated_gzip",
+        "expected_success": False,
+    },
+])
+def test_read_pipeline_unusual_files(tmp_path, test_dict):
+    # write a PGM.gz file with unusual contents
+    with open("%s/%s" % (DATA_DIR, "20220307_0600_gill_nir-216_8446.pgm.gz"), "rb") as fp:
+        compressed = fp.read()
+    contents = gzip.decompress(compressed)
+    if (test_dict["contents"] == "multiple_members"):
+        compressed = gzip.compress(contents[0:300000]) + gzip.compress(contents[300000:])
+    elif (test_dict["contents"] == "padded_members"):
+        compressed = gzip.compress(contents[0:300000]) + b"\x00" * 100 + gzip.compress(contents[300000:]) + b"\x00" * 10
+    elif (test_dict["contents"] == "equal_size_members"):
+        compressed = compressed + compressed
+    elif (test_dict["contents"] == "truncated_image_data"):
+        compressed = gzip.compress(contents[0:-1000])
+    elif (test_dict["contents"] == "truncated_gzip"):
+        compressed = compressed[0:-5000]
+    filename = "%s/20220307_0600_gill_nir-216_8446.pgm.gz" % (tmp_path)
+    with open(filename, "wb") as fp:
+        fp.write(compressed)
+
+    # read file, with and without a pipeline
+    img, meta, problematic_files = trex_imager_readfile.read_nir(filename, quiet=True)
+    img_pipeline, meta_pipeline, problematic_files_pipeline = trex_imager_readfile.read_nir(filename, pipeline=True, quiet=True)
+
+    # check the results
+    assert np.array_equal(img_pipeline, img)
+    assert meta_pipeline == meta
+    if (test_dict["expected_success"] is True):
+        assert len(problematic_files) == 0
+        assert len(problematic_files_pipeline) == 0
+        assert img_pipeline.shape == (256, 256, test_dict["expected_frames"])
+    else:
+        assert len(problematic_files_pipeline) == 1
+        assert len(problematic_files) == 1
+
+
+@pytest.mark.nir
+def test_read_backend_invalid():
+    with pytest.raises(ValueError):
+        trex_imager_readfile.read_nir("%s/%s" % (DATA_DIR, "20220307_0600_gill_nir-216_8446.pgm.gz"), workers=2, backend="fork")
+
+
+@pytest.mark.nir
+def test_read_peak_memory():
+    # build file list
+    file_list = []
+    max_file_size = 0
+    for f in sorted(os.listdir(DATA_DIR)):
+        if (f.endswith(".pgm.gz") is True):
+            file_list.append("%s/%s" % (DATA_DIR, f))
+            with gzip.open(file_list[-1], 'rb') as fp:
+                max_file_size = max(max_file_size, len(fp.read()))
+
+    # read files, tracking memory usage
+    tracemalloc.start()
+    try:
+        img, _, _ = trex_imager_readfile.read_nir(file_list, no_metadata=True)
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    # the frames are decoded straight into the result, so the only other memory needed is
+    # the (compressed and decompressed) contents of the file being read
+    assert img.shape == (256, 256, 50)
+    assert peak_memory < img.nbytes + 2 * max_file_size
+
+
+@pytest.mark.nir
+def test_read_peak_memory_truncated_file(tmp_path):
+    # build file list, with a truncated file that was estimated to have more frames than it has
+    file_list = []
+    max_file_size = 0
+    for f in sorted(os.listdir(DATA_DIR)):
+        if (f.endswith(".pgm.gz") is True):
+            file_list.append("%s/%s" % (DATA_DIR, f))
+            with gzip.open(file_list[-1], 'rb') as fp:
+                max_file_size = max(max_file_size, len(fp.read()))
+    with gzip.open(file_list[0], 'rb') as fp:
+        contents = fp.read()
+    truncated_filename = "%s/20220307_0559_gill_nir-216_8446.pgm.gz" % (tmp_path)
+    with open(truncated_filename, "wb") as fp:
+        fp.write(gzip.compress(contents[0:-1000]))
+    file_list.insert(1, truncated_filename)
+    img, _, _ = trex_imager_readfile.read_nir([f for f in file_list if f != truncated_filename], no_metadata=True)
+
+    # read files, tracking memory usage
+    tracemalloc.start()
+    try:
+        img_truncated, _, problematic_files = trex_imager_readfile.read_nir(file_list, no_metadata=True, quiet=True)
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    # the space set aside for the truncated file is closed up in place, rather than the
+    # frames being copied into a second, smaller array
+    assert len(problematic_files) == 1
+    assert np.array_equal(img_truncated, img)
+    assert img_truncated.flags["C_CONTIGUOUS"] is True
+    frame_size = img.nbytes // img.shape[-1]
+    assert peak_memory < img.nbytes + 10 * frame_size + 2 * max_file_size
+
+
+@pytest.mark.nir
+def test_read_peak_memory_workers_without_shared_memory(monkeypatch):
+    # build file list, reading each file a few times
+    file_list = []
+    max_file_size = 0
+    for f in sorted(os.listdir(DATA_DIR)):
+        if (f.endswith(".pgm.gz") is True):
+            file_list.append("%s/%s" % (DATA_DIR, f))
+            with gzip.open(file_list[-1], 'rb') as fp:
+                max_file_size = max(max_file_size, len(fp.read()))
+    file_list = file_list * 4
+    img, _, _ = trex_imager_readfile.read_nir(file_list, no_metadata=True)
+
+    # read files with worker processes that can't write into shared memory, tracking memory usage
+    monkeypatch.setattr(trex_imager_readfile._engine, "__shared_memory_available", lambda nbytes: False)
+    tracemalloc.start()
+    try:
+        img_workers, _, _ = trex_imager_readfile.read_nir(file_list, workers=2, backend="process", no_metadata=True)
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    # each worker sends back its frames, which are copied into place as they arrive, so only
+    # a few files' worth of frames are held at once
+    assert np.array_equal(img_workers, img)
+    assert peak_memory < img.nbytes + 6 * max_file_size
+
+
+@pytest.mark.nir
+@pytest.mark.parametrize("test_dict", [
+    {
+        "filenames": [
+            "20220307_0605_gill_nir-216_8446.pgm",
+        ],
+        "workers": 1,
+        "first_frame": False,
+    },
+    {
+        "filenames": [
+            "20220307_0605_gill_nir-216_8446.pgm",
+        ],
+        "workers": 1,
+        "first_frame": True,
+    },
+    {
+        "filenames": [
+            "20220307_0600_gill_nir-216_8446.pgm.gz",
+            "20220307_0605_gill_nir-216_8446.pgm",
+        ],
+        "workers": 2,
+        "first_frame": False,
+    },
+])
+def test_read_mmap(test_dict):
+    # build file list
+    file_list = []
+    for f in test_dict["filenames"]:
+        file_list.append("%s/%s" % (DATA_DIR, f))
+
+    # read files with and without memory mapping
+    img, meta, problematic_files = trex_imager_readfile.read_nir(
+        file_list,
+        workers=test_dict["workers"],
+        first_frame=test_dict["first_frame"],
+    )
+    img_mmap, meta_mmap, problematic_files_mmap = trex_imager_readfile.read_nir(
+        file_list,
+        workers=test_dict["workers"],
+        first_frame=test_dict["first_frame"],
+        mmap=True,
+    )
+
+    # check that the results are identical
+    assert len(problematic_files_mmap) == 0
+    assert img_mmap.dtype == np.uint16
+    assert np.array_equal(img_mmap, img)
+    assert meta_mmap == meta
+
+
+@pytest.mark.nir
+def test_open_mmap():
+    # read file normally for comparison
+    filename = "%s/20220307_0605_gill_nir-216_8446.pgm" % (DATA_DIR)
+    img, meta, _ = trex_imager_readfile.read_nir(filename)
+
+    # open file with memory mapping
+    with trex_imager_readfile.nir.open_mmap(filename) as mapped_file:
+        assert len(mapped_file) == 10
+        assert mapped_file.problematic is False
+        for i in range(0, len(mapped_file)):
+            assert mapped_file[i].shape == (256, 256)
+            assert np.array_equal(mapped_file[i], img[:, :, i])
+        assert mapped_file.frame(-1, native=True).dtype == np.uint16
+        assert np.array_equal(mapped_file.frame(-1, native=True), img[:, :, -1])
+        assert mapped_file.metadata == meta
+
+        # frames stay valid after the file is closed
+        frame = mapped_file[0]
+    assert np.array_equal(frame, img[:, :, 0])
+
+
+@pytest.mark.nir
+def test_open_mmap_compressed_file():
+    with pytest.raises(ValueError):
+        trex_imager_readfile.nir.open_mmap("%s/20220307_0600_gill_nir-216_8446.pgm.gz" % (DATA_DIR))
+
+
+@pytest.mark.nir
+@pytest.mark.parametrize("test_dict", [
+    {
+        "workers": 1,
+        "first_frame": False,
+    },
+    {
+        "workers": 1,
+        "first_frame": True,
+    },
+    {
+        "workers": 2,
+        "first_frame": False,
+    },
+])
+def test_read_gzip_index(tmp_path, test_dict):
+    # build file list
+    file_list = []
+    for f in ["20220307_0600_gill_nir-216_8446.pgm.gz", "20220307_0601_gill_nir-216_8446.pgm.gz", "20220307_0605_gill_nir-216_8446.pgm"]:
+        file_list.append("%s/%s" % (DATA_DIR, f))
+
+    # read files without and with gzip indexes, twice so that the second read uses the saved indexes
+    img, meta, _ = trex_imager_readfile.read_nir(file_list, workers=test_dict["workers"], first_frame=test_dict["first_frame"])
+    for _ in range(0, 2):
+        img_indexed, meta_indexed, problematic_files_indexed = trex_imager_readfile.read_nir(
+            file_list,
+            workers=test_dict["workers"],
+            first_frame=test_dict["first_frame"],
+            gzip_index=str(tmp_path),
+        )
+
+        # check that the results are identical
+        assert len(problematic_files_indexed) == 0
+        assert img_indexed.dtype == np.uint16
+        assert np.array_equal(img_indexed, img)
+        assert meta_indexed == meta
+
+    # check that the indexes were saved
+    assert sorted(os.listdir(tmp_path)) == ["20220307_0600_gill_nir-216_8446.pgm.gz.idx", "20220307_0601_gill_nir-216_8446.pgm.gz.idx"]
+
+
+@pytest.mark.nir
+def test_open_indexed(tmp_path):
+    # read file normally for comparison
+    filename = "%s/20220307_0600_gill_nir-216_8446.pgm.gz" % (DATA_DIR)
+    img, meta, _ = trex_imager_readfile.read_nir(filename)
+
+    # open file using a gzip index, building it and then using the saved one
+    for _ in range(0, 2):
+        with trex_imager_readfile.nir.open_indexed(filename, index_dir=str(tmp_path)) as indexed_file:
+            assert len(indexed_file) == 10
+            assert indexed_file.problematic is False
+            for i in reversed(range(0, len(indexed_file))):
+                assert indexed_file[i].shape == (256, 256)
+                assert indexed_file[i].dtype == np.uint16
+                assert np.array_equal(indexed_file[i], img[:, :, i])
+                assert indexed_file.frame_metadata(i) == meta[i]
+
+
+@pytest.mark.nir
+def test_open_indexed_uncompressed_file():
+    with pytest.raises(ValueError):
+        trex_imager_readfile.nir.open_indexed("%s/20220307_0605_gill_nir-216_8446.pgm" % (DATA_DIR))
+
+
+@pytest.mark.nir
+def test_build_gzip_index(tmp_path):
+    # build file list
+    file_list = []
+    for f in sorted(os.listdir(DATA_DIR)):
+        file_list.append("%s/%s" % (DATA_DIR, f))
+
+    # build indexes, uncompressed files can't be indexed
+    index_file_list, problematic_files = trex_imager_readfile.build_gzip_index(file_list, workers=2, index_dir=str(tmp_path), quiet=True)
+    assert len(index_file_list) == 5
+    assert len(problematic_files) == 1
+    assert problematic_files[0]["filename"] == file_list[-1]
+    for f in index_file_list:
+        assert os.path.exists(f)
+
+    # indexes that no longer match their file are rebuilt when used
+    os.replace(index_file_list[1], index_file_list[0])
+    img, meta, _ = trex_imager_readfile.read_nir(file_list[0])
+    img_indexed, meta_indexed, _ = trex_imager_readfile.read_nir(file_list[0], gzip_index=str(tmp_path))
+    assert np.array_equal(img_indexed, img)
+    assert meta_indexed == meta
+    assert os.path.exists(index_file_list[0])
+
+
+@pytest.mark.nir
+@pytest.mark.parametrize("test_dict", [
+    {
+        "frames": slice(0, 3),
+        "expected_indices": [0, 1, 2],
+    },
+    {
+        "frames": slice(None, None, 3),
+        "expected_indices": [0, 3, 6, 9],
+    },
+    {
+        "frames": [9, 1, 1],
+        "expected_indices": [9, 1, 1],
+    },
+    {
+        "frames": -1,
+        "expected_indices": [9],
+    },
+    {
+        "frames": [0, 100],
+        "expected_indices": [0],
+    },
+])
+def test_read_frames(test_dict):
+    # build file list
+    file_list = []
+    for f in ["20220307_0600_gill_nir-216_8446.pgm.gz", "20220307_0605_gill_nir-216_8446.pgm"]:
+        file_list.append("%s/%s" % (DATA_DIR, f))
+
+    # read all frames, and only the selected frames
+    for filename in file_list:
+        img, meta, _ = trex_imager_readfile.read_nir(filename)
+        img_frames, meta_frames, problematic_files = trex_imager_readfile.read_nir(filename, frames=test_dict["frames"])
+
+        # check that the selected frames were read
+        assert len(problematic_files) == 0
+        assert np.array_equal(img_frames, img[..., test_dict["expected_indices"]])
+        assert meta_frames == [meta[i] for i in test_dict["expected_indices"]]
+
+
+@pytest.mark.nir
+@pytest.mark.parametrize("test_dict", [
+    {
+        "start": datetime.datetime(2022, 3, 7, 6, 0, 30),
+        "end": datetime.datetime(2022, 3, 7, 6, 1, 30),
+        "expected_indices": list(range(5, 15)),
+    },
+    {
+        "start": datetime.datetime(2022, 3, 7, 6, 0, 30, tzinfo=datetime.timezone.utc),
+        "end": datetime.datetime(2022, 3, 7, 6, 1, 30, tzinfo=datetime.timezone.utc),
+        "expected_indices": list(range(5, 15)),
+    },
+    {
+        "start": None,
+        "end": datetime.datetime(2022, 3, 7, 6, 0, 12),
+        "expected_indices": [0, 1],
+    },
+    {
+        "start": datetime.datetime(2022, 3, 7, 6, 1, 54),
+        "end": None,
+        "expected_indices": list(range(19, 30)),
+    },
+    {
+        "start": datetime.datetime(2022, 3, 7, 7, 0, 0),
+        "end": None,
+        "expected_indices": [],
+    },
+])
+@pytest.mark.parametrize("gzip_index", [False, True])
+@pytest.mark.parametrize("workers", [1, 2])
+def test_read_time_window(tmp_path, test_dict, gzip_index, workers):
+    # build file list
+    file_list = []
+    for f in ["20220307_0600_gill_nir-216_8446.pgm.gz", "20220307_0601_gill_nir-216_8446.pgm.gz", "20220307_0602_gill_nir-216_8446.pgm.gz"]:
+        file_list.append("%s/%s" % (DATA_DIR, f))
+
+    # read all frames, and only the frames in the time window
+    img, meta, _ = trex_imager_readfile.read_nir(file_list)
+    img_window, meta_window, problematic_files = trex_imager_readfile.read_nir(
+        file_list,
+        workers=workers,
+        gzip_index=str(tmp_path) if gzip_index is True else False,
+        start=test_dict["start"],
+        end=test_dict["end"],
+    )
+
+    # check that the frames in the time window were read
+    assert len(problematic_files) == 0
+    assert np.array_equal(img_window, img[..., test_dict["expected_indices"]])
+    assert meta_window == [meta[i] for i in test_dict["expected_indices"]]
+
+
+@pytest.mark.nir
+@pytest.mark.parametrize("test_dict", [
+    {
+        "workers": 1,
+        "first_frame": False,
+        "frames": None,
+    },
+    {
+        "workers": 2,
+        "first_frame": False,
+        "frames": None,
+    },
+    {
+        "workers": 1,
+        "first_frame": True,
+        "frames": None,
+    },
+    {
+        "workers": 1,
+        "first_frame": False,
+        "frames": [0, -1],
+    },
+])
+def test_read_metadata(test_dict):
+    # build file list
+    file_list = []
+    for f in ["20220307_0600_gill_nir-216_8446.pgm.gz", "20220307_0605_gill_nir-216_8446.pgm"]:
+        file_list.append("%s/%s" % (DATA_DIR, f))
+
+    # read files, and only their metadata
+    _, meta, problematic_files = trex_imager_readfile.read_nir(
+        file_list,
+        workers=test_dict["workers"],
+        first_frame=test_dict["first_frame"],
+        frames=test_dict["frames"],
+    )
+    meta_only, problematic_files_only = trex_imager_readfile.read_nir_metadata(
+        file_list,
+        workers=test_dict["workers"],
+        first_frame=test_dict["first_frame"],
+        frames=test_dict["frames"],
+    )
+
+    # check that the metadata is identical
+    assert len(problematic_files_only) == 0
+    assert problematic_files_only == problematic_files
+    assert meta_only == meta
+
+
+@pytest.mark.nir
+@pytest.mark.parametrize("test_dict", [
+    {
+        "output_dtype": "uint16",
+        "expected_dtype": np.uint16,
+    },
+    {
+        "output_dtype": "float32",
+        "expected_dtype": np.float32,
+    },
+    {
+        "output_dtype": np.float16,
+        "expected_dtype": np.float16,
+    },
+    {
+        "output_dtype": "uint8",
+        "expected_dtype": np.uint8,
+    },
+    {
+        "output_dtype": "int32",
+        "expected_dtype": np.int32,
+    },
+])
+@pytest.mark.parametrize("workers", [1, 2])
+def test_read_output_dtype(test_dict, workers):
+    # build file list
+    file_list = []
+    for f in ["20220307_0600_gill_nir-216_8446.pgm.gz", "20220307_0605_gill_nir-216_8446.pgm"]:
+        file_list.append("%s/%s" % (DATA_DIR, f))
+
+    # read files in their own dtype, and converted to the output dtype
+    img, meta, _ = trex_imager_readfile.read_nir(file_list)
+    img_converted, meta_converted, problematic_files = trex_imager_readfile.read_nir(
+        file_list,
+        workers=workers,
+        output_dtype=test_dict["output_dtype"],
+    )
+
+    # check that the images were converted
+    #
+    # NOTE: 16-bit data is scaled down to fit in uint8
+    assert len(problematic_files) == 0
+    assert img_converted.dtype == test_dict["expected_dtype"]
+    if (test_dict["expected_dtype"] == np.uint8):
+        assert np.array_equal(img_converted, (img >> 8).astype(np.uint8))
+    else:
+        assert np.array_equal(img_converted, img.astype(test_dict["expected_dtype"]))
+    assert meta_converted == meta
+
+
+@pytest.mark.nir
+@pytest.mark.parametrize("output_dtype", ["int8", "int16", ">i2"])
+def test_read_output_dtype_too_narrow(output_dtype):
+    # integer dtypes that would wrap the 16-bit pixel values around aren't allowed
+    with pytest.raises(ValueError):
+        trex_imager_readfile.read_nir("%s/%s" % (DATA_DIR, "20220307_0600_gill_nir-216_8446.pgm.gz"), output_dtype=output_dtype)
+
+
+@pytest.mark.nir
+@pytest.mark.parametrize("gzip_backend", ["auto"] + trex_imager_readfile.gzip_backends())
+@pytest.mark.parametrize("gzip_verify", [True, False])
+def test_read_gzip_backend(caplog, gzip_backend, gzip_verify):
+    # build file list
+    file_list = []
+    for f in ["20220307_0600_gill_nir-216_8446.pgm.gz", "20220307_0605_gill_nir-216_8446.pgm"]:
+        file_list.append("%s/%s" % (DATA_DIR, f))
+
+    # read files with the default backend, and the one being tested
+    img, meta, _ = trex_imager_readfile.read_nir(file_list)
+    with caplog.at_level(logging.DEBUG, logger="trex_imager_readfile"):
+        img_backend, meta_backend, problematic_files = trex_imager_readfile.read_nir(
+            file_list,
+            gzip_backend=gzip_backend,
+            gzip_verify=gzip_verify,
+        )
+
+    # check that the results are identical
+    assert len(problematic_files) == 0
+    assert np.array_equal(img_backend, img)
+    assert meta_backend == meta
+
+    # check that the backend used for each compressed file was reported
+    assert len([r for r in caplog.records if r.getMessage().startswith("Decompressed")]) == 1
+
+
+@pytest.mark.nir
+@pytest.mark.parametrize("gzip_backend", trex_imager_readfile.gzip_backends())
+@pytest.mark.parametrize("gzip_verify", [True, False])
+def test_read_gzip_backend_equal_size_members(tmp_path, gzip_backend, gzip_verify):
+    # write a file made of two copies of the same file joined together (ie. with cat), so
+    # that the size in the trailer at the end matches the size of the first member
+    with open("%s/%s" % (DATA_DIR, "20220307_0600_gill_nir-216_8446.pgm.gz"), "rb") as fp:
+        compressed = fp.read()
+    filename = "%s/20220307_0600_gill_nir-216_8446.pgm.gz" % (tmp_path)
+    with open(filename, "wb") as fp:
+        fp.write(compressed + compressed)
+
+    # read file, checking that the frames of both members were read
+    img, meta, _ = trex_imager_readfile.read_nir("%s/%s" % (DATA_DIR, "20220307_0600_gill_nir-216_8446.pgm.gz"))
+    img_joined, meta_joined, problematic_files = trex_imager_readfile.read_nir(filename, gzip_backend=gzip_backend, gzip_verify=gzip_verify)
+    assert len(problematic_files) == 0
+    assert img_joined.shape == (256, 256, 20)
+    assert np.array_equal(img_joined, np.concatenate([img, img], axis=2))
+    assert meta_joined == meta + meta
+
+
+@pytest.mark.nir
+def test_read_gzip_backend_unverified_corrupt_trailer(tmp_path):
+    # make a copy of a file with a corrupt CRC32 in its gzip trailer
+    with open("%s/%s" % (DATA_DIR, "20220307_0600_gill_nir-216_8446.pgm.gz"), "rb") as fp:
+        contents = bytearray(fp.read())
+    contents[-8] ^= 0xFF
+    filename = "%s/20220307_0600_gill_nir-216_8446.pgm.gz" % (tmp_path)
+    with open(filename, "wb") as fp:
+        fp.write(contents)
+
+    # the trailer is checked by default, and skipped for trusted data
+    _, _, problematic_files = trex_imager_readfile.read_nir(filename, quiet=True)
+    assert len(problematic_files) == 1
+    img, meta, problematic_files = trex_imager_readfile.read_nir(filename, gzip_verify=False)
+    assert len(problematic_files) == 0
+    assert img.shape == (256, 256, 10)
+    assert len(meta) == 10
+
+
+@pytest.mark.nir
+@pytest.mark.parametrize("gzip_backend", ["unknown", 1])
+def test_read_gzip_backend_invalid(gzip_backend):
+    with pytest.raises(ValueError):
+        trex_imager_readfile.read_nir("%s/%s" % (DATA_DIR, "20220307_0600_gill_nir-216_8446.pgm.gz"), gzip_backend=gzip_backend)
+
+
+@pytest.mark.nir
+@pytest.mark.parametrize("test_dict", [
+    {
+        "workers": 1,
+        "backend": "thread",
+        "first_frame": False,
+        "no_metadata": False,
+    },
+    {
+        "workers": 2,
+        "backend": "process",
+        "first_frame": False,
+        "no_metadata": False,
+    },
+    {
+        "workers": 2,
+        "backend": "thread",
+        "first_frame": True,
+        "no_metadata": False,
+    },
+    {
+        "workers": 1,
+        "backend": "thread",
+        "first_frame": False,
+        "no_metadata": True,
+    },
+])
+def test_read_metadata_format_columnar(test_dict):
+    # build file list
+    file_list = []
+    for f in ["20220307_0600_gill_nir-216_8446.pgm.gz", "20220307_0605_gill_nir-216_8446.pgm", "20220307_0601_gill_nir-216_8446.pgm.gz"]:
+        file_list.append("%s/%s" % (DATA_DIR, f))
+
+    # read files, with both metadata formats
+    kwargs = {"workers": test_dict["workers"], "backend": test_dict["backend"], "first_frame": test_dict["first_frame"]}
+    img, meta, _ = trex_imager_readfile.read_nir(file_list, no_metadata=test_dict["no_metadata"], **kwargs)
+    img_columnar, meta_columnar, problematic_files = trex_imager_readfile.read_nir(
+        file_list,
+        no_metadata=test_dict["no_metadata"],
+        metadata_format="columnar",
+        **kwargs,
+    )
+    meta_only, _ = trex_imager_readfile.read_nir_metadata(file_list, metadata_format="columnar", **kwargs)
+
+    # check that the columns give back the same metadata
+    assert len(problematic_files) == 0
+    assert np.array_equal(img_columnar, img)
+    assert isinstance(meta_columnar, trex_imager_readfile.ColumnarMetadata)
+    assert meta_columnar.num_frames == img.shape[-1]
+    assert meta_columnar.to_records() == meta
+    if (test_dict["no_metadata"] is True):
+        assert len(meta_columnar) == 0
+        return
+    assert meta_only.to_records() == meta
+
+    # check the column types
+    for column in meta_columnar.values():
+        assert column.shape == (img.shape[-1], )
+    assert meta_columnar["Image request start"].dtype == np.dtype("datetime64[us]")
+    assert meta_columnar["Image request start"][0] == np.datetime64("2022-03-07T06:00:00.000000")
+    assert meta_columnar["Mode sequence number"].dtype == np.int64
+    assert meta_columnar["NTP jitter"].dtype == np.float64
+    assert meta_columnar["Site unique ID"].dtype.kind == "U"
+    assert meta_columnar["Mode unique ID"].dtype.kind == "U"
+    if (test_dict["first_frame"] is False):
+        # header fields only in the first frame of each file are masked out of the others
+        assert np.ma.isMaskedArray(meta_columnar["NTP jitter"]) is True
+        assert np.ma.count(meta_columnar["NTP jitter"]) == 3
+        assert "NTP jitter" not in meta_columnar.row(1)
+    assert meta_columnar.row(0)["Mode sequence number"] == int(meta[0]["Mode sequence number"])
+
+
+@pytest.mark.nir
+def test_metadata_format_columnar_mixed_files():
+    # the same field holding different kinds of values in different files
+    from trex_imager_readfile import _metadata
+    parts = [
+        _metadata.from_dicts([{"a": "1.50", "b": "2022-03-07 06:00:00.000000 UTC"}, {"a": "2.25"}]),
+        _metadata.from_dicts([{"a": "3", "c": datetime.datetime(2022, 3, 7, 6)}, {"a": "x"}]),
+        _metadata.from_dicts([{"a": "4.125", "b": "2022-03-07 06:00:06.000000 UTC"}]),
+    ]
+    meta = _metadata.combine(parts, "columnar")
+
+    # check that the original values are given back
+    assert meta.to_records() == [
+        {"a": "1.50", "b": "2022-03-07 06:00:00.000000 UTC"},
+        {"a": "2.25"},
+        {"a": "3", "c": datetime.datetime(2022, 3, 7, 6)},
+        {"a": "x"},
+        {"a": "4.125", "b": "2022-03-07 06:00:06.000000 UTC"},
+    ]
+    assert meta["a"].dtype.kind == "U"
+    assert meta["b"].dtype == np.dtype("datetime64[us]")
+    assert meta["c"].dtype == np.dtype("datetime64[us]")
+    assert np.ma.count(meta["b"]) == 2
+
+
+@pytest.mark.nir
+def test_read_metadata_format_invalid():
+    with pytest.raises(ValueError):
+        trex_imager_readfile.read_nir("%s/%s" % (DATA_DIR, "20220307_0600_gill_nir-216_8446.pgm.gz"), metadata_format="records")
+
+
+@pytest.mark.nir
+@pytest.mark.parametrize("workers", [1, 2])
+def test_read_metadata_format_typed(workers):
+    # build file list
+    file_list = []
+    for f in ["20220307_0600_gill_nir-216_8446.pgm.gz", "20220307_0605_gill_nir-216_8446.pgm", "20220307_0601_gill_nir-216_8446.pgm.gz"]:
+        file_list.append("%s/%s" % (DATA_DIR, f))
+
+    # read files, with typed metadata
+    _, meta, _ = trex_imager_readfile.read_nir(file_list, workers=workers)
+    _, meta_typed, problematic_files = trex_imager_readfile.read_nir(file_list, workers=workers, metadata_format="typed")
+    meta_only, _ = trex_imager_readfile.read_nir_metadata(file_list, workers=workers, metadata_format="typed")
+
+    # check that the original values are given back
+    assert len(problematic_files) == 0
+    assert meta_typed.to_records() == meta
+    assert meta_only.to_records() == meta
+
+    # check that the units were split off
+    assert meta_typed["Exposure plus readout"].dtype == np.float64
+    assert meta_typed["Exposure plus readout"][0] == 5001.0
+    assert meta_typed["Current CCD temperature"].dtype == np.float64
+    assert meta_typed["Current CCD temperature"][0] == -64.0
+    assert meta_typed["CCD xsize"].dtype == np.int64
+    assert meta_typed["Image request start"].dtype == np.dtype("datetime64[us]")
+    assert meta_typed.units["Exposure plus readout"] == "ms"
+    assert meta_typed.units["Current CCD temperature"] == "C"
+    assert meta_typed.units["CCD xsize"] == "pixels"
+    assert "Exposure Options" not in meta_typed.units
+
+    # check that identifiers that look like numbers are kept as strings
+    assert meta_typed["Mode unique ID"].dtype.kind == "U"
+    assert meta_typed["Lens Serial Number"].dtype.kind == "U"
+
+
+@pytest.mark.nir
+def test_metadata_format_typed_inconsistent_values():
+    # known numeric fields have the same dtype whatever their values, and give back the
+    # original values even when they're written differently, or aren't numbers at all
+    from trex_imager_readfile import _metadata
+    meta = _metadata.combine([
+        _metadata.from_dicts([
+            {"Current CCD temperature": "-64C", "Exposure plus readout": "5.470 ms", "NTP jitter": "1.50", "Mode sequence number": "-0"},
+            {"Current CCD temperature": "-0.4400 C", "Exposure plus readout": "5.47 ms", "NTP jitter": "x", "Mode sequence number": "2"},
+        ], typed=True),
+        _metadata.from_dicts([{"Exposure plus readout": "7.000 ms", "NTP jitter": "2.25", "Mode sequence number": "3", "a": "4"}], typed=True),
+    ], "typed")
+    assert meta.to_records() == [
+        {"Current CCD temperature": "-64C", "Exposure plus readout": "5.470 ms", "NTP jitter": "1.50", "Mode sequence number": "-0"},
+        {"Current CCD temperature": "-0.4400 C", "Exposure plus readout": "5.47 ms", "NTP jitter": "x", "Mode sequence number": "2"},
+        {"Exposure plus readout": "7.000 ms", "NTP jitter": "2.25", "Mode sequence number": "3", "a": "4"},
+    ]
+    assert meta["Current CCD temperature"].dtype == np.float64
+    assert meta["Exposure plus readout"].dtype == np.float64
+    assert np.array_equal(meta["Exposure plus readout"], [5.47, 5.47, 7.0])
+    assert meta["NTP jitter"].dtype == np.float64
+    assert "NTP jitter" not in meta.row(1)
+    assert meta["Mode sequence number"].dtype == np.int64
+    assert meta["a"].dtype.kind == "U"
+    assert meta.units == {"Current CCD temperature": "C", "Exposure plus readout": "ms"}
+
+
+@pytest.mark.nir
+@pytest.mark.parametrize("test_dict", [
+    {
+        "workers": 1,
+        "backend": "thread",
+    },
+    {
+        "workers": 2,
+        "backend": "process",
+    },
+])
+def test_read_metadata_format_compact(test_dict):
+    # build file list
+    file_list = []
+    for f in ["20220307_0600_gill_nir-216_8446.pgm.gz", "20220307_0605_gill_nir-216_8446.pgm", "20220307_0601_gill_nir-216_8446.pgm.gz"]:
+        file_list.append("%s/%s" % (DATA_DIR, f))
+
+    # read files, with compact metadata
+    _, meta, _ = trex_imager_readfile.read_nir(file_list, workers=test_dict["workers"], backend=test_dict["backend"])
+    _, meta_compact, problematic_files = trex_imager_readfile.read_nir(
+        file_list,
+        workers=test_dict["workers"],
+        backend=test_dict["backend"],
+        metadata_format="compact",
+    )
+    meta_only, _ = trex_imager_readfile.read_nir_metadata(
+        file_list,
+        workers=test_dict["workers"],
+        backend=test_dict["backend"],
+        metadata_format="compact",
+    )
+
+    # check that each frame behaves like its dictionary
+    assert len(problematic_files) == 0
+    assert isinstance(meta_compact, list) is True
+    assert meta_compact == meta
+    assert meta_only == meta
+    for i in range(0, len(meta)):
+        assert isinstance(meta_compact[i], trex_imager_readfile.FrameMetadata) is True
+        assert list(meta_compact[i].items()) == list(meta[i].items())
+        assert dict(meta_compact[i]) == meta[i]
+        assert meta_compact[i].get("Not a field") is None
+        assert ("Image request start" in meta_compact[i]) is True
+
+    # check that changing a frame leaves the others as they were
+    meta_compact[1]["Site unique ID"] = "fsmi"
+    del meta_compact[1]["Imager unique ID"]
+    assert meta_compact[1]["Site unique ID"] == "fsmi"
+    assert "Imager unique ID" not in meta_compact[1]
+    assert meta_compact[2] == meta[2]
+
+
+@pytest.mark.nir
+def test_metadata_format_compact_shared_values():
+    # file attributes copied into every frame are kept once, whatever their type
+    from trex_imager_readfile import _metadata
+    file_attributes = {"site": "gill", "position": np.array([56.37, -94.64])}
+    metadata_dict_list = []
+    for i in range(0, 3):
+        metadata_dict = file_attributes.copy()
+        metadata_dict["timestamp"] = "2022-03-07 06:00:0%d.000000 UTC" % (i)
+        metadata_dict["ccd_temp"] = np.float32(-64.0)
+        metadata_dict["counts"] = np.array([i])
+        metadata_dict_list.append(metadata_dict)
+    meta = _metadata.combine([_metadata.convert(metadata_dict_list, "compact")], "compact")
+    assert len(meta) == 3
+    assert [list(m.keys()) for m in meta] == [list(m.keys()) for m in metadata_dict_list]
+    assert meta[2]["timestamp"] == "2022-03-07 06:00:02.000000 UTC"
+    assert meta[2]["position"] is file_attributes["position"]
+    assert meta[2]["ccd_temp"] == np.float32(-64.0)
+    assert meta[2]["counts"][0] == 2
+    assert len(meta[2]._values) == 2
+
+
+@pytest.mark.nir
+@pytest.mark.parametrize("test_dict", [
+    {
+        "workers": 1,
+        "backend": "thread",
+        "pipeline": False,
+    },
+    {
+        "workers": 2,
+        "backend": "process",
+        "pipeline": False,
+    },
+    {
+        "workers": 1,
+        "backend": "thread",
+        "pipeline": True,
+    },
+])
+def test_read_metadata_format_lazy(test_dict):
+    # build file list
+    file_list = []
+    for f in ["20220307_0600_gill_nir-216_8446.pgm.gz", "20220307_0605_gill_nir-216_8446.pgm", "20220307_0601_gill_nir-216_8446.pgm.gz"]:
+        file_list.append("%s/%s" % (DATA_DIR, f))
+
+    # read files, with lazy metadata
+    _, meta, _ = trex_imager_readfile.read_nir(file_list, workers=test_dict["workers"], backend=test_dict["backend"])
+    _, meta_lazy, problematic_files = trex_imager_readfile.read_nir(
+        file_list,
+        workers=test_dict["workers"],
+        backend=test_dict["backend"],
+        pipeline=test_dict["pipeline"],
+        metadata_format="lazy",
+    )
+    meta_only, _ = trex_imager_readfile.read_nir_metadata(
+        file_list,
+        workers=test_dict["workers"],
+        backend=test_dict["backend"],
+        metadata_format="lazy",
+    )
+
+    # check that nothing is decoded until it's used
+    assert len(problematic_files) == 0
+    assert len(meta_lazy) == len(meta)
+    for i in range(0, len(meta)):
+        assert isinstance(meta_lazy[i], trex_imager_readfile.LazyMetadata) is True
+        assert meta_lazy[i].decoded is False
+        assert meta_only[i].decoded is False
+    assert meta_lazy[12]["Image request start"] == meta[12]["Image request start"]
+    assert meta_lazy[12].decoded is True
+    assert meta_lazy[13].decoded is False
+
+    # check that each frame behaves like its dictionary
+    for i in range(0, len(meta)):
+        assert list(meta_lazy[i].items()) == list(meta[i].items())
+        assert list(meta_only[i].items()) == list(meta[i].items())
+        assert meta_lazy[i] == meta[i]
+    meta_lazy[1]["Site unique ID"] = "fsmi"
+    assert meta_lazy[1]["Site unique ID"] == "fsmi"
+    assert dict(meta_lazy[1]) != meta[1]
+
+
+@pytest.mark.nir
+@pytest.mark.parametrize("duplicates_as_list", [False, True])
+def test_read_metadata_format_lazy_carried_uids(tmp_path, duplicates_as_list):
+    # the site and device UIDs carried forward from frame to frame are the same as when
+    # each frame is decoded as it's read
+    from trex_imager_readfile import _pgm
+    filename = "%s/20220307_0600_gill_nir-216_8446.pgm" % (tmp_path)
+    with open(filename, "wb") as fp:
+        for header in [
+            b'#"Project unique ID" trex\n#"Site unique ID" gill\n#"Imager unique ID" nir-216\n',
+            b'#"Exposure plus readout" 5001.0000 ms\n',
+            b'#"Exposure plus readout" 5002.0000 ms\n#"Site unique ID" fsmi\n#"Site unique ID" rabb\n',
+            b'#"Exposure plus readout" 5003.0000 ms\n',
+            b'#"Lens" f/1.4 \xc2\xb5m\n',
+        ]:
+            fp.write(b"P5\n" + header + b"#\n2 2\n65535\n" + b"\x00\x01" * 4)
+    for frames in [None, [1, 3]]:
+        meta, problematic, error_message, _ = _pgm.read_metadata(
+            filename,
+            site_uid="gill",
+            device_uid="nir-216",
+            frames=frames,
+            quiet=True,
+            duplicates_as_list=duplicates_as_list,
+        )
+        meta_lazy, problematic_lazy, error_message_lazy, _ = _pgm.read_metadata(
+            filename,
+            site_uid="gill",
+            device_uid="nir-216",
+            frames=frames,
+            quiet=True,
+            duplicates_as_list=duplicates_as_list,
+            lazy_metadata=True,
+        )
+        assert problematic_lazy == problematic
+        assert error_message_lazy == error_message
+        assert [list(m.items()) for m in meta_lazy] == [list(m.items()) for m in meta]
+
+
+@pytest.mark.nir
+@pytest.mark.parametrize("read_function", ["read_nir", "read_nir_metadata"])
+def test_read_unusual_metadata_lines(tmp_path, read_function):
+    # comment lines in amongst the metadata lines are skipped, and lines that aren't ASCII are reported
+    def write_file(filename, frame_headers):
+        with open(filename, "wb") as fp:
+            for header in frame_headers:
+                fp.write(b"P5\n" + header + b"#\n2 2\n65535\n" + b"\x00\x01" * 4)
+
+    def read_file(filename):
+        if (read_function == "read_nir"):
+            _, meta, problematic_files = trex_imager_readfile.read_nir(filename, quiet=True)
+        else:
+            meta, problematic_files = trex_imager_readfile.read_nir_metadata(filename, quiet=True)
+        return meta, problematic_files
+
+    # comment lines in amongst the metadata lines
+    filename = "%s/20220307_0600_gill_nir-216_8446.pgm" % (tmp_path)
+    write_file(filename, [
+        b'#"Site unique ID" gill\n#"Imager unique ID" nir-216\n#"Exposure plus readout" 5001.0000 ms \n',
+        b'#"Site unique ID" gill\n# comment\n#"Imager unique ID" nir-216\n#\n#"Exposure plus readout" 5002.0000 ms \n',
+    ])
+    meta, problematic_files = read_file(filename)
+    assert len(problematic_files) == 0
+    assert meta == [
+        {"Site unique ID": "gill", "Imager unique ID": "nir-216", "Exposure plus readout": "5001.0000 ms"},
+        {"Site unique ID": "gill", "Imager unique ID": "nir-216", "Exposure plus readout": "5002.0000 ms"},
+    ]
+
+    # a line that isn't ASCII in the last frame
+    filename = "%s/20220307_0601_gill_nir-216_8446.pgm" % (tmp_path)
+    write_file(filename, [
+        b'#"Site unique ID" gill\n#"Imager unique ID" nir-216\n',
+        b'#"Site unique ID" gill\n#"Imager unique ID" nir-216\n#"Lens" f/1.4 \xc2\xb5m\n',
+    ])
+    meta, problematic_files = read_file(filename)
+    assert len(problematic_files) == 1
+    assert "error decoding metadata line" in problematic_files[0]["error_message"]
@@ -466,3 +466,86 @@ def test_read_first_frame_and_no_metadata(test_dict):
 
     # check dtype
     assert img.dtype == np.uint8
+
+
+@pytest.mark.rgb
+@pytest.mark.parametrize("test_dict", [
+    {
+        "frames": slice(0, 3),
+        "expected_indices": [0, 1, 2],
+    },
+    {
+        "frames": slice(None, None, 3),
+        "expected_indices": [0, 3, 6, 9, 12, 15, 18],
+    },
+    {
+        "frames": [19, 1, 1],
+        "expected_indices": [19, 1, 1],
+    },
+    {
+        "frames": -1,
+        "expected_indices": [19],
+    },
+    {
+        "frames": [0, 100],
+        "expected_indices": [0],
+    },
+])
+def test_read_frames(test_dict):
+    # build file list
+    file_list = []
+    for f in ["20210205_0600_gill_rgb-04_full.h5"]:
+        file_list.append("%s/%s" % (DATA_DIR, f))
+
+    # read all frames, and only the selected frames
+    for filename in file_list:
+        img, meta, _ = trex_imager_readfile.read_rgb(filename)
+        img_frames, meta_frames, problematic_files = trex_imager_readfile.read_rgb(filename, frames=test_dict["frames"])
+
+        # check that the selected frames were read
+        assert len(problematic_files) == 0
+        assert np.array_equal(img_frames, img[..., test_dict["expected_indices"]])
+        assert len(meta_frames) == len(test_dict["expected_indices"])
+
+
+@pytest.mark.rgb
+@pytest.mark.parametrize("output_dtype", ["uint8", "uint16", "float32"])
+def test_read_output_dtype(output_dtype):
+    # read a file in its own dtype, and converted to the output dtype
+    filename = "%s/%s" % (DATA_DIR, "20210205_0600_gill_rgb-04_full.h5")
+    img, meta, _ = trex_imager_readfile.read_rgb(filename)
+    img_converted, meta_converted, problematic_files = trex_imager_readfile.read_rgb(filename, output_dtype=output_dtype)
+
+    # check that the images were converted, keeping their values
+    assert len(problematic_files) == 0
+    assert img_converted.dtype == np.dtype(output_dtype)
+    assert np.array_equal(img_converted, img.astype(output_dtype))
+    assert len(meta_converted) == len(meta)
+
+
+@pytest.mark.rgb
+@pytest.mark.parametrize("read_function", ["read_rgb", "read_rgb_metadata"])
+def test_read_metadata_format_lazy(tmp_path, read_function):
+    # write a small file, with duplicate fields and the site UID in its headers
+    filename = "%s/20200508_0600_gill_rgb-04_full.pgm" % (tmp_path)
+    with open(filename, "wb") as fp:
+        for i in range(0, 3):
+            fp.write(b"P5\n")
+            fp.write(b'#"Site unique ID" gill\n' if i == 0 else b"")
+            fp.write(b'#"Image request start" 2020-05-08 06:00:0%d.000000 UTC\n#"Mode" a\n#"Mode" b\n#\n' % (i))
+            fp.write(b"2 2\n65535\n" + b"\x00\x01" * 4)
+
+    # read file
+    if (read_function == "read_rgb"):
+        _, meta, _ = trex_imager_readfile.read_rgb(filename)
+        _, meta_lazy, problematic_files = trex_imager_readfile.read_rgb(filename, metadata_format="lazy")
+    else:
+        meta, _ = trex_imager_readfile.read_rgb_metadata(filename)
+        meta_lazy, problematic_files = trex_imager_readfile.read_rgb_metadata(filename, metadata_format="lazy")
+
+    # check that nothing is decoded until it's used, and that it's the same once it is
+    assert len(problematic_files) == 0
+    assert len(meta_lazy) == 3
+    assert [m.decoded for m in meta_lazy] == [False, False, False]
+    assert [dict(m) for m in meta_lazy] == meta
+    assert meta_lazy[1]["Mode"] == ["a", "b"]
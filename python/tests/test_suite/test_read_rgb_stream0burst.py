@@ -448,3 +448,211 @@ def test_read_first_frame_and_no_metadata(test_dict):
 
     # check dtype
     assert img.dtype == np.uint8
+
+
+@pytest.mark.rgb
+@pytest.mark.parametrize("test_dict", [
+    {
+        "frames": slice(0, 3),
+        "expected_indices": [0, 1, 2],
+    },
+    {
+        "frames": slice(None, None, 3),
+        "expected_indices": list(range(0, 159, 3)),
+    },
+    {
+        "frames": [158, 1, 1],
+        "expected_indices": [158, 1, 1],
+    },
+    {
+        "frames": -1,
+        "expected_indices": [158],
+    },
+    {
+        "frames": [0, 100],
+        "expected_indices": [0],
+    },
+])
+def test_read_frames(test_dict):
+    # build file list
+    file_list = []
+    for f in ["20211030_0601_gill_rgb-04_burst.png.tar"]:
+        file_list.append("%s/%s" % (DATA_DIR, f))
+
+    # read all frames, and only the selected frames
+    for filename in file_list:
+        img, meta, _ = trex_imager_readfile.read_rgb(filename)
+        img_frames, meta_frames, problematic_files = trex_imager_readfile.read_rgb(filename, frames=test_dict["frames"])
+
+        # check that the selected frames were read
+        assert len(problematic_files) == 0
+        assert np.array_equal(img_frames, img[..., test_dict["expected_indices"]])
+        assert meta_frames == [meta[i] for i in test_dict["expected_indices"]]
+
+
+@pytest.mark.rgb
+def test_read_time_window():
+    # read all frames
+    filename = "%s/%s" % (DATA_DIR, "20211030_0601_gill_rgb-04_burst.png.tar")
+    img, meta, _ = trex_imager_readfile.read_rgb(filename)
+
+    # read only the frames in a time window, taken from the frame timestamps
+    start = meta[2]["Image request start"]
+    end = meta[5]["Image request start"]
+    img_window, meta_window, problematic_files = trex_imager_readfile.read_rgb(filename, start=start, end=end)
+
+    # check that the frames in the time window were read
+    assert len(problematic_files) == 0
+    assert np.array_equal(img_window, img[..., 2:5])
+    assert meta_window == meta[2:5]
+
+
+@pytest.mark.rgb
+@pytest.mark.parametrize("test_dict", [
+    {
+        "workers": 1,
+        "first_frame": False,
+        "frames": None,
+    },
+    {
+        "workers": 2,
+        "first_frame": False,
+        "frames": None,
+    },
+    {
+        "workers": 1,
+        "first_frame": True,
+        "frames": None,
+    },
+    {
+        "workers": 1,
+        "first_frame": False,
+        "frames": [0, -1],
+    },
+])
+def test_read_metadata(test_dict):
+    # build file list
+    file_list = []
+    for f in ["20211030_0600_gill_rgb-04_burst.png.tar", "20211030_0601_gill_rgb-04_burst.png.tar"]:
+        file_list.append("%s/%s" % (DATA_DIR, f))
+
+    # read files, and only their metadata
+    _, meta, problematic_files = trex_imager_readfile.read_rgb(
+        file_list,
+        workers=test_dict["workers"],
+        first_frame=test_dict["first_frame"],
+        frames=test_dict["frames"],
+    )
+    meta_only, problematic_files_only = trex_imager_readfile.read_rgb_metadata(
+        file_list,
+        workers=test_dict["workers"],
+        first_frame=test_dict["first_frame"],
+        frames=test_dict["frames"],
+    )
+
+    # check that the metadata is identical
+    assert len(problematic_files_only) == 0
+    assert problematic_files_only == problematic_files
+    assert meta_only == meta
+
+
+@pytest.mark.rgb
+@pytest.mark.parametrize("backend", ["auto", "process", "thread"])
+def test_read_backend(backend):
+    # build file list
+    file_list = []
+    for f in ["20211030_0600_gill_rgb-04_burst.png.tar", "20211030_0601_gill_rgb-04_burst.png.tar"]:
+        file_list.append("%s/%s" % (DATA_DIR, f))
+
+    # read with a single worker, and with multiple workers using the backend
+    img, meta, _ = trex_imager_readfile.read_rgb(file_list)
+    img_backend, meta_backend, problematic_files = trex_imager_readfile.read_rgb(file_list, workers=2, backend=backend)
+
+    # check that the results are identical
+    assert len(problematic_files) == 0
+    assert img_backend.dtype == img.dtype
+    assert np.array_equal(img_backend, img)
+    assert meta_backend == meta
+
+
+@pytest.mark.rgb
+@pytest.mark.parametrize("test_dict", [
+    {
+        "png_threads": 2,
+        "workers": 1,
+        "frames": None,
+    },
+    {
+        "png_threads": 4,
+        "workers": 1,
+        "frames": slice(0, None, 3),
+    },
+    {
+        "png_threads": None,
+        "workers": 4,
+        "frames": None,
+    },
+])
+def test_read_png_threads(test_dict):
+    # read a single file one frame at a time, and with its frames split between threads
+    filename = "%s/%s" % (DATA_DIR, "20211030_0600_gill_rgb-04_burst.png.tar")
+    img, meta, _ = trex_imager_readfile.read_rgb(filename, png_threads=1, frames=test_dict["frames"])
+    img_threads, meta_threads, problematic_files = trex_imager_readfile.read_rgb(
+        filename,
+        workers=test_dict["workers"],
+        png_threads=test_dict["png_threads"],
+        frames=test_dict["frames"],
+    )
+
+    # check that the results are identical
+    assert len(problematic_files) == 0
+    assert np.array_equal(img_threads, img)
+    assert meta_threads == meta
+
+
+@pytest.mark.rgb
+@pytest.mark.parametrize("test_dict", [
+    {
+        "workers": 8,
+        "cpus": 8,
+        "num_files": 1,
+        "expected_png_threads": 8,  # one file decoded by all of the workers
+    },
+    {
+        "workers": 8,
+        "cpus": 8,
+        "num_files": 16,
+        "expected_png_threads": 1,  # every worker busy with a file of its own
+    },
+    {
+        "workers": 4,
+        "cpus": 4,
+        "num_files": 2,
+        "expected_png_threads": 2,
+    },
+    {
+        "workers": 4,
+        "cpus": 16,
+        "num_files": 16,
+        "expected_png_threads": 4,  # workers="auto", CPUs split between the workers
+    },
+    {
+        "workers": 1,
+        "cpus": 8,
+        "num_files": 3,
+        "expected_png_threads": 8,  # workers="auto", only room for one worker
+    },
+])
+def test_png_threads_default(test_dict):
+    from trex_imager_readfile import rgb
+    file_list = ["%s/%s" % (DATA_DIR, "20211030_0600_gill_rgb-04_burst.png.tar")] * test_dict["num_files"]
+    png_threads = getattr(rgb, "__png_threads")(None, test_dict["workers"], test_dict["cpus"], file_list)
+    assert png_threads == test_dict["expected_png_threads"]
+
+
+@pytest.mark.rgb
+def test_read_png_threads_invalid():
+    with pytest.raises(ValueError):
+        trex_imager_readfile.read_rgb("%s/%s" % (DATA_DIR, "20211030_0600_gill_rgb-04_burst.png.tar"), png_threads=0)
+    with pytest.raises(TypeError):
+        trex_imager_readfile.read_rgb("%s/%s" % (DATA_DIR, "20211030_0600_gill_rgb-04_burst.png.tar"), png_threads="4")
@@ -525,3 +525,28 @@ def test_read_first_frame_and_no_metadata(test_dict):
 
     # check dtype
     assert img.dtype == np.uint8
+
+
+@pytest.mark.rgb
+@pytest.mark.parametrize("test_dict", [
+    {
+        "output_dtype": "int8",
+        "expected_success": False,
+    },
+    {
+        "output_dtype": "int16",
+        "expected_success": True,
+    },
+])
+def test_read_output_dtype_range(test_dict):
+    # integer dtypes that would wrap the 8-bit pixel values around aren't allowed
+    filename = "%s/%s" % (DATA_DIR, "20200508_060500_122643_gill_rgb-04_320ms_full.png")
+    if (test_dict["expected_success"] is False):
+        with pytest.raises(ValueError):
+            trex_imager_readfile.read_rgb(filename, output_dtype=test_dict["output_dtype"])
+    else:
+        img, _, _ = trex_imager_readfile.read_rgb(filename)
+        img_converted, _, problematic_files = trex_imager_readfile.read_rgb(filename, output_dtype=test_dict["output_dtype"])
+        assert len(problematic_files) == 0
+        assert img_converted.dtype == np.dtype(test_dict["output_dtype"])
+        assert np.array_equal(img_converted, img.astype(np.int16))
@@ -1,4 +1,7 @@
 import os
+import asyncio
+import logging
+import datetime
 import pytest
 import numpy as np
 import trex_imager_readfile
@@ -507,3 +510,414 @@ def test_read_first_frame_and_no_metadata(test_dict):
 
     # check dtype
     assert img.dtype == np.uint16
+
+
+@pytest.mark.spectrograph
+@pytest.mark.parametrize("test_dict", [
+    {
+        "filenames": [
+            "20230503_0605_luck_spect-02_spectra.pgm",
+        ],
+        "workers": 1,
+        "first_frame": False,
+    },
+    {
+        "filenames": [
+            "20230503_0605_luck_spect-02_spectra.pgm",
+        ],
+        "workers": 1,
+        "first_frame": True,
+    },
+    {
+        "filenames": [
+            "20230503_0600_luck_spect-02_spectra.pgm.gz",
+            "20230503_0605_luck_spect-02_spectra.pgm",
+        ],
+        "workers": 2,
+        "first_frame": False,
+    },
+])
+def test_read_mmap(test_dict):
+    # build file list
+    file_list = []
+    for f in test_dict["filenames"]:
+        file_list.append("%s/%s" % (DATA_DIR, f))
+
+    # read files with and without memory mapping
+    img, meta, problematic_files = trex_imager_readfile.read_spectrograph(
+        file_list,
+        workers=test_dict["workers"],
+        first_frame=test_dict["first_frame"],
+    )
+    img_mmap, meta_mmap, problematic_files_mmap = trex_imager_readfile.read_spectrograph(
+        file_list,
+        workers=test_dict["workers"],
+        first_frame=test_dict["first_frame"],
+        mmap=True,
+    )
+
+    # check that the results are identical
+    assert len(problematic_files_mmap) == 0
+    assert img_mmap.dtype == np.uint16
+    assert np.array_equal(img_mmap, img)
+    assert meta_mmap == meta
+
+
+@pytest.mark.spectrograph
+def test_open_mmap():
+    # read file normally for comparison
+    filename = "%s/20230503_0605_luck_spect-02_spectra.pgm" % (DATA_DIR)
+    img, meta, _ = trex_imager_readfile.read_spectrograph(filename)
+
+    # open file with memory mapping
+    with trex_imager_readfile.spectrograph.open_mmap(filename) as mapped_file:
+        assert len(mapped_file) == 4
+        assert mapped_file.problematic is False
+        for i in range(0, len(mapped_file)):
+            assert mapped_file[i].shape == (1024, 256)
+            assert np.array_equal(mapped_file[i], img[:, :, i])
+        assert mapped_file.frame(-1, native=True).dtype == np.uint16
+        assert np.array_equal(mapped_file.frame(-1, native=True), img[:, :, -1])
+        assert mapped_file.metadata == meta
+
+        # frames stay valid after the file is closed
+        frame = mapped_file[0]
+    assert np.array_equal(frame, img[:, :, 0])
+
+
+@pytest.mark.spectrograph
+def test_open_mmap_compressed_file():
+    with pytest.raises(ValueError):
+        trex_imager_readfile.spectrograph.open_mmap("%s/20230503_0600_luck_spect-02_spectra.pgm.gz" % (DATA_DIR))
+
+
+@pytest.mark.spectrograph
+@pytest.mark.parametrize("test_dict", [
+    {
+        "workers": 1,
+        "first_frame": False,
+    },
+    {
+        "workers": 1,
+        "first_frame": True,
+    },
+    {
+        "workers": 2,
+        "first_frame": False,
+    },
+])
+def test_read_gzip_index(tmp_path, test_dict):
+    # build file list
+    file_list = []
+    for f in ["20230503_0600_luck_spect-02_spectra.pgm.gz", "20230503_0601_luck_spect-02_spectra.pgm.gz", "20230503_0605_luck_spect-02_spectra.pgm"]:
+        file_list.append("%s/%s" % (DATA_DIR, f))
+
+    # read files without and with gzip indexes, twice so that the second read uses the saved indexes
+    img, meta, _ = trex_imager_readfile.read_spectrograph(file_list, workers=test_dict["workers"], first_frame=test_dict["first_frame"])
+    for _ in range(0, 2):
+        img_indexed, meta_indexed, problematic_files_indexed = trex_imager_readfile.read_spectrograph(
+            file_list,
+            workers=test_dict["workers"],
+            first_frame=test_dict["first_frame"],
+            gzip_index=str(tmp_path),
+        )
+
+        # check that the results are identical
+        assert len(problematic_files_indexed) == 0
+        assert img_indexed.dtype == np.uint16
+        assert np.array_equal(img_indexed, img)
+        assert meta_indexed == meta
+
+    # check that the indexes were saved
+    assert sorted(os.listdir(tmp_path)) == ["20230503_0600_luck_spect-02_spectra.pgm.gz.idx", "20230503_0601_luck_spect-02_spectra.pgm.gz.idx"]
+
+
+@pytest.mark.spectrograph
+def test_open_indexed(tmp_path):
+    # read file normally for comparison
+    filename = "%s/20230503_0600_luck_spect-02_spectra.pgm.gz" % (DATA_DIR)
+    img, meta, _ = trex_imager_readfile.read_spectrograph(filename)
+
+    # open file using a gzip index, building it and then using the saved one
+    for _ in range(0, 2):
+        with trex_imager_readfile.spectrograph.open_indexed(filename, index_dir=str(tmp_path)) as indexed_file:
+            assert len(indexed_file) == 4
+            assert indexed_file.problematic is False
+            for i in reversed(range(0, len(indexed_file))):
+                assert indexed_file[i].shape == (1024, 256)
+                assert indexed_file[i].dtype == np.uint16
+                assert np.array_equal(indexed_file[i], img[:, :, i])
+                assert indexed_file.frame_metadata(i) == meta[i]
+
+
+@pytest.mark.spectrograph
+def test_open_indexed_uncompressed_file():
+    with pytest.raises(ValueError):
+        trex_imager_readfile.spectrograph.open_indexed("%s/20230503_0605_luck_spect-02_spectra.pgm" % (DATA_DIR))
+
+
+@pytest.mark.spectrograph
+@pytest.mark.parametrize("test_dict", [
+    {
+        "frames": slice(0, 3),
+        "expected_indices": [0, 1, 2],
+    },
+    {
+        "frames": slice(None, None, 3),
+        "expected_indices": [0, 3],
+    },
+    {
+        "frames": [3, 1, 1],
+        "expected_indices": [3, 1, 1],
+    },
+    {
+        "frames": -1,
+        "expected_indices": [3],
+    },
+    {
+        "frames": [0, 100],
+        "expected_indices": [0],
+    },
+])
+def test_read_frames(test_dict):
+    # build file list
+    file_list = []
+    for f in ["20230503_0600_luck_spect-02_spectra.pgm.gz", "20230503_0605_luck_spect-02_spectra.pgm"]:
+        file_list.append("%s/%s" % (DATA_DIR, f))
+
+    # read all frames, and only the selected frames
+    for filename in file_list:
+        img, meta, _ = trex_imager_readfile.read_spectrograph(filename)
+        img_frames, meta_frames, problematic_files = trex_imager_readfile.read_spectrograph(filename, frames=test_dict["frames"])
+
+        # check that the selected frames were read
+        assert len(problematic_files) == 0
+        assert np.array_equal(img_frames, img[..., test_dict["expected_indices"]])
+        assert meta_frames == [meta[i] for i in test_dict["expected_indices"]]
+
+
+@pytest.mark.spectrograph
+@pytest.mark.parametrize("test_dict", [
+    {
+        "start": datetime.datetime(2023, 5, 3, 6, 0, 30),
+        "end": datetime.datetime(2023, 5, 3, 6, 1, 30),
+        "expected_indices": [2, 3, 4, 5],
+    },
+    {
+        "start": None,
+        "end": datetime.datetime(2023, 5, 3, 6, 0, 0),
+        "expected_indices": [],
+    },
+    {
+        "start": datetime.datetime(2023, 5, 3, 6, 2, 0),
+        "end": None,
+        "expected_indices": [8, 9, 10, 11],
+    },
+])
+@pytest.mark.parametrize("gzip_index", [False, True])
+def test_read_time_window(tmp_path, test_dict, gzip_index):
+    # build file list
+    file_list = []
+    for f in ["0600", "0601", "0602"]:
+        file_list.append("%s/20230503_%s_luck_spect-02_spectra.pgm.gz" % (DATA_DIR, f))
+
+    # read all frames, and only the frames in the time window
+    img, meta, _ = trex_imager_readfile.read_spectrograph(file_list)
+    img_window, meta_window, problematic_files = trex_imager_readfile.read_spectrograph(
+        file_list,
+        gzip_index=str(tmp_path) if gzip_index is True else False,
+        start=test_dict["start"],
+        end=test_dict["end"],
+    )
+
+    # check that the frames in the time window were read
+    assert len(problematic_files) == 0
+    assert np.array_equal(img_window, img[..., test_dict["expected_indices"]])
+    assert meta_window == [meta[i] for i in test_dict["expected_indices"]]
+
+
+@pytest.mark.spectrograph
+@pytest.mark.parametrize("test_dict", [
+    {
+        "workers": 1,
+        "first_frame": False,
+        "frames": None,
+    },
+    {
+        "workers": 2,
+        "first_frame": False,
+        "frames": None,
+    },
+    {
+        "workers": 1,
+        "first_frame": True,
+        "frames": None,
+    },
+    {
+        "workers": 1,
+        "first_frame": False,
+        "frames": [0, -1],
+    },
+])
+def test_read_metadata(test_dict):
+    # build file list
+    file_list = []
+    for f in ["20230503_0600_luck_spect-02_spectra.pgm.gz", "20230503_0605_luck_spect-02_spectra.pgm"]:
+        file_list.append("%s/%s" % (DATA_DIR, f))
+
+    # read files, and only their metadata
+    _, meta, problematic_files = trex_imager_readfile.read_spectrograph(
+        file_list,
+        workers=test_dict["workers"],
+        first_frame=test_dict["first_frame"],
+        frames=test_dict["frames"],
+    )
+    meta_only, problematic_files_only = trex_imager_readfile.read_spectrograph_metadata(
+        file_list,
+        workers=test_dict["workers"],
+        first_frame=test_dict["first_frame"],
+        frames=test_dict["frames"],
+    )
+
+    # check that the metadata is identical
+    assert len(problematic_files_only) == 0
+    assert problematic_files_only == problematic_files
+    assert meta_only == meta
+
+
+@pytest.mark.spectrograph
+@pytest.mark.parametrize("test_dict", [
+    {
+        "output_dtype": "uint16",
+        "expected_dtype": np.uint16,
+    },
+    {
+        "output_dtype": "float32",
+        "expected_dtype": np.float32,
+    },
+    {
+        "output_dtype": np.float16,
+        "expected_dtype": np.float16,
+    },
+    {
+        "output_dtype": "uint8",
+        "expected_dtype": np.uint8,
+    },
+])
+@pytest.mark.parametrize("workers", [1, 2])
+def test_read_output_dtype(test_dict, workers):
+    # build file list
+    file_list = []
+    for f in ["20230503_0600_luck_spect-02_spectra.pgm.gz", "20230503_0605_luck_spect-02_spectra.pgm"]:
+        file_list.append("%s/%s" % (DATA_DIR, f))
+
+    # read files in their own dtype, and converted to the output dtype
+    img, meta, _ = trex_imager_readfile.read_spectrograph(file_list)
+    img_converted, meta_converted, problematic_files = trex_imager_readfile.read_spectrograph(
+        file_list,
+        workers=workers,
+        output_dtype=test_dict["output_dtype"],
+    )
+
+    # check that the images were converted
+    #
+    # NOTE: 16-bit data is scaled down to fit in uint8
+    assert len(problematic_files) == 0
+    assert img_converted.dtype == test_dict["expected_dtype"]
+    if (test_dict["expected_dtype"] == np.uint8):
+        assert np.array_equal(img_converted, (img >> 8).astype(np.uint8))
+    else:
+        assert np.array_equal(img_converted, img.astype(test_dict["expected_dtype"]))
+    assert meta_converted == meta
+
+
+@pytest.mark.spectrograph
+@pytest.mark.parametrize("gzip_backend", ["auto"] + trex_imager_readfile.gzip_backends())
+@pytest.mark.parametrize("gzip_verify", [True, False])
+def test_read_gzip_backend(caplog, gzip_backend, gzip_verify):
+    # build file list
+    file_list = []
+    for f in ["20230503_0600_luck_spect-02_spectra.pgm.gz", "20230503_0605_luck_spect-02_spectra.pgm"]:
+        file_list.append("%s/%s" % (DATA_DIR, f))
+
+    # read files with the default backend, and the one being tested
+    img, meta, _ = trex_imager_readfile.read_spectrograph(file_list)
+    with caplog.at_level(logging.DEBUG, logger="trex_imager_readfile"):
+        img_backend, meta_backend, problematic_files = trex_imager_readfile.read_spectrograph(
+            file_list,
+            gzip_backend=gzip_backend,
+            gzip_verify=gzip_verify,
+        )
+
+    # check that the results are identical
+    assert len(problematic_files) == 0
+    assert np.array_equal(img_backend, img)
+    assert meta_backend == meta
+
+    # check that the backend used for each compressed file was reported
+    assert len([r for r in caplog.records if r.getMessage().startswith("Decompressed")]) == 1
+
+
+@pytest.mark.spectrograph
+@pytest.mark.parametrize("backend", ["auto", "process", "thread"])
+def test_read_backend(backend):
+    # build file list
+    file_list = []
+    for f in ["20230503_0600_luck_spect-02_spectra.pgm.gz", "20230503_0601_luck_spect-02_spectra.pgm.gz"]:
+        file_list.append("%s/%s" % (DATA_DIR, f))
+
+    # read with a single worker, and with multiple workers using the backend
+    img, meta, _ = trex_imager_readfile.read_spectrograph(file_list)
+    img_backend, meta_backend, problematic_files = trex_imager_readfile.read_spectrograph(file_list, workers=2, backend=backend)
+
+    # check that the results are identical
+    assert len(problematic_files) == 0
+    assert img_backend.dtype == img.dtype
+    assert np.array_equal(img_backend, img)
+    assert meta_backend == meta
+
+
+@pytest.mark.spectrograph
+def test_aread():
+    # build file list
+    file_list = []
+    for f in ["20230503_0600_luck_spect-02_spectra.pgm.gz", "20230503_0601_luck_spect-02_spectra.pgm.gz"]:
+        file_list.append("%s/%s" % (DATA_DIR, f))
+
+    # read without blocking, and by iterating over the frames
+    async def read_async():
+        frames = []
+        async with trex_imager_readfile.aiter_spectrograph_frames(file_list) as iterator:
+            async for frame in iterator:
+                frames.append(frame)
+        return await trex_imager_readfile.aread_spectrograph(file_list), frames
+
+    img, meta, _ = trex_imager_readfile.read_spectrograph(file_list)
+    (img_async, meta_async, problematic_files), frames = asyncio.run(read_async())
+
+    # check that the results are identical
+    assert len(problematic_files) == 0
+    assert np.array_equal(img_async, img)
+    assert meta_async == meta
+    assert len(frames) == img.shape[-1]
+    for i in range(0, len(frames)):
+        assert np.array_equal(frames[i][0], img[..., i])
+        assert frames[i][1] == meta[i]
+
+
+@pytest.mark.spectrograph
+@pytest.mark.parametrize("workers", [1, 2])
+def test_read_pipeline(workers):
+    # build file list
+    file_list = []
+    for f in sorted(os.listdir(DATA_DIR)):
+        file_list.append("%s/%s" % (DATA_DIR, f))
+
+    # read files, and read them again decoding PGM.gz files as a pipeline
+    img, meta, _ = trex_imager_readfile.read_spectrograph(file_list, workers=workers)
+    img_pipeline, meta_pipeline, problematic_files = trex_imager_readfile.read_spectrograph(file_list, workers=workers, pipeline=True)
+
+    # check that the results are identical
+    assert len(problematic_files) == 0
+    assert np.array_equal(img_pipeline, img)
+    assert meta_pipeline == meta
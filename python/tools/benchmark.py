@@ -0,0 +1,240 @@
+#! /usr/bin/env python
+#
+# This script runs some simple benchmarks of the readfile
+# functions, and of the techniques they use internally.
+#
+# Usage:
+#   python tools/benchmark.py stack
+#   python tools/benchmark.py read nir tests/test_suite/data/nir/*.pgm.gz
+#   python tools/benchmark.py backends --workers 4 nir tests/test_suite/data/nir/*.pgm.gz
+#   python tools/benchmark.py schedule --workers 4 nir tests/test_suite/data/nir/*
+#   python tools/benchmark.py pipeline --cold --workers 4 nir /mnt/nfs/nir/*.pgm.gz
+
+import argparse
+import os
+import time
+import numpy as np
+import trex_imager_readfile
+
+# globals
+INSTRUMENT_READ_FUNCTIONS = {
+    "blueline": trex_imager_readfile.read_blueline,
+    "nir": trex_imager_readfile.read_nir,
+    "rgb": trex_imager_readfile.read_rgb,
+    "spectrograph": trex_imager_readfile.read_spectrograph,
+}
+
+
+def time_it(repeat, func, *args, **kwargs):
+    # run the function a few times, and return the best time
+    best = None
+    for _ in range(0, repeat):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        if (best is None or elapsed < best):
+            best = elapsed
+    return best
+
+
+def benchmark_stack(args):
+    # compare growing a stack of frames with np.dstack against copying each frame
+    # into a pre-allocated array
+    frame = np.zeros((args.height, args.width), dtype=np.uint16)
+
+    def stack_dstack(num_frames):
+        images = frame.reshape((args.height, args.width, 1))
+        for _ in range(1, num_frames):
+            images = np.dstack([images, frame.reshape((args.height, args.width, 1))])
+        return images
+
+    def stack_preallocated(num_frames):
+        images = np.empty((args.height, args.width, num_frames), dtype=frame.dtype)
+        for i in range(0, num_frames):
+            images[:, :, i] = frame
+        return images
+
+    print("Stacking %dx%d frames (best of %d)" % (args.width, args.height, args.repeat))
+    print("%8s %14s %14s %10s" % ("frames", "dstack (ms)", "prealloc (ms)", "speedup"))
+    for num_frames in args.frames:
+        dstack_time = time_it(args.repeat, stack_dstack, num_frames)
+        preallocated_time = time_it(args.repeat, stack_preallocated, num_frames)
+        print("%8d %14.2f %14.2f %9.1fx" % (num_frames, dstack_time * 1000.0, preallocated_time * 1000.0, dstack_time / preallocated_time))
+
+
+def benchmark_read(args):
+    # time a read function on a list of files
+    read_func = INSTRUMENT_READ_FUNCTIONS[args.instrument]
+    elapsed = time_it(args.repeat, read_func, args.files, workers=args.workers, backend=args.backend, quiet=True)
+    img, _, _ = read_func(args.files, workers=args.workers, backend=args.backend, quiet=True)
+    print("Read %d files (%d frames, %.1f MB) in %.3f seconds with %d worker(s) using the %s backend (best of %d)" % (
+        len(args.files),
+        img.shape[-1],
+        img.nbytes / 1024.0 / 1024.0,
+        elapsed,
+        args.workers,
+        args.backend,
+        args.repeat,
+    ))
+
+
+def benchmark_backends(args):
+    # compare worker processes to worker threads, for each instrument given
+    #
+    # NOTE: instruments and files are given as pairs, ie. "nir file1 file2 rgb file3", so
+    # that all instruments can be compared in one run
+    groups = []
+    for arg in args.files:
+        if (arg in INSTRUMENT_READ_FUNCTIONS):
+            groups.append((arg, []))
+        elif (len(groups) == 0):
+            raise ValueError("the first argument must be an instrument name")
+        else:
+            groups[-1][1].append(arg)
+
+    print("Reading with %d workers (best of %d)" % (args.workers, args.repeat))
+    print("%-14s %8s %14s %14s %10s" % ("instrument", "frames", "process (s)", "thread (s)", "speedup"))
+    for instrument, files in groups:
+        read_func = INSTRUMENT_READ_FUNCTIONS[instrument]
+        process_time = time_it(args.repeat, read_func, files, workers=args.workers, backend="process", quiet=True)
+        thread_time = time_it(args.repeat, read_func, files, workers=args.workers, backend="thread", quiet=True)
+        img, _, _ = read_func(files, workers=args.workers, quiet=True)
+        print("%-14s %8d %14.3f %14.3f %9.2fx" % (instrument, img.shape[-1], process_time, thread_time, process_time / thread_time))
+
+
+def simulate_schedule(durations, workers):
+    # get the time it takes to run tasks in the given order, each one handed to the
+    # next free worker
+    free_at = [0.0] * workers
+    for duration in durations:
+        i = free_at.index(min(free_at))
+        free_at[i] += duration
+    return max(free_at)
+
+
+def benchmark_schedule(args):
+    # compare handing files to workers in the order given with handing them out largest
+    # file first, using the time it takes to read each file on its own
+    #
+    # NOTE: the schedules are simulated from the measured times, so that the comparison
+    # doesn't depend on how many cores are free while the benchmark runs
+    read_func = INSTRUMENT_READ_FUNCTIONS[args.instrument]
+    durations = []
+    for f in args.files:
+        durations.append(time_it(args.repeat, read_func, f, quiet=True))
+    sizes = [os.path.getsize(f) for f in args.files]
+    largest_first = [durations[i] for i in sorted(range(0, len(args.files)), key=lambda i: sizes[i], reverse=True)]
+
+    print("Reading %d files (%.1f MB) with %d workers, simulated from the time to read each file (best of %d)" % (
+        len(args.files),
+        sum(sizes) / 1024.0 / 1024.0,
+        args.workers,
+        args.repeat,
+    ))
+    print("%-16s %10.3f s" % ("input order", simulate_schedule(durations, args.workers)))
+    print("%-16s %10.3f s" % ("largest first", simulate_schedule(largest_first, args.workers)))
+    print("%-16s %10.3f s" % ("ideal", sum(durations) / args.workers))
+
+
+def drop_cache(files):
+    # ask the kernel to drop any cached pages of the files, so that they're read from
+    # storage again (on NFS, this drops the client's cache of them)
+    for f in files:
+        fd = os.open(f, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def benchmark_pipeline(args):
+    # compare decoding each PGM.gz file in sequence (read, decompress, then parse and copy)
+    # with decoding it as a pipeline, where a second thread reads and decompresses while
+    # the frames that have arrived are parsed and copied
+    #
+    # NOTE: with --cold, the files are dropped from the page cache before each repetition,
+    # so the times include reading from storage (use the best of a few runs either way)
+    read_func = INSTRUMENT_READ_FUNCTIONS[args.instrument]
+    if (args.cold is True and hasattr(os, "posix_fadvise") is False):
+        raise ValueError("--cold needs os.posix_fadvise, which isn't available on this system")
+
+    def read_timed(pipeline):
+        best = None
+        for _ in range(0, args.repeat):
+            if (args.cold is True):
+                drop_cache(args.files)
+            start = time.perf_counter()
+            read_func(args.files, workers=args.workers, backend=args.backend, pipeline=pipeline, quiet=True)
+            elapsed = time.perf_counter() - start
+            if (best is None or elapsed < best):
+                best = elapsed
+        return best
+
+    sequential_time = read_timed(False)
+    pipeline_time = read_timed(True)
+    size = sum([os.path.getsize(f) for f in args.files]) / 1024.0 / 1024.0
+    print("Reading %d files (%.1f MB compressed) with %d worker(s) using the %s backend, %s cache (best of %d)" % (
+        len(args.files),
+        size,
+        args.workers,
+        args.backend,
+        "cold" if args.cold is True else "warm",
+        args.repeat,
+    ))
+    print("%-12s %10s %18s" % ("", "time (s)", "MB/s per worker"))
+    print("%-12s %10.3f %18.1f" % ("sequential", sequential_time, size / sequential_time / args.workers))
+    print("%-12s %10.3f %18.1f" % ("pipeline", pipeline_time, size / pipeline_time / args.workers))
+    print("%-12s %9.2fx" % ("speedup", sequential_time / pipeline_time))
+
+
+def main():
+    # args
+    parser = argparse.ArgumentParser(description="Benchmark the trex-imager-readfile library")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    parser_stack = subparsers.add_parser("stack", help="Compare np.dstack stacking to pre-allocated stacking")
+    parser_stack.add_argument("--width", type=int, default=256, help="Frame width, defaults to 256")
+    parser_stack.add_argument("--height", type=int, default=256, help="Frame height, defaults to 256")
+    parser_stack.add_argument("--frames", type=int, nargs="+", default=[20, 40, 60], help="Numbers of frames to stack")
+    parser_stack.add_argument("--repeat", type=int, default=3, help="Number of repetitions, defaults to 3")
+    parser_read = subparsers.add_parser("read", help="Time a read function on a list of files")
+    parser_read.add_argument("instrument", type=str, choices=sorted(INSTRUMENT_READ_FUNCTIONS.keys()), help="Instrument to read")
+    parser_read.add_argument("files", type=str, nargs="+", help="Files to read")
+    parser_read.add_argument("--workers", type=int, default=1, help="Number of workers, defaults to 1")
+    parser_read.add_argument("--backend", type=str, default="auto", choices=["auto", "process", "thread"], help="Worker backend, defaults to auto")
+    parser_read.add_argument("--repeat", type=int, default=3, help="Number of repetitions, defaults to 3")
+    parser_backends = subparsers.add_parser("backends", help="Compare worker processes to worker threads for each instrument")
+    parser_backends.add_argument("files", type=str, nargs="+", help="Instrument names, each followed by the files to read for it")
+    parser_backends.add_argument("--workers", type=int, default=4, help="Number of workers, defaults to 4")
+    parser_backends.add_argument("--repeat", type=int, default=3, help="Number of repetitions, defaults to 3")
+    parser_schedule = subparsers.add_parser("schedule", help="Compare input order to largest first scheduling of files")
+    parser_schedule.add_argument("instrument", type=str, choices=sorted(INSTRUMENT_READ_FUNCTIONS.keys()), help="Instrument to read")
+    parser_schedule.add_argument("files", type=str, nargs="+", help="Files to read")
+    parser_schedule.add_argument("--workers", type=int, default=4, help="Number of workers, defaults to 4")
+    parser_schedule.add_argument("--repeat", type=int, default=3, help="Number of repetitions, defaults to 3")
+    parser_pipeline = subparsers.add_parser("pipeline", help="Compare sequential to pipelined decoding of PGM.gz files")
+    parser_pipeline.add_argument("instrument", type=str, choices=sorted(INSTRUMENT_READ_FUNCTIONS.keys()), help="Instrument to read")
+    parser_pipeline.add_argument("files", type=str, nargs="+", help="PGM.gz files to read")
+    parser_pipeline.add_argument("--workers", type=int, default=1, help="Number of workers, defaults to 1")
+    parser_pipeline.add_argument("--backend", type=str, default="auto", choices=["auto", "process", "thread"],
+                                 help="Worker backend, defaults to auto")
+    parser_pipeline.add_argument("--cold", action="store_true", help="Drop the files from the page cache before each repetition")
+    parser_pipeline.add_argument("--repeat", type=int, default=3, help="Number of repetitions, defaults to 3")
+    args = parser.parse_args()
+
+    # run benchmark
+    if (args.benchmark == "stack"):
+        benchmark_stack(args)
+    elif (args.benchmark == "read"):
+        benchmark_read(args)
+    elif (args.benchmark == "backends"):
+        benchmark_backends(args)
+    elif (args.benchmark == "schedule"):
+        benchmark_schedule(args)
+    elif (args.benchmark == "pipeline"):
+        benchmark_pipeline(args)
+    return 0
+
+
+# -----------------
+if (__name__ == "__main__"):
+    main()
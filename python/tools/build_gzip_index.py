@@ -0,0 +1,42 @@
+#! /usr/bin/env python
+#
+# This script builds gzip indexes for a set of PGM.gz files ahead
+# of time, so that later reads of only some of their frames don't
+# have to decompress the whole file.
+#
+# Usage:
+#   python tools/build_gzip_index.py --workers 4 /path/to/data/*.pgm.gz
+
+import argparse
+import sys
+import trex_imager_readfile
+
+
+def main():
+    # args
+    parser = argparse.ArgumentParser(description="Build gzip indexes for PGM.gz files")
+    parser.add_argument("files", type=str, nargs="+", help="PGM.gz files to index")
+    parser.add_argument("--workers", type=int, default=1, help="Number of workers, defaults to 1")
+    parser.add_argument("--index-dir", type=str, default=None, help="Directory to save the indexes in, defaults to next to each file")
+    parser.add_argument("--span", type=int, default=262144, help="Uncompressed bytes between decompression checkpoints, defaults to 262144")
+    parser.add_argument("--overwrite", action="store_true", default=False, help="Rebuild indexes that already exist")
+    args = parser.parse_args()
+
+    # build indexes
+    index_file_list, problematic_file_list = trex_imager_readfile.build_gzip_index(
+        args.files,
+        workers=args.workers,
+        index_dir=args.index_dir,
+        span=args.span,
+        overwrite=args.overwrite,
+        quiet=True,
+    )
+    print("Indexed %d files" % (len(index_file_list)))
+    for p in problematic_file_list:
+        print("  %s: %s" % (p["filename"], p["error_message"]))
+    return 0 if len(problematic_file_list) == 0 else 1
+
+
+# -----------------
+if (__name__ == "__main__"):
+    sys.exit(main())
@@ -5,6 +5,25 @@ from .blueline import read as read_blueline
 from .nir import read as read_nir
 from .rgb import read as read_rgb
 from .spectrograph import read as read_spectrograph
+from .blueline import read_metadata as read_blueline_metadata
+from .nir import read_metadata as read_nir_metadata
+from .rgb import read_metadata as read_rgb_metadata
+from .spectrograph import read_metadata as read_spectrograph_metadata
+from .blueline import aread as aread_blueline
+from .nir import aread as aread_nir
+from .rgb import aread as aread_rgb
+from .spectrograph import aread as aread_spectrograph
+from .blueline import aiter_frames as aiter_blueline_frames
+from .nir import aiter_frames as aiter_nir_frames
+from .rgb import aiter_frames as aiter_rgb_frames
+from .spectrograph import aiter_frames as aiter_spectrograph_frames
+from ._aio import set_max_concurrent_reads, get_max_concurrent_reads
+from ._pgm import build_index as build_gzip_index
+from ._decompress import available as gzip_backends
+from ._metadata import ColumnarMetadata
+from ._metadata import FrameMetadata
+from ._metadata import LazyMetadata
+from .reader import Reader
 
 # module imports
 from trex_imager_readfile import blueline
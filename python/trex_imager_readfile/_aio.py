@@ -0,0 +1,174 @@
+"""
+Asynchronous (asyncio) reads
+
+The read functions block until they're done, so they're run on a pool of
+threads shared by all asynchronous reads, leaving the event loop free. The size
+of the pool is the most reads that run at once, across every event loop and
+instrument; reads over the limit wait for a thread to become free.
+
+Cancelling the task awaiting a read stops it: a read that hasn't started yet is
+dropped, and one that has gives up on its remaining files (see cancel_event of
+the read functions) and frees its thread. Unless a timeout or deadline is given,
+a read with one worker checks for cancellation between files, so it frees its
+thread once the file it's reading is finished.
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+import os
+import threading
+
+# globals
+__executor = None
+__executor_lock = threading.Lock()
+__max_concurrent_reads = os.cpu_count() or 1
+
+
+def set_max_concurrent_reads(limit):
+    """
+    Set the most asynchronous reads that can run at once (across all event loops).
+    Reads that are already running carry on, defaults to the number of CPUs
+
+    :param limit: number of reads
+    :type limit: int
+    """
+    global __executor, __max_concurrent_reads
+    if (isinstance(limit, bool) is True or isinstance(limit, int) is False):
+        raise TypeError("max concurrent reads must be an int")
+    if (limit < 1):
+        raise ValueError("max concurrent reads must be at least 1")
+    with __executor_lock:
+        __max_concurrent_reads = limit
+        if (__executor is not None):
+            # NOTE: the old executor's threads finish the reads they're running, and any
+            # queued reads, then exit
+            __executor.shutdown(wait=False)
+            __executor = None
+
+
+def get_max_concurrent_reads():
+    """
+    Get the most asynchronous reads that can run at once, see set_max_concurrent_reads()
+
+    :return: number of reads
+    :rtype: int
+    """
+    return __max_concurrent_reads
+
+
+def __get_executor():
+    global __executor
+    with __executor_lock:
+        if (__executor is None):
+            __executor = concurrent.futures.ThreadPoolExecutor(max_workers=__max_concurrent_reads, thread_name_prefix="trex_imager_readfile_aio")
+        return __executor
+
+
+async def run(read_func, file_list, kwargs):
+    """
+    Run a read function on the shared pool of threads, without blocking the event loop
+
+    :return: the read function's results
+    """
+    if ("cancel_event" in kwargs):
+        raise TypeError("'cancel_event' can't be passed to asynchronous reads, cancel the task instead")
+    cancel_event = threading.Event()
+    read = functools.partial(read_func, file_list, cancel_event=cancel_event, **kwargs)
+    future = asyncio.get_running_loop().run_in_executor(__get_executor(), read)
+    try:
+        return await future
+    except asyncio.CancelledError:
+        # stop the read if it's already running (if it isn't, the future being cancelled
+        # means it never will)
+        cancel_event.set()
+        raise
+
+
+class FrameIterator:
+    """
+    Asynchronous iterator over the frames of a set of files, as (image, metadata) for
+    each frame, reading one file at a time
+
+    The next file is read while the frames of the current one are being used. Files that
+    couldn't be read are added to problematic_files as they come up. Use it as an async
+    context manager, or call aclose(), to stop the read ahead if iterating stops early.
+    """
+
+    def __init__(self, read_func, file_list, kwargs):
+        if ("cancel_event" in kwargs):
+            raise TypeError("'cancel_event' can't be passed to asynchronous reads, cancel the task instead")
+        if (isinstance(file_list, str) is True):
+            file_list = [file_list]
+        self.problematic_files = []
+        self.__read_func = read_func
+        self.__file_list = list(file_list)
+        self.__kwargs = kwargs
+        self.__next_file = 0
+        self.__next_read = None
+        self.__images = None
+        self.__metadata = []
+        self.__num_frames = 0
+        self.__next_frame = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+    def __start_read(self):
+        # start reading the next file, if there is one
+        if (self.__next_file >= len(self.__file_list)):
+            return None
+        file_list = [self.__file_list[self.__next_file]]
+        self.__next_file += 1
+        return asyncio.ensure_future(run(self.__read_func, file_list, self.__kwargs))
+
+    async def __anext__(self):
+        while (self.__next_frame >= self.__num_frames):
+            # move on to the next file
+            self.__images = None
+            self.__metadata = []
+            self.__num_frames = 0
+            self.__next_frame = 0
+            if (self.__next_read is None):
+                self.__next_read = self.__start_read()
+                if (self.__next_read is None):
+                    raise StopAsyncIteration
+            images, metadata, problematic_files = await self.__next_read
+            self.__next_read = self.__start_read()
+            self.problematic_files.extend(problematic_files)
+            self.__images = images
+            self.__metadata = metadata
+            self.__num_frames = images.shape[-1]
+
+        # get the frame
+        #
+        # NOTE: with metadata_format="columnar", each frame's metadata is its row of the
+        # columns (see ColumnarMetadata.row())
+        frame = self.__next_frame
+        self.__next_frame += 1
+        if (isinstance(self.__metadata, list) is False):
+            return self.__images[..., frame], self.__metadata.row(frame)
+        return self.__images[..., frame], self.__metadata[frame]
+
+    async def aclose(self):
+        """
+        Stop reading ahead, and end the iteration
+        """
+        self.__next_file = len(self.__file_list)
+        self.__images = None
+        self.__metadata = []
+        self.__num_frames = 0
+        self.__next_frame = 0
+        if (self.__next_read is not None):
+            self.__next_read.cancel()
+            try:
+                await self.__next_read
+            except (asyncio.CancelledError, Exception):
+                pass
+            self.__next_read = None
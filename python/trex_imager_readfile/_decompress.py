@@ -0,0 +1,226 @@
+"""
+Decompression backends for PGM.gz files
+
+The stdlib zlib module is always available, and is the fallback. Faster zlib
+compatible libraries are used instead when they're installed:
+
+  isal      python-isal (Intel ISA-L)
+  zlib-ng   python-zlib-ng
+
+The "pigz" backend runs the external pigz program and reads the decompressed
+file from a pipe. It's only used when asked for by name, since it costs a new
+process for every file. If it fails, the file is decompressed with zlib instead.
+
+By default the CRC32 and size in each gzip member's trailer are checked. With
+verify=False (ie. for trusted data), only the raw deflate data between each
+member's header and trailer is decompressed, and the trailers are skipped.
+
+A thread can keep the buffer that compressed files are read into between files
+(see keep_buffer), which a Reader's workers do. The decompressed data is still
+a new bytes object for every file, since the zlib compatible libraries have no
+way of decompressing into an existing buffer.
+"""
+
+import os
+import shutil
+import subprocess
+import threading
+import zlib
+
+# optional backends
+try:
+    from isal import isal_zlib
+except ImportError:
+    isal_zlib = None
+try:
+    from zlib_ng import zlib_ng
+except ImportError:
+    zlib_ng = None
+
+# globals
+BACKENDS = ["isal", "zlib-ng", "pigz", "zlib"]
+__AUTO_BACKENDS = ["isal", "zlib-ng", "zlib"]  # in order of preference
+__GZIP_WBITS = 31  # zlib window bits for gzip header and trailer
+__RAW_WBITS = -15  # zlib window bits for raw deflate data
+__GZIP_TRAILER_SIZE = 8
+__GZIP_MAGIC = b"\x1f\x8b\x08"
+__local = threading.local()  # per-thread buffer for compressed files, see keep_buffer()
+
+
+def __module(backend):
+    # get the zlib compatible module for a backend, or None if it isn't installed
+    if (backend == "isal"):
+        return isal_zlib
+    elif (backend == "zlib-ng"):
+        return zlib_ng
+    elif (backend == "pigz"):
+        return None if shutil.which("pigz") is None else zlib
+    return zlib
+
+
+def available():
+    """
+    Get the decompression backends that can be used on this system
+
+    :return: backend names
+    :rtype: list[str]
+    """
+    return [b for b in BACKENDS if __module(b) is not None]
+
+
+def select(backend=None):
+    """
+    Check the gzip_backend parameter of a read function, picking the fastest
+    installed backend for "auto" (or None)
+
+    :return: backend name
+    :rtype: str
+    """
+    if (backend is None or backend == "auto"):
+        for b in __AUTO_BACKENDS:
+            if (__module(b) is not None):
+                return b
+    if (backend not in BACKENDS):
+        raise ValueError("Unknown gzip backend '%s', must be one of: auto, %s" % (backend, ", ".join(BACKENDS)))
+    if (__module(backend) is None):
+        raise ValueError("gzip backend '%s' is not available on this system" % (backend))
+    return backend
+
+
+def __header_size(contents, position):
+    # get the size of the gzip member header starting at position
+    if (contents[position:position + 3] != __GZIP_MAGIC):
+        raise ValueError("not a gzip file")
+    flags = contents[position + 3]
+    header_end = position + 10
+    if ((flags & 4) != 0):
+        # FEXTRA
+        header_end += 2 + int.from_bytes(contents[header_end:header_end + 2], "little")
+    if ((flags & 8) != 0):
+        # FNAME
+        header_end = contents.index(b"\x00", header_end) + 1
+    if ((flags & 16) != 0):
+        # FCOMMENT
+        header_end = contents.index(b"\x00", header_end) + 1
+    if ((flags & 2) != 0):
+        # FHCRC
+        header_end += 2
+    return header_end - position
+
+
+def __decompress_verified(module, contents):
+    # decompress gzip data, checking each member's trailer
+    #
+    # NOTE: most files are a single gzip member, in which case the trailer holds the exact
+    # uncompressed size (ISIZE, modulo 2^32) and the output can be allocated in one go. The
+    # size matching isn't enough to tell that there's only one member (ie. two files of the
+    # same size joined with cat), but every member starts with the gzip magic number, so if
+    # it doesn't turn up again after the start there can't be another one. It can also turn
+    # up by chance in the compressed data, and then the members are decompressed one at a time.
+    if (contents.find(__GZIP_MAGIC, 1) == -1):
+        isize = int.from_bytes(contents[-4:], "little")
+        return module.decompress(contents, __GZIP_WBITS, max(isize, 1))
+
+    # possibly multiple members, decompress each one
+    members = []
+    while (len(contents) > 0):
+        decompressor = module.decompressobj(__GZIP_WBITS)
+        members.append(decompressor.decompress(contents))
+        if (decompressor.eof is False):
+            raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+        contents = decompressor.unused_data.lstrip(b"\x00")  # skip any trailing padding
+    return members[0] if len(members) == 1 else b"".join(members)
+
+
+def __decompress_unverified(module, contents):
+    # decompress gzip data without checking the member trailers, by decompressing the raw
+    # deflate data of each member
+    members = []
+    position = 0
+    with memoryview(contents) as view:
+        while (position < len(contents)):
+            decompressor = module.decompressobj(__RAW_WBITS)
+            members.append(decompressor.decompress(view[position + __header_size(contents, position):]))
+            if (decompressor.eof is False):
+                raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+
+            # skip the trailer, and any trailing padding
+            unused_data = decompressor.unused_data[__GZIP_TRAILER_SIZE:]
+            position = len(contents) - len(unused_data.lstrip(b"\x00"))
+    return members[0] if len(members) == 1 else b"".join(members)
+
+
+def decompress(contents, backend="zlib", verify=True):
+    """
+    Decompress the contents of a gzip file, which may have multiple members,
+    using a zlib compatible backend
+
+    :return: decompressed contents
+    :rtype: bytes
+    """
+    module = __module(backend if backend != "pigz" else "zlib")
+    if (verify is False):
+        return __decompress_unverified(module, contents)
+    return __decompress_verified(module, contents)
+
+
+def keep_buffer():
+    """
+    Keep the buffer that compressed files are read into between files decompressed
+    by the calling thread, rather than allocating a new one for each file (used as
+    the initializer of a Reader's workers). The buffer is as big as the largest file
+    read so far, and is freed when the thread exits.
+    """
+    __local.buffer = bytearray()
+
+
+def __read_file(fp):
+    # read the contents of a file, into the calling thread's buffer if it keeps one
+    #
+    # NOTE: the buffer is resized to fit the file exactly, which doesn't give up its
+    # memory unless the file is much smaller than the last one. Anything past the size
+    # the file had when it was opened (ie. it's still being written) is read as well.
+    buffer = getattr(__local, "buffer", None)
+    if (buffer is None):
+        return fp.read()
+    size = os.fstat(fp.fileno()).st_size
+    if (len(buffer) > size):
+        del buffer[size:]
+    elif (len(buffer) < size):
+        buffer.extend(bytes(size - len(buffer)))
+    num_read = fp.readinto(buffer)
+    del buffer[num_read:]
+    buffer.extend(fp.read())
+    return buffer
+
+
+def decompress_file(filename, backend="zlib", verify=True):
+    """
+    Decompress a gzip file using the given backend (see select), falling back
+    to zlib if the pigz program fails
+
+    :return: decompressed contents, and the name of the backend that was used
+    :rtype: bytes, str
+    """
+    if (backend == "pigz"):
+        try:
+            return subprocess.run(["pigz", "-dc", filename], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout, "pigz"
+        except (OSError, subprocess.CalledProcessError):
+            backend = "zlib"
+    with open(filename, mode='rb') as fp:
+        contents = __read_file(fp)
+    return decompress(contents, backend=backend, verify=verify), backend
+
+
+def decompressobj(backend="zlib"):
+    """
+    Get a streaming gzip decompressor from a zlib compatible backend, used when
+    only the start of a file is decompressed (pigz can't be used for this, so
+    zlib is used instead)
+
+    :return: decompressor, and the name of the backend that was used
+    :rtype: object, str
+    """
+    if (backend == "pigz"):
+        backend = "zlib"
+    return __module(backend).decompressobj(__GZIP_WBITS), backend
@@ -0,0 +1,1122 @@
+"""
+Shared machinery for reading a list of files into a single image array
+
+Each file is first probed to get its frame shape and an upper bound on the
+number of frames it holds. One output array is then allocated for all files,
+and each worker decodes its file straight into its own slice of that array.
+When reading with more than one worker process, the output array lives in
+shared memory so that only metadata has to be sent back to the parent process.
+If there isn't enough shared memory, each worker decodes into its own array and
+sends it back, and the parent copies it into place as soon as it arrives.
+Worker threads (the "thread" backend) write straight into the output array.
+Workers are started for each read, unless a Reader (see reader.py) is given,
+in which case its long-lived pool is used.
+
+A read can be limited by a per-file timeout, a deadline, and a cancel event
+(see read_limits). Files that are given up on are reported as problematic, and
+the frames of the files that were finished are returned.
+Threads are the better choice whenever decoding spends most of its time outside
+the GIL (zlib, numpy copies, and OpenCV all release it), since no processes
+have to be started and nothing is sent between them.
+
+Instrument modules supply two functions:
+
+  probe_func(filename, options)
+      returns (frame_shape, dtype, num_frames), where num_frames is an upper
+      bound on the number of frames the file will produce
+
+  decode_func(filename, images, options)
+      writes frames into images[..., 0:n] and returns (num_frames,
+      metadata_dict_list, problematic, error_message, overflow_images,
+      gzip_backend), where overflow_images holds any frames that did not fit
+      in images (or None), and gzip_backend is the name of the decompression
+      backend used for the file (or None if it wasn't compressed)
+
+The output array has the probed dtype, or the "output_dtype" option if it's
+set (see output_dtype). Decode functions convert each frame to the output
+dtype as they copy it in (see convert_frames), so there's no conversion pass
+over the whole result afterwards.
+
+The options dictionary is passed through to both. Files whose names show that
+they're entirely outside the time window given by the "start" and "end"
+options (see time_window) are skipped without being probed or decoded.
+
+Metadata can also be read on its own with read_metadata(), which skips the
+probe and output array entirely. Instrument modules supply one function:
+
+  metadata_func(filename, options)
+      returns (metadata_dict_list, problematic, error_message, gzip_backend),
+      without reading any pixel data
+
+Metadata is passed back from the workers in the format given by the
+"metadata_format" option, and joined together in the parent (see _metadata.py).
+
+The decompression backend used for each compressed file is reported through
+the "trex_imager_readfile" logger, at debug level, along with the number of
+workers picked for workers="auto" (see worker_count).
+"""
+
+import datetime
+import functools
+import logging
+import math
+import os
+import signal
+import sys
+import threading
+import time
+import numpy as np
+from multiprocessing import Pool
+from multiprocessing import TimeoutError as PoolTimeoutError
+from multiprocessing import shared_memory
+from multiprocessing.pool import ThreadPool
+from . import _metadata
+
+# globals
+__logger = logging.getLogger("trex_imager_readfile")
+__LIMIT_POLL_INTERVAL = 0.1  # seconds between checks of the cancel event
+__AUTO_BYTES_PER_WORKER = {"thread": 1024 * 1024, "process": 16 * 1024 * 1024}  # least file data worth another worker
+__AUTO_PROCESS_MEMORY = 128 * 1024 * 1024  # memory used by a worker process before it reads anything
+__AUTO_FILE_MEMORY = 4  # working memory of a worker, as a multiple of the size of the file it's reading
+__AUTO_MEMORY_FRACTION = 0.5  # fraction of the available memory that workers can use between them
+__TRIM_CHUNK_SIZE = 1024 * 1024  # values moved at a time when trimming the output array
+
+# NOTE: creating or unlinking a shared memory segment holds the resource tracker's lock, and
+# a worker process forked by another thread at the same time (ie. concurrent asynchronous
+# reads) would start with that lock held and hang once it attaches to its output array. So
+# worker processes aren't started while segments are being created or unlinked.
+__shared_memory_lock = threading.Lock()
+
+
+class _SharedMemoryBuffer:
+    """
+    Exposes a shared memory segment to numpy through the array interface, and
+    closes the segment once the last array using it has been garbage collected
+    """
+
+    def __init__(self, shm, shape, dtype):
+        self.__shm = shm
+        address = np.frombuffer(shm.buf, dtype=np.uint8, count=1).ctypes.data
+        self.__array_interface__ = {
+            "shape": tuple(shape),
+            "typestr": dtype.str,
+            "data": (address, False),
+            "version": 3,
+        }
+
+    def __del__(self):
+        try:
+            self.__shm.close()
+        except Exception:
+            pass
+
+
+def __shared_memory_available(nbytes):
+    # shared memory on Linux is backed by /dev/shm, which is often small inside containers
+    # and writing past its size kills the writer with SIGBUS, so check there's room first
+    if (sys.platform.startswith("linux") is True):
+        try:
+            stats = os.statvfs("/dev/shm")
+            return (stats.f_bavail * stats.f_frsize) >= nbytes
+        except Exception:
+            return False
+    return True
+
+
+def __allocate_shared(shape, dtype):
+    # allocate an array in a new shared memory segment
+    nbytes = int(np.prod(shape)) * dtype.itemsize
+    with __shared_memory_lock:
+        shm = shared_memory.SharedMemory(create=True, size=nbytes)
+    images = np.asarray(_SharedMemoryBuffer(shm, shape, dtype))
+    return images, shm
+
+
+def worker_backend(backend="auto"):
+    """
+    Check the backend parameter of a read function, using worker processes for "auto"
+
+    :return: "process" or "thread"
+    :rtype: str
+    """
+    if (backend == "auto"):
+        return "process"
+    if (backend not in ["process", "thread"]):
+        raise ValueError("Unknown backend '%s', must be one of: auto, process, thread" % (backend))
+    return backend
+
+
+def __read_cgroup_file(filename):
+    # read the value in a cgroup control file, or None if there isn't one
+    try:
+        with open(filename, "r") as fp:
+            return fp.read().strip()
+    except (OSError, ValueError):
+        return None
+
+
+def __cgroup_cpu_quota():
+    # get the CPU quota of this process's cgroup (ie. a container's CPU limit), as a number
+    # of CPUs, or None if there isn't one
+    #
+    # NOTE: cgroup v2 has "<quota> <period>" in cpu.max, with a quota of "max" when there's
+    # no limit. cgroup v1 has them in separate files, with a quota of -1 when there's no limit.
+    cpu_max = __read_cgroup_file("/sys/fs/cgroup/cpu.max")
+    if (cpu_max is not None):
+        quota_period = cpu_max.split()
+    else:
+        quota_period = [
+            __read_cgroup_file("/sys/fs/cgroup/cpu/cpu.cfs_quota_us"),
+            __read_cgroup_file("/sys/fs/cgroup/cpu/cpu.cfs_period_us"),
+        ]
+    try:
+        quota = int(quota_period[0])
+        period = int(quota_period[1])
+    except (IndexError, TypeError, ValueError):
+        return None
+    if (quota <= 0 or period <= 0):
+        return None
+    return quota / period
+
+
+def __available_memory():
+    # get the memory available to this process in bytes, from its cgroup's memory limit
+    # (ie. a container's memory limit) or the free physical memory, or None if unknown
+    available = None
+    for limit_filename, usage_filename in [
+        ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory.current"),
+        ("/sys/fs/cgroup/memory/memory.limit_in_bytes", "/sys/fs/cgroup/memory/memory.usage_in_bytes"),
+    ]:
+        try:
+            limit = int(__read_cgroup_file(limit_filename))
+            usage = int(__read_cgroup_file(usage_filename))
+        except (TypeError, ValueError):
+            continue  # no limit ("max"), or no cgroup of this version
+        if (limit < 2**60):  # cgroup v1 reports no limit as a huge number
+            available = max(limit - usage, 0)
+        break
+    try:
+        free = os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+        available = free if available is None else min(available, free)
+    except (AttributeError, OSError, ValueError):
+        pass
+    return available
+
+
+def available_cpus():
+    """
+    Get the number of CPUs this process can use, taking its CPU affinity and any cgroup CPU
+    quota (ie. a container's CPU limit) into account
+
+    :return: number of CPUs
+    :rtype: int
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = __cgroup_cpu_quota()
+    if (quota is not None):
+        cpus = min(cpus, int(math.ceil(quota)))
+    return max(cpus, 1)
+
+
+def worker_count(workers, file_list, backend):
+    """
+    Check the workers parameter of a read function, picking the number of workers for
+    "auto" from the CPUs and memory available, the files being read, and the backend
+
+    One worker is used per CPU, but no more than there are files, or than the files have
+    enough data for (starting a worker has to pay for itself, and starting a process costs
+    more than starting a thread), or than fit in half of the available memory. The choice
+    is logged to the "trex_imager_readfile" logger, at debug level.
+
+    :return: number of workers
+    :rtype: int
+    """
+    if (workers != "auto"):
+        return workers
+
+    # get the limits
+    if (backend not in __AUTO_BYTES_PER_WORKER):
+        backend = "process"
+    cpus = available_cpus()
+    file_sizes = [__file_size(f) for f in file_list]
+    by_files = max(len(file_sizes), 1)
+    by_size = max(sum(file_sizes) // __AUTO_BYTES_PER_WORKER[backend], 1)
+    by_memory = cpus
+    memory = __available_memory()
+    if (memory is not None):
+        worker_memory = max(file_sizes + [0]) * __AUTO_FILE_MEMORY
+        if (backend == "process"):
+            worker_memory += __AUTO_PROCESS_MEMORY
+        by_memory = max(int((memory * __AUTO_MEMORY_FRACTION) // max(worker_memory, 1)), 1)
+    workers = min(cpus, by_files, by_size, by_memory)
+
+    # report the choice
+    __logger.debug(
+        "Reading %d files (%d bytes) using %d %s workers, picked for workers=\"auto\" with %d CPUs and %s bytes of memory available",
+        len(file_sizes),
+        sum(file_sizes),
+        workers,
+        backend,
+        cpus,
+        "unknown" if memory is None else str(memory),
+    )
+    return workers
+
+
+def create_pool(workers, backend, initializer=None):
+    """
+    Start a pool of worker processes or threads
+
+    :param initializer: function each worker calls when it starts, defaults to None
+    :type initializer: callable, optional
+
+    :return: the pool
+    :rtype: multiprocessing.pool.Pool or multiprocessing.pool.ThreadPool
+    """
+    if (backend == "thread"):
+        return ThreadPool(processes=workers, initializer=initializer)
+    with __shared_memory_lock:
+        try:
+            # set up process pool (ignore SIGINT before spawning pool so child processes inherit SIGINT handler)
+            original_sigint_handler = signal.signal(signal.SIGINT, signal.SIG_IGN)
+            pool = Pool(processes=workers, initializer=initializer)
+            signal.signal(signal.SIGINT, original_sigint_handler)  # restore SIGINT handler
+        except ValueError:
+            # likely the read call is being used within a context that doesn't support the usage
+            # of signals in this way, proceed without it
+            pool = Pool(processes=workers, initializer=initializer)
+    return pool
+
+
+def __file_size(filename):
+    # get the size of a file, or 0 if it can't be found
+    try:
+        return os.path.getsize(filename)
+    except OSError:
+        return 0
+
+
+def __run_indexed_task(indexed_task):
+    # run a task function, returning the task's index along with its result (or None if
+    # the read has been given up on before the task started)
+    func, index, task, abort = indexed_task
+    if (abort is not None and abort.is_set() is True):
+        return index, None
+    return index, func(task)
+
+
+def read_limits(timeout_per_file=None, deadline=None, cancel_event=None):
+    """
+    Check the timeout_per_file, deadline, and cancel_event parameters of a read function
+
+    A deadline can be given as a number of seconds from now, or as a datetime (naive
+    datetimes are taken as local time, ie. datetime.datetime.now() + datetime.timedelta(...)).
+
+    :return: None if there are no limits, otherwise a dictionary of them with the deadline
+             converted to a time.monotonic() time
+    :rtype: dict
+    """
+    if (timeout_per_file is None and deadline is None and cancel_event is None):
+        return None
+    if (timeout_per_file is not None):
+        if (isinstance(timeout_per_file, (int, float)) is False or isinstance(timeout_per_file, bool) is True):
+            raise TypeError("timeout_per_file must be a number of seconds")
+        if (timeout_per_file <= 0):
+            raise ValueError("timeout_per_file must be greater than 0")
+    if (isinstance(deadline, datetime.datetime) is True):
+        deadline = (deadline - datetime.datetime.now(deadline.tzinfo)).total_seconds()
+    elif (deadline is not None and (isinstance(deadline, (int, float)) is False or isinstance(deadline, bool) is True)):
+        raise TypeError("deadline must be a number of seconds or a datetime.datetime")
+    if (cancel_event is not None and hasattr(cancel_event, "is_set") is False):
+        raise TypeError("cancel_event must have an is_set() method (ie. threading.Event)")
+    return {
+        "timeout_per_file": timeout_per_file,
+        "deadline": time.monotonic() + deadline if deadline is not None else None,
+        "cancel_event": cancel_event,
+    }
+
+
+def __waits_on_files(limits):
+    # check if a read has to be able to stop waiting part way through a file (a timeout or a
+    # deadline), rather than just checking for cancellation between files
+    return (limits is not None and (limits["timeout_per_file"] is not None or limits["deadline"] is not None))
+
+
+def __collect_results(iterator, tasks, order, results, result_func, limits, slots):
+    # collect results from the workers until they're all in, or a limit is reached,
+    # returning an error message for each task that was given up on
+    #
+    # NOTE: the pool doesn't say when a worker starts a task. Workers take tasks in the
+    # order they were handed out, so the first 'slots' tasks start straight away and
+    # each one after that starts when a task finishes and frees up its worker. A task's
+    # "time_used" (ie. probing the file) comes out of its timeout.
+    start_times = [None] * len(tasks)
+    for p in range(0, min(slots, len(order))):
+        start_times[order[p]] = time.monotonic()
+    next_start = slots
+    num_done = 0
+    failures = {}
+    reason = None
+    while (num_done + len(failures) < len(tasks)):
+        # check if the read has been cancelled, or is out of time
+        now = time.monotonic()
+        if (limits["cancel_event"] is not None and limits["cancel_event"].is_set() is True):
+            reason = "read cancelled before the file was read"
+            break
+        if (limits["deadline"] is not None and now >= limits["deadline"]):
+            reason = "deadline passed before the file was read"
+            break
+        wait = __LIMIT_POLL_INTERVAL if limits["cancel_event"] is not None else None
+        if (limits["deadline"] is not None):
+            wait = limits["deadline"] - now if wait is None else min(wait, limits["deadline"] - now)
+
+        # give up on files that have taken too long
+        if (limits["timeout_per_file"] is not None):
+            num_running = 0
+            for i in range(0, len(tasks)):
+                if (start_times[i] is None or results[i] is not None or i in failures):
+                    continue
+                remaining = start_times[i] + limits["timeout_per_file"] - tasks[i].get("time_used", 0) - now
+                if (remaining <= 0):
+                    failures[i] = "timed out after %s seconds" % (limits["timeout_per_file"])
+                else:
+                    num_running += 1
+                    wait = remaining if wait is None else min(wait, remaining)
+            if (num_done + len(failures) == len(tasks)):
+                break
+            if (num_running == 0):
+                # every worker is stuck on a file that timed out, so nothing else can start
+                reason = "timed out waiting for a worker, all workers are stuck on files that timed out"
+                break
+
+        # wait for the next result
+        try:
+            i, result = iterator.next(timeout=wait)
+        except PoolTimeoutError:
+            continue
+        except StopIteration:
+            break
+        if (next_start < len(order)):
+            # a worker is free, so the next task starts
+            start_times[order[next_start]] = time.monotonic()
+            next_start += 1
+        if (result is None or i in failures):
+            continue
+        results[i] = result if result_func is None else result_func(tasks[i], result)
+        num_done += 1
+
+    # give up on everything that's left
+    for i in range(0, len(tasks)):
+        if (results[i] is None and i not in failures):
+            failures[i] = reason
+    return failures
+
+
+def __run_tasks(func, tasks, workers, backend, reader=None, result_func=None, limits=None, failed_func=None):
+    # run a task function over all tasks, returning the results in task order, or None if
+    # interrupted
+    #
+    # NOTE: workers hand back each result as soon as it's done (in whatever order they
+    # finish), and it's passed straight to result_func(task, result) which returns what
+    # to keep of it. This lets large results be dealt with and freed right away, rather
+    # than holding onto all of them until the last file is done. Tasks that are given
+    # up on because of the limits (see read_limits) get failed_func(task, error_message)
+    # as their result.
+    results = [None] * len(tasks)
+    if (workers <= 1 and __waits_on_files(limits) is False):
+        # don't bother using multiprocessing with one worker, just call the function directly,
+        # checking for cancellation between files
+        for i in range(0, len(tasks)):
+            if (limits is not None and limits["cancel_event"].is_set() is True):
+                for j in range(i, len(tasks)):
+                    results[j] = failed_func(tasks[j], "read cancelled before the file was read")
+                return results
+            results[i] = func(tasks[i])
+            if (result_func is not None):
+                results[i] = result_func(tasks[i], results[i])
+        return results
+    if (workers <= 1):
+        # a single worker runs in a thread when there are limits, so the read can stop waiting for it
+        workers = 1
+        backend = "thread"
+        reader = None
+
+    # get a pool, using the reader's long-lived one if there is one
+    if (reader is not None):
+        pool = reader._pool(backend)
+        try:
+            return __run_pool_tasks(func, tasks, workers, backend, pool, reader.chunksize, reader, result_func, limits, failed_func)
+        finally:
+            reader._release_pool(pool)
+    pool = create_pool(workers, backend)
+    return __run_pool_tasks(func, tasks, workers, backend, pool, 1, None, result_func, limits, failed_func)
+
+
+def __run_pool_tasks(func, tasks, workers, backend, pool, chunksize, reader, result_func, limits, failed_func):
+    # run a task function over all tasks on the given pool (see __run_tasks)
+    results = [None] * len(tasks)
+
+    # call the function, run each iteration with a single task
+    #
+    # NOTE: tasks are handed out largest file first (longest processing time first
+    # scheduling), so that a large file near the end of the list doesn't leave the other
+    # workers idle while it's read. The results are put back in task order.
+    abort = threading.Event() if backend == "thread" else None
+    failures = {}
+    try:
+        sizes = [0 if tasks[i]["skip"] is True else __file_size(tasks[i]["filename"]) for i in range(0, len(tasks))]
+        order = sorted(range(0, len(tasks)), key=lambda i: sizes[i], reverse=True)
+        indexed_tasks = [(func, i, tasks[i], abort) for i in order]
+        iterator = pool.imap_unordered(__run_indexed_task, indexed_tasks, chunksize=chunksize)
+        if (limits is None):
+            for i, result in iterator:
+                results[i] = result if result_func is None else result_func(tasks[i], result)
+        else:
+            failures = __collect_results(iterator, tasks, order, results, result_func, limits, workers * chunksize)
+    except KeyboardInterrupt:
+        if (abort is not None):
+            abort.set()
+        if (reader is not None):
+            # NOTE: other reads may still be using the reader's pool, so it's only stopped
+            # once they're done
+            reader._discard_pool(backend, pool)
+        else:
+            pool.terminate()  # gracefully kill children
+        return None
+    except Exception:
+        if (reader is None):
+            pool.terminate()
+        raise
+
+    # stop any tasks that were given up on
+    #
+    # NOTE: worker processes are killed, unless they belong to a reader and may be busy with
+    # other reads, in which case the reader starts a new pool and kills the old one's
+    # workers once the other reads are done. Threads can't be stopped, so any that are
+    # stuck keep going until the file they're on is done, and the rest skip the tasks they
+    # haven't started.
+    if (len(failures) > 0):
+        if (abort is not None):
+            abort.set()
+        if (reader is not None):
+            reader._discard_pool(backend, pool)
+        elif (backend == "thread"):
+            pool.close()
+        else:
+            pool.terminate()
+        for i, error_message in failures.items():
+            results[i] = failed_func(tasks[i], error_message)
+        return results
+    if (reader is None):
+        pool.close()
+        pool.join()
+    return results
+
+
+def __store_result(images, task, result):
+    # copy frames that a worker decoded into its own array (when there's no shared output
+    # array) into their place in the output array, so that the worker's array can be freed
+    if (result["images"] is not None):
+        num_frames = min(result["num_frames"], task["capacity"])
+        if (result["problematic"] is False and num_frames > 0):
+            images[..., task["offset"]:task["offset"] + num_frames] = result["images"][..., 0:num_frames]
+        result["images"] = None
+    return result
+
+
+def __run_task(task):
+    # skip files outside the time window
+    if (task["skip"] is True):
+        return {
+            "num_frames": 0,
+            "metadata_dict_list": [],
+            "problematic": False,
+            "error_message": "",
+            "overflow_images": None,
+            "gzip_backend": None,
+            "images": None,
+            "abandoned": False,
+        }
+
+    # get the array this file's frames should be written into
+    shm = None
+    output = None
+    if (task["shared_memory_name"] is not None):
+        # attach to the shared output array
+        shm = shared_memory.SharedMemory(name=task["shared_memory_name"])
+        output = np.ndarray(task["output_shape"], dtype=task["dtype"], buffer=shm.buf)
+        images = output[..., task["offset"]:task["offset"] + task["capacity"]]
+    elif (task["output"] is not None):
+        # write directly into the output array (same process)
+        images = task["output"][..., task["offset"]:task["offset"] + task["capacity"]]
+    else:
+        # no shared output available, decode into a local array that is sent back
+        images = np.empty(task["frame_shape"] + (task["capacity"], ), dtype=task["dtype"])
+
+    # decode the file
+    try:
+        num_frames, metadata_dict_list, problematic, error_message, overflow_images, gzip_backend = task["decode_func"](
+            task["filename"],
+            images,
+            task["options"],
+        )
+    except Exception as e:
+        if (task["options"]["quiet"] is False):
+            print("Failed to process file '%s' " % (task["filename"]))
+        num_frames = 0
+        metadata_dict_list = []
+        problematic = True
+        error_message = "failed to process file: %s" % (str(e))
+        overflow_images = None
+        gzip_backend = None
+    if (problematic is False):
+        metadata_dict_list = _metadata.convert(metadata_dict_list, task["options"].get("metadata_format"))
+
+    # set the result
+    result = {
+        "num_frames": num_frames,
+        "metadata_dict_list": metadata_dict_list,
+        "problematic": problematic,
+        "error_message": error_message,
+        "overflow_images": overflow_images,
+        "gzip_backend": gzip_backend,
+        "images": None,
+        "abandoned": False,
+    }
+    if (shm is not None):
+        # detach from the shared output array
+        del images
+        del output
+        shm.close()
+    elif (task["output"] is None):
+        result["images"] = images
+
+    # return
+    return result
+
+
+def __run_probe_task(task):
+    # probe a file, the probe is None if the file is skipped or can't be probed
+    #
+    # NOTE: when the read has a timeout or deadline, a file that can't be probed is given up
+    # on with the probe's error, rather than being read again by a decode that might hang
+    if (task["skip"] is True):
+        return {"probe": None, "error_message": "", "time_used": 0}
+    start_time = time.monotonic()
+    try:
+        probe = task["probe_func"](task["filename"], task["options"])
+    except Exception as e:
+        error_message = "failed to process file: %s" % (str(e)) if task["report_error"] is True else ""
+        return {"probe": None, "error_message": error_message, "time_used": time.monotonic() - start_time}
+    return {"probe": probe, "error_message": "", "time_used": time.monotonic() - start_time}
+
+
+def __failed_probe(task, error_message):
+    # probe result for a file that was given up on
+    return {"probe": None, "error_message": error_message, "time_used": 0}
+
+
+def __failed_result(task, error_message):
+    # result for a file that was given up on
+    if (task["options"]["quiet"] is False):
+        print("Failed to process file '%s' " % (task["filename"]))
+    return {
+        "num_frames": 0,
+        "metadata_dict_list": [],
+        "problematic": True,
+        "error_message": error_message,
+        "overflow_images": None,
+        "gzip_backend": None,
+        "images": None,
+        "abandoned": True,
+    }
+
+
+def frame_selection(frames=None, first_frame=False):
+    """
+    Check the frames parameter of a read function, and combine it with the first_frame
+    parameter
+
+    :return: None to select all frames, otherwise a slice or a tuple of frame indices
+    :rtype: slice or tuple[int]
+    """
+    if (first_frame is True):
+        return slice(0, 1)
+    if (frames is None or isinstance(frames, slice) is True):
+        return frames
+    if (isinstance(frames, (int, np.integer)) is True and isinstance(frames, bool) is False):
+        return (int(frames), )
+    try:
+        selection = tuple(frames)
+    except TypeError:
+        selection = None
+    if (selection is None or any([(isinstance(i, (int, np.integer)) is False or isinstance(i, bool) is True) for i in selection])):
+        raise TypeError("frames must be a slice, an integer, or a list of integers")
+    return tuple([int(i) for i in selection])
+
+
+def frame_indices(selection, num_frames):
+    """
+    Get the indices of the frames that a selection (from frame_selection) picks out
+    of a file with num_frames frames. Negative indices count back from the end of the
+    file, and indices past the end of the file are skipped.
+
+    :return: frame indices
+    :rtype: list[int]
+    """
+    if (selection is None):
+        return list(range(0, num_frames))
+    if (isinstance(selection, slice) is True):
+        return list(range(0, num_frames)[selection])
+    indices = []
+    for i in selection:
+        if (i < 0):
+            i += num_frames
+        if (i >= 0 and i < num_frames):
+            indices.append(i)
+    return indices
+
+
+def time_window(start=None, end=None):
+    """
+    Check the start and end parameters of a read function
+
+    Timestamps in the data are UTC, so timezone aware datetimes are converted to UTC
+    and made naive to be compared with them. Naive datetimes are assumed to be UTC.
+
+    :return: start and end
+    :rtype: datetime.datetime, datetime.datetime
+    """
+    window = []
+    for value in [start, end]:
+        if (value is not None and isinstance(value, datetime.datetime) is False):
+            raise TypeError("start and end must be datetime.datetime objects")
+        if (value is not None and value.tzinfo is not None):
+            value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        window.append(value)
+    return window[0], window[1]
+
+
+def parse_timestamp(value):
+    """
+    Parse a metadata timestamp (ie. '2022-03-07 06:00:00.000000 UTC') into a naive
+    UTC datetime, returning None if it can't be parsed
+    """
+    if (isinstance(value, bytes) is True):
+        value = value.decode("ascii", errors="replace")
+    value = value.strip()
+    if (value.upper().endswith("UTC") is True):
+        value = value[:-3].strip()
+    for timestamp_format in ["%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%d %H:%M:%S"]:
+        try:
+            return datetime.datetime.strptime(value, timestamp_format)
+        except ValueError:
+            pass
+    return None
+
+
+def in_time_window(timestamp, start, end):
+    """
+    Check if a frame timestamp is in the time window, which includes start but not end.
+    Frames without a timestamp are never in a time window.
+    """
+    if (start is None and end is None):
+        return True
+    if (timestamp is None):
+        return False
+    return (start is None or timestamp >= start) and (end is None or timestamp < end)
+
+
+def __file_outside_time_window(filename, start, end):
+    # check if a file's name shows that all its frames are outside the time window
+    #
+    # NOTE: one minute files are named YYYYMMDD_HHMM_..., and single frame files are
+    # named YYYYMMDD_HHMMSS_..., with any other names the file has to be read to tell
+    if (start is None and end is None):
+        return False
+    file_split = os.path.basename(filename).split('_')
+    if (len(file_split) < 2):
+        return False
+    try:
+        if (len(file_split[1]) == 4):
+            file_start = datetime.datetime.strptime(file_split[0] + file_split[1], "%Y%m%d%H%M")
+            file_end = file_start + datetime.timedelta(minutes=1)
+        elif (len(file_split[1]) == 6):
+            file_start = datetime.datetime.strptime(file_split[0] + file_split[1], "%Y%m%d%H%M%S")
+            file_end = file_start + datetime.timedelta(seconds=1)
+        else:
+            return False
+    except ValueError:
+        return False
+    return (end is not None and file_start >= end) or (start is not None and file_end <= start)
+
+
+def output_dtype(value=None):
+    """
+    Check the output_dtype parameter of a read function
+
+    :return: output dtype in native byte order, or None to keep the dtype of the data
+    :rtype: numpy.dtype
+    """
+    if (value is None):
+        return None
+    dtype = np.dtype(value)
+    if (dtype.kind not in ["u", "i", "f"]):
+        raise ValueError("output_dtype must be an integer or floating point dtype, not %s" % (str(dtype)))
+    return dtype.newbyteorder('=')
+
+
+def check_output_dtype(data_dtype, dtype):
+    """
+    Check that the output dtype can hold the pixel values of data in the given dtype,
+    so that converting to it never wraps values around
+
+    Integer dtypes need to hold every value of the data's dtype, apart from 16-bit data
+    into uint8, which is scaled down (see convert_frames). Floating point dtypes are
+    always allowed (float16 rounds values above 2048, and can't hold values above 65504).
+    """
+    if (dtype.kind not in ["u", "i"] or data_dtype.kind not in ["u", "i"]):
+        return
+    if (dtype == np.uint8 and data_dtype.kind == "u" and data_dtype.itemsize == 2):
+        return
+    if (np.can_cast(data_dtype, dtype, casting="safe") is False):
+        raise ValueError("output_dtype %s can't hold every value of the %s pixel data being read, use a wider integer or a floating point dtype" % (
+            str(dtype),
+            str(data_dtype.newbyteorder("=")),
+        ))
+
+
+def convert_frames(destination, frames):
+    """
+    Copy frames into destination, converting them to its dtype and byte order in
+    the same pass
+
+    16-bit data copied into a uint8 destination is scaled down to 8 bits (keeping
+    the top 8 bits of each value, so the full 16-bit range that PGM files declare
+    maps onto 0-255). Any other conversion keeps the values as they are, and is
+    only made to dtypes that can hold them (see check_output_dtype).
+    """
+    if (destination.dtype == np.uint8 and frames.dtype.kind == "u" and frames.dtype.itemsize == 2):
+        np.right_shift(frames, 8, out=destination, casting="unsafe")
+    else:
+        destination[...] = frames
+
+
+def store_frames(images, frames):
+    """
+    Copy a stack of frames (on the last axis) into images, converting them to its
+    dtype, and returning any frames that didn't fit as an overflow array (None if
+    they all fit)
+    """
+    capacity = images.shape[-1]
+    num_frames = frames.shape[-1]
+    if (capacity > 0):
+        convert_frames(images[..., 0:min(num_frames, capacity)], frames[..., 0:capacity])
+    if (num_frames <= capacity):
+        return None
+    overflow_images = np.empty(frames.shape[:-1] + (num_frames - capacity, ), dtype=images.dtype)
+    convert_frames(overflow_images, frames[..., capacity:])
+    return overflow_images
+
+
+def __report_gzip_backend(filename, gzip_backend):
+    # report which decompression backend handled a file
+    if (gzip_backend is not None):
+        __logger.debug("Decompressed '%s' using %s", filename, gzip_backend)
+
+
+def __move_frames(images, src, dst, num_frames):
+    # move frames to an earlier position along the last axis, one frame at a time so
+    # that the source and destination never overlap
+    for i in range(0, num_frames):
+        images[..., dst + i] = images[..., src + i]
+
+
+def __trim_frames(images, num_frames):
+    # shrink the last axis of a C contiguous array to num_frames in place, returning a view
+    # on the start of its buffer
+    #
+    # NOTE: every value moves to the same or an earlier position, so working forward through
+    # the pixels a chunk at a time never overwrites values that haven't been moved yet. numpy
+    # takes care of the overlap within a chunk.
+    pixels = images.reshape((-1, images.shape[-1]))
+    flat = images.reshape(-1)
+    chunk = max(__TRIM_CHUNK_SIZE // max(num_frames, 1), 1)
+    for start in range(0, pixels.shape[0], chunk):
+        stop = min(start + chunk, pixels.shape[0])
+        flat[start * num_frames:stop * num_frames].reshape((stop - start, num_frames))[...] = pixels[start:stop, 0:num_frames]
+    return flat[0:pixels.shape[0] * num_frames].reshape(images.shape[:-1] + (num_frames, ))
+
+
+def read(file_list, probe_func, decode_func, options, workers=1, backend="process", reader=None, limits=None, default_frame_shape=(0, 0),
+         default_dtype="uint16"):
+    """
+    Read a list of files into a single array, see the module docstring for details
+
+    :return: images, metadata (see _metadata.py), and problematic files
+    :rtype: numpy.ndarray, list[dict] or ColumnarMetadata, list[dict]
+    """
+    # if input is just a single file name in a string, convert to a list to be fed to the workers
+    if isinstance(file_list, str):
+        file_list = [file_list]
+    workers = worker_count(workers, file_list, backend)
+
+    # probe files to find out how much space they need
+    #
+    # NOTE: the first successfully probed file sets the frame shape and dtype. Any file that
+    # can't be probed, or doesn't match, is given no space and will be caught when decoded.
+    # When the read has a timeout or deadline, files are probed in worker threads so that a
+    # file that can't be opened (ie. on a hung network filesystem) is given up on here, and
+    # isn't decoded. A file's timeout covers both its probe and its decode.
+    probe_tasks = []
+    for f in file_list:
+        probe_tasks.append({
+            "filename": f,
+            "probe_func": probe_func,
+            "options": options,
+            "skip": __file_outside_time_window(f, options.get("start"), options.get("end")),
+            "report_error": __waits_on_files(limits),
+        })
+    probe_workers = workers if __waits_on_files(limits) is True else 1
+    probes = __run_tasks(__run_probe_task, probe_tasks, probe_workers, "thread", limits=limits, failed_func=__failed_probe)
+    if (probes is None):
+        return np.empty((0, ) * (len(default_frame_shape) + 1), dtype=default_dtype), _metadata.combine([], options.get("metadata_format")), []
+    frame_shape = None
+    dtype = None
+    data_dtypes = []
+    capacities = []
+    skip = []
+    probe_failures = {}
+    for i in range(0, len(file_list)):
+        skip.append(probe_tasks[i]["skip"])
+        if (probes[i]["error_message"] != ""):
+            skip[-1] = True
+            probe_failures[i] = probes[i]["error_message"]
+        if (probes[i]["probe"] is None):
+            capacities.append(0)
+            continue
+        this_frame_shape, this_dtype, this_num_frames = probes[i]["probe"]
+        this_frame_shape = tuple(this_frame_shape)
+        if (np.dtype(this_dtype) not in data_dtypes):
+            data_dtypes.append(np.dtype(this_dtype))
+        if (frame_shape is None):
+            frame_shape = this_frame_shape
+            dtype = np.dtype(this_dtype)
+        if (this_frame_shape == frame_shape and np.dtype(this_dtype) == dtype):
+            capacities.append(this_num_frames)
+        else:
+            capacities.append(0)
+    if (frame_shape is None):
+        frame_shape = tuple(default_frame_shape)
+        dtype = np.dtype(default_dtype)
+    if (options.get("output_dtype") is not None):
+        for data_dtype in data_dtypes:
+            check_output_dtype(data_dtype, np.dtype(options["output_dtype"]))
+        dtype = np.dtype(options["output_dtype"])
+    total_capacity = sum(capacities)
+    output_shape = frame_shape + (total_capacity, )
+
+    # allocate output array
+    #
+    # NOTE: worker threads share this process's memory, so they write straight into the
+    # output array in the same way as when there's only one worker
+    shm = None
+    direct_output = (workers <= 1 or backend == "thread")
+    if (direct_output is False and total_capacity > 0 and __shared_memory_available(int(np.prod(output_shape)) * dtype.itemsize) is True):
+        images, shm = __allocate_shared(output_shape, dtype)
+    else:
+        images = np.empty(output_shape, dtype=dtype)
+
+    # set up and run the tasks
+    #
+    # NOTE: the shared memory segment is unlinked however this ends, including on
+    # KeyboardInterrupt or if the pool can't be started. It stays mapped in this process
+    # until the images array is gone, but it no longer needs a name once the workers are
+    # done with it. If this process is killed, the resource tracker unlinks it instead.
+    try:
+        tasks = []
+        offset = 0
+        for i in range(0, len(file_list)):
+            tasks.append({
+                "filename": file_list[i],
+                "decode_func": decode_func,
+                "options": options,
+                "frame_shape": frame_shape,
+                "dtype": dtype,
+                "offset": offset,
+                "capacity": capacities[i],
+                "skip": skip[i],
+                "time_used": probes[i]["time_used"],
+                "output_shape": output_shape,
+                "shared_memory_name": shm.name if shm is not None else None,
+                "output": images if direct_output is True else None,
+            })
+            offset += capacities[i]
+        results = __run_tasks(
+            __run_task,
+            tasks,
+            workers,
+            backend,
+            reader=reader,
+            result_func=functools.partial(__store_result, images),
+            limits=limits,
+            failed_func=__failed_result,
+        )
+    finally:
+        if (shm is not None):
+            with __shared_memory_lock:
+                shm.unlink()
+    if (results is None):
+        return np.empty((0, ) * (len(frame_shape) + 1), dtype=dtype), _metadata.combine([], options.get("metadata_format")), []
+    for i, error_message in probe_failures.items():
+        results[i] = __failed_result(tasks[i], error_message)
+
+    # check results
+    metadata_parts = []
+    problematic_file_list = []
+    good = []
+    has_overflow = False
+    has_abandoned = False
+    for i in range(0, len(results)):
+        __report_gzip_backend(tasks[i]["filename"], results[i]["gzip_backend"])
+
+        # check if file was problematic
+        if (results[i]["problematic"] is False and results[i]["overflow_images"] is not None):
+            if (tuple(results[i]["overflow_images"].shape[:-1]) != frame_shape):
+                results[i]["problematic"] = True
+                results[i]["error_message"] = "image data read failure: unexpected image dimensions %s" % (
+                    "x".join([str(x) for x in results[i]["overflow_images"].shape[:-1]]))
+            else:
+                has_overflow = True
+        if (results[i]["abandoned"] is True):
+            has_abandoned = True
+        if (results[i]["problematic"] is True):
+            problematic_file_list.append({
+                "filename": tasks[i]["filename"],
+                "error_message": results[i]["error_message"],
+            })
+            continue
+
+        # check if any data was read in
+        if (results[i]["num_frames"] == 0):
+            continue
+
+        # add metadata
+        metadata_parts.append(results[i]["metadata_dict_list"])
+        good.append(i)
+    total_num_frames = sum([results[i]["num_frames"] for i in good])
+    metadata = _metadata.combine(metadata_parts, options.get("metadata_format"))
+
+    # put the frames for each file in place, packing them together
+    #
+    # NOTE: usually every frame already sits in its final position and nothing needs
+    # to be moved. Problematic files, or files with fewer frames than estimated, leave
+    # gaps that need to be closed up.
+    if (has_overflow is True or has_abandoned is True):
+        # a file had more frames than estimated, so there's no room to do this in place, or a
+        # worker that was given up on may still write into its part of the output array
+        packed_images = np.empty(frame_shape + (total_num_frames, ), dtype=dtype)
+        position = 0
+        for i in good:
+            in_place = min(results[i]["num_frames"], tasks[i]["capacity"])
+            packed_images[..., position:position + in_place] = images[..., tasks[i]["offset"]:tasks[i]["offset"] + in_place]
+            position += in_place
+            if (results[i]["overflow_images"] is not None):
+                num_overflow = results[i]["overflow_images"].shape[-1]
+                packed_images[..., position:position + num_overflow] = results[i]["overflow_images"]
+                position += num_overflow
+        images = packed_images
+    else:
+        position = 0
+        for i in good:
+            num_frames = results[i]["num_frames"]
+            if (tasks[i]["offset"] != position):
+                __move_frames(images, tasks[i]["offset"], position, num_frames)
+            position += num_frames
+
+        # trim unused space at the end
+        #
+        # NOTE: the frames are packed into the start of the output array's buffer rather than
+        # copied out, so that the memory needed doesn't double when the estimate was too high
+        # (ie. problematic or truncated files, or a time window without an index). Only when
+        # most of the space went unused is it worth copying the frames into a smaller array.
+        if (total_num_frames < total_capacity):
+            images = __trim_frames(images, total_num_frames)
+            if (total_num_frames * 2 < total_capacity):
+                images = images.copy()
+
+    # return
+    results = None
+    return images, metadata, problematic_file_list
+
+
+def __run_metadata_task(task):
+    # skip files outside the time window
+    if (task["skip"] is True):
+        return [], False, "", None
+
+    # read the metadata
+    try:
+        metadata_dict_list, problematic, error_message, gzip_backend = task["metadata_func"](task["filename"], task["options"])
+    except Exception as e:
+        if (task["options"]["quiet"] is False):
+            print("Failed to process file '%s' " % (task["filename"]))
+        return [], True, "failed to process file: %s" % (str(e)), None
+    if (problematic is False):
+        metadata_dict_list = _metadata.convert(metadata_dict_list, task["options"].get("metadata_format"))
+    return metadata_dict_list, problematic, error_message, gzip_backend
+
+
+def __failed_metadata_result(task, error_message):
+    # result for a file that was given up on
+    if (task["options"]["quiet"] is False):
+        print("Failed to process file '%s' " % (task["filename"]))
+    return [], True, error_message, None
+
+
+def read_metadata(file_list, metadata_func, options, workers=1, backend="process", reader=None, limits=None):
+    """
+    Read the metadata of a list of files, without reading any pixel data
+
+    :return: metadata (see _metadata.py), and problematic files
+    :rtype: list[dict] or ColumnarMetadata, list[dict]
+    """
+    # if input is just a single file name in a string, convert to a list to be fed to the workers
+    if isinstance(file_list, str):
+        file_list = [file_list]
+    workers = worker_count(workers, file_list, backend)
+
+    # set up the tasks
+    tasks = []
+    for f in file_list:
+        tasks.append({
+            "filename": f,
+            "metadata_func": metadata_func,
+            "options": options,
+            "skip": __file_outside_time_window(f, options.get("start"), options.get("end")),
+        })
+
+    # run the tasks
+    results = __run_tasks(__run_metadata_task, tasks, workers, backend, reader=reader, limits=limits, failed_func=__failed_metadata_result)
+    if (results is None):
+        return _metadata.combine([], options.get("metadata_format")), []
+
+    # check results
+    metadata_parts = []
+    problematic_file_list = []
+    for i in range(0, len(results)):
+        this_metadata_dict_list, problematic, error_message, gzip_backend = results[i]
+        __report_gzip_backend(tasks[i]["filename"], gzip_backend)
+        if (problematic is True):
+            problematic_file_list.append({
+                "filename": tasks[i]["filename"],
+                "error_message": error_message,
+            })
+            continue
+        metadata_parts.append(this_metadata_dict_list)
+
+    # return
+    return _metadata.combine(metadata_parts, options.get("metadata_format")), problematic_file_list
@@ -0,0 +1,311 @@
+"""
+Random access into gzip files using checkpoints, in the style of zlib's
+zran.c example
+
+A gzip file can normally only be decompressed from the start. While building
+an index, the whole file is decompressed once and a checkpoint is recorded
+every 'span' bytes of output, at a deflate block boundary. Each checkpoint
+holds the compressed position (byte and bit offset), the uncompressed position,
+and the 32 KiB of output preceding it (the deflate dictionary). Decompression
+can then be restarted at any checkpoint, so reading a range of the uncompressed
+data only costs decompressing from the nearest checkpoint before it.
+
+Python's zlib module doesn't expose the block boundaries or a way to restart
+decompression part way through a byte, so the system zlib library is called
+directly using ctypes. If it can't be found (ie. on Windows), available() is
+False and callers should fall back to decompressing the whole file.
+
+Only single member gzip files are supported.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import threading
+import numpy as np
+
+# globals
+DEFAULT_SPAN = 262144  # uncompressed bytes between checkpoints
+WINDOW_SIZE = 32768  # deflate dictionary size
+__INDEX_VERSION = 2
+__READ_CHUNK_SIZE = 65536
+__Z_OK = 0
+__Z_STREAM_END = 1
+__Z_BUF_ERROR = -5
+__Z_NO_FLUSH = 0
+__Z_BLOCK = 5
+__GZIP_WBITS = 31  # zlib window bits for gzip header and trailer
+__RAW_WBITS = -15  # zlib window bits for raw deflate data
+__zlib = None  # system zlib library, loaded on first use
+
+
+class _ZStream(ctypes.Structure):
+    # zlib's z_stream struct
+    _fields_ = [
+        ("next_in", ctypes.c_void_p),
+        ("avail_in", ctypes.c_uint),
+        ("total_in", ctypes.c_ulong),
+        ("next_out", ctypes.c_void_p),
+        ("avail_out", ctypes.c_uint),
+        ("total_out", ctypes.c_ulong),
+        ("msg", ctypes.c_char_p),
+        ("state", ctypes.c_void_p),
+        ("zalloc", ctypes.c_void_p),
+        ("zfree", ctypes.c_void_p),
+        ("opaque", ctypes.c_void_p),
+        ("data_type", ctypes.c_int),
+        ("adler", ctypes.c_ulong),
+        ("reserved", ctypes.c_ulong),
+    ]
+
+
+def __load_zlib():
+    # load the system zlib library, returning None if it isn't available
+    global __zlib
+    if (__zlib is None):
+        try:
+            lib = ctypes.CDLL(ctypes.util.find_library("z"))
+            stream_p = ctypes.POINTER(_ZStream)
+            lib.zlibVersion.restype = ctypes.c_char_p
+            lib.inflateInit2_.argtypes = [stream_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_int]
+            lib.inflate.argtypes = [stream_p, ctypes.c_int]
+            lib.inflateEnd.argtypes = [stream_p]
+            lib.inflatePrime.argtypes = [stream_p, ctypes.c_int, ctypes.c_int]
+            lib.inflateSetDictionary.argtypes = [stream_p, ctypes.c_char_p, ctypes.c_uint]
+            __zlib = lib
+        except Exception:
+            __zlib = False
+    return __zlib if __zlib is not False else None
+
+
+def available():
+    """
+    Check if gzip indexes can be built and used on this system
+    """
+    return __load_zlib() is not None
+
+
+def __inflate_init(stream, wbits):
+    lib = __load_zlib()
+    ret = lib.inflateInit2_(ctypes.byref(stream), wbits, lib.zlibVersion(), ctypes.sizeof(stream))
+    if (ret != __Z_OK):
+        raise RuntimeError("failed to initialize zlib (error %d)" % (ret))
+    return lib
+
+
+def __inflate_error(stream, ret):
+    # build an exception for a failed inflate call
+    message = stream.msg.decode("ascii", errors="replace") if stream.msg else "error %d" % (ret)
+    return ValueError("gzip decompression failed: %s" % (message))
+
+
+def gzip_trailer(filename):
+    """
+    Get the file size and gzip trailer (CRC32 and ISIZE), used to check
+    that an index still matches its file
+    """
+    with open(filename, mode='rb') as fp:
+        file_size = os.fstat(fp.fileno()).st_size
+        fp.seek(max(file_size - 8, 0))
+        return file_size, fp.read(8)
+
+
+def build(filename, span=DEFAULT_SPAN):
+    """
+    Decompress a gzip file, recording a checkpoint roughly every 'span' bytes
+    of uncompressed data
+
+    :return: index dictionary, and the decompressed contents of the file
+    :rtype: dict, bytearray
+    """
+    lib = __load_zlib()
+    if (lib is None):
+        raise RuntimeError("gzip indexes are not supported on this system (zlib library not found)")
+
+    # read the file, and set up the output using the uncompressed size from the trailer
+    with open(filename, mode='rb') as fp:
+        contents = bytearray(os.fstat(fp.fileno()).st_size)
+        fp.readinto(contents)
+    isize = int.from_bytes(contents[-4:], "little")
+    output = bytearray(max(isize, 1))
+    input_buffer = (ctypes.c_char * len(contents)).from_buffer(contents)
+    output_buffer = (ctypes.c_char * len(output)).from_buffer(output)
+
+    # decompress the file one deflate block at a time, recording checkpoints
+    #
+    # NOTE: with Z_BLOCK, inflate() returns at every block boundary. Bit 7 of data_type is
+    # set there, bit 6 is set if it's the last block, and bits 0-2 are the number of bits of
+    # the last compressed byte that belong to the next block.
+    points = []
+    stream = _ZStream()
+    __inflate_init(stream, __GZIP_WBITS)
+    try:
+        stream.next_in = ctypes.addressof(input_buffer)
+        stream.avail_in = len(contents)
+        stream.next_out = ctypes.addressof(output_buffer)
+        stream.avail_out = len(output)
+        last = 0
+        while True:
+            ret = lib.inflate(ctypes.byref(stream), __Z_BLOCK)
+            if (ret == __Z_STREAM_END):
+                break
+            if (ret == __Z_BUF_ERROR and stream.avail_out == 0):
+                raise ValueError("gzip files with multiple members are not supported")
+            if (ret == __Z_BUF_ERROR):
+                raise ValueError("gzip decompression failed: unexpected end of data")
+            if (ret != __Z_OK):
+                raise __inflate_error(stream, ret)
+            if ((stream.data_type & 128) != 0 and (stream.data_type & 64) == 0 and (stream.total_out == 0 or stream.total_out - last > span)):
+                points.append((stream.total_in, stream.data_type & 7, stream.total_out))
+                last = stream.total_out
+        total_in = stream.total_in
+        total_out = stream.total_out
+    finally:
+        lib.inflateEnd(ctypes.byref(stream))
+        del input_buffer
+        del output_buffer
+
+    # only single member files are supported
+    if (len(contents[total_in:].strip(b"\x00")) > 0 or total_out != isize):
+        raise ValueError("gzip files with multiple members are not supported")
+
+    # save the dictionary for each checkpoint, left padded with zeros
+    windows = np.zeros((len(points), WINDOW_SIZE), dtype=np.uint8)
+    for i in range(0, len(points)):
+        window = output[max(points[i][2] - WINDOW_SIZE, 0):points[i][2]]
+        windows[i, WINDOW_SIZE - len(window):] = np.frombuffer(window, dtype=np.uint8)
+
+    # return
+    file_size, trailer = gzip_trailer(filename)
+    index = {
+        "file_size": file_size,
+        "trailer": trailer,
+        "uncompressed_size": total_out,
+        "span": span,
+        "points": np.array(points, dtype=np.int64).reshape((len(points), 3)),
+        "windows": windows,
+    }
+    return index, output
+
+
+def save(index, index_filename):
+    """
+    Write an index to a file, along with any extra arrays stored in it
+
+    The file is written under a temporary name (unique to the process and
+    thread) and then renamed, so that an index is never seen part way through
+    being written.
+    """
+    arrays = {}
+    for key, value in index.items():
+        if (key == "trailer"):
+            arrays[key] = np.frombuffer(value, dtype=np.uint8)
+        else:
+            arrays[key] = np.asarray(value)
+    arrays["version"] = np.asarray(__INDEX_VERSION)
+    temp_filename = "%s.%d.%d.tmp" % (index_filename, os.getpid(), threading.get_ident())
+    try:
+        with open(temp_filename, mode='wb') as fp:
+            np.savez_compressed(fp, **arrays)
+        os.replace(temp_filename, index_filename)
+    finally:
+        if (os.path.exists(temp_filename) is True):
+            os.remove(temp_filename)
+
+
+def load(index_filename, filename, windows=True):
+    """
+    Read an index from a file, returning None if it doesn't exist, can't be
+    read, or no longer matches the gzip file
+
+    :param windows: also load the checkpoint dictionaries, which are only
+                    needed for decompressing, defaults to True
+    :type windows: bool, optional
+    """
+    if (os.path.exists(index_filename) is False):
+        return None
+    try:
+        with np.load(index_filename, allow_pickle=False) as npz:
+            if (int(npz["version"]) != __INDEX_VERSION):
+                return None
+            index = {}
+            for key in npz.files:
+                if (key == "version" or (key == "windows" and windows is False)):
+                    continue
+                index[key] = npz[key]
+        index["trailer"] = index["trailer"].tobytes()
+        for key in ["file_size", "uncompressed_size", "span"]:
+            index[key] = int(index[key])
+    except Exception:
+        return None
+
+    # check that the gzip file hasn't changed since the index was built
+    if ((index["file_size"], index["trailer"]) != gzip_trailer(filename)):
+        return None
+
+    # return
+    return index
+
+
+def read_range(filename, index, start, end):
+    """
+    Decompress part of a gzip file, starting from the nearest checkpoint at or
+    before 'start'
+
+    :return: buffer holding at least the uncompressed bytes from start to end, and
+             the uncompressed position of the start of the buffer
+    :rtype: bytearray, int
+    """
+    lib = __load_zlib()
+    if (lib is None):
+        raise RuntimeError("gzip indexes are not supported on this system (zlib library not found)")
+
+    # find the checkpoint to start from
+    points = index["points"]
+    i = max(int(np.searchsorted(points[:, 2], start, side="right")) - 1, 0)
+    in_offset, bits, out_offset = [int(x) for x in points[i]]
+    output = bytearray(max(end - out_offset, 1))
+    output_buffer = (ctypes.c_char * len(output)).from_buffer(output)
+
+    # decompress from the checkpoint
+    stream = _ZStream()
+    __inflate_init(stream, __RAW_WBITS)
+    try:
+        with open(filename, mode='rb') as fp:
+            # the checkpoint may start part way through a byte, feed in the remaining bits
+            fp.seek(in_offset - (1 if bits > 0 else 0))
+            if (bits > 0):
+                ret = lib.inflatePrime(ctypes.byref(stream), bits, fp.read(1)[0] >> (8 - bits))
+                if (ret != __Z_OK):
+                    raise __inflate_error(stream, ret)
+            if (out_offset > 0):
+                window = index["windows"][i, WINDOW_SIZE - min(out_offset, WINDOW_SIZE):].tobytes()
+                ret = lib.inflateSetDictionary(ctypes.byref(stream), window, len(window))
+                if (ret != __Z_OK):
+                    raise __inflate_error(stream, ret)
+
+            # decompress until the output is full
+            stream.next_out = ctypes.addressof(output_buffer)
+            stream.avail_out = len(output)
+            while (stream.avail_out > 0):
+                chunk = fp.read(__READ_CHUNK_SIZE)
+                if (len(chunk) == 0):
+                    raise ValueError("gzip decompression failed: unexpected end of data")
+                stream.next_in = ctypes.cast(ctypes.c_char_p(chunk), ctypes.c_void_p)
+                stream.avail_in = len(chunk)
+                while (stream.avail_in > 0 and stream.avail_out > 0):
+                    ret = lib.inflate(ctypes.byref(stream), __Z_NO_FLUSH)
+                    if (ret == __Z_STREAM_END):
+                        break
+                    if (ret != __Z_OK):
+                        raise __inflate_error(stream, ret)
+                if (ret == __Z_STREAM_END):
+                    break
+    finally:
+        lib.inflateEnd(ctypes.byref(stream))
+        del output_buffer
+
+    # return
+    if (len(output) - stream.avail_out < end - out_offset):
+        raise ValueError("gzip decompression failed: unexpected end of data")
+    return output, out_offset
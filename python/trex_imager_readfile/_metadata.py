@@ -0,0 +1,615 @@
+"""
+Metadata formats returned by the read functions
+
+By default (metadata_format="dicts"), metadata is returned as a list holding a
+dictionary for each frame. With metadata_format="columnar", it's returned as a
+ColumnarMetadata instead: a dictionary of NumPy arrays keyed by metadata field,
+with one entry per frame in each array:
+
+  "2022-03-07 06:00:00.000000 UTC"    datetime64[us]
+  known numeric fields (ie. "42")     int64 or float64
+  anything else                       fixed-width strings
+
+Only the fields listed in __NUMBER_FIELDS are converted to numbers, each always
+to the same dtype, so that a column's dtype doesn't depend on the values that
+happened to be read, and identifiers that look like numbers (ie. "Mode unique
+ID" or "Lens Serial Number") stay strings. With metadata_format="typed", the
+known fields whose values are a number followed by a unit (ie. exposures like
+"5001.0000 ms", and temperatures like "-64C") are converted too, and the units
+are kept in the schema (the units attribute) instead of in every value:
+
+  "5001.0000 ms"                      float64, with units["..."] = "ms"
+
+to_records() gives back the same list of dictionaries as the default format.
+Usually every value of a numeric field is written the same way (ie. with the
+same number of decimal places), and is turned back into a string from its
+number. When they aren't, the original strings are kept alongside the column,
+and values that aren't numbers at all are masked out of it. Columns holding
+values that aren't strings (ie. datetimes in PNG metadata, or H5 attributes) are
+datetime64[us] if they're all datetimes, and object arrays otherwise. Frames that
+don't have a field (ie. fields that are only in the first frame of each file) are
+masked out of its column (see numpy.ma).
+
+Each worker builds the columns for its file in one pass over the frames, and
+the tables for all files are joined together at the end.
+
+With metadata_format="compact", metadata is a list with a FrameMetadata for each
+frame instead, which behaves like its dictionary would. The frames of a file that
+have the same fields share one schema, holding the fields in order along with the
+values that are the same in all of those frames (ie. the site, imager, and camera
+fields, or the file attributes of H5 files). Each frame then only keeps a tuple of
+the values that change from frame to frame. When the files are joined together,
+schemas that are the same in different files (ie. for the first frame of each PGM
+file) are shared too, along with equal strings.
+
+With metadata_format="lazy", metadata is a list with a LazyMetadata for each
+frame, which also behaves like its dictionary would. PGM frame headers are kept
+as they were read, and are only decoded the first time the frame's metadata is
+used (see _pgm.parse_header_metadata), so reads that only look at the metadata
+of a few frames don't pay for decoding the rest.
+"""
+
+import collections.abc
+import datetime
+import re
+import numpy as np
+
+# globals
+FORMATS = ["dicts", "columnar", "typed", "compact", "lazy"]
+MISSING = object()  # placeholder for a field that a frame doesn't have
+__TIMESTAMP_REGEX = re.compile(r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\.\d{6}( UTC| utc)?$")
+__TIMESTAMP_LENGTH = len("2022-03-07 06:00:00.000000")
+__NUMBER_REGEX = re.compile(r"^(-?(0|[1-9]\d*)(\.(\d+))?)( ?[A-Za-z]+)?$")
+__FLOAT_MAX_DIGITS = 15  # a float64 holds any decimal with this many significant digits exactly
+__INT_MAX_DIGITS = 18  # an int64 holds any integer with this many digits
+__NUMBER_FIELDS = {
+    # field: (dtype, whether its values have a unit)
+    "CCD xbinned": ("int64", False),
+    "CCD xsize": ("int64", True),
+    "CCD ybinned": ("int64", False),
+    "CCD ysize": ("int64", True),
+    "Calibration lambda end": ("float64", False),
+    "Calibration lambda start": ("float64", False),
+    "Calibration resolution": ("float64", False),
+    "Current CCD temperature": ("float64", True),
+    "Current HS Speed": ("float64", True),
+    "Digitemp Camera": ("float64", True),
+    "Digitemp camera": ("float64", True),
+    "Exposure plus readout": ("float64", True),
+    "Geographic latitude": ("float64", False),
+    "Geographic longitude": ("float64", False),
+    "High Capacity Toggle": ("int64", False),
+    "Mode sequence number": ("int64", False),
+    "NTP delay": ("float64", False),
+    "NTP jitter": ("float64", False),
+    "NTP offset": ("float64", False),
+    "Pixel depth": ("int64", True),
+    "Readout rate": ("float64", True),
+    "Requested Exposure": ("float64", False),
+    "Requested Pre Amp gain": ("float64", False),
+    "VS Amplitude": ("int64", False),
+    "VS Amplitude index": ("int64", False),
+    "VSSpeed": ("float64", False),
+    "VSSpeed index": ("int64", False),
+}
+
+
+class ColumnarMetadata(dict):
+    """
+    Metadata of a set of frames, as a dictionary of NumPy arrays keyed by metadata
+    field, each with one entry per frame (see metadata_format of the read functions)
+
+    Fields that some frames don't have are masked arrays (numpy.ma), with those frames
+    masked out.
+
+    :ivar num_frames: number of frames
+    :vartype num_frames: int
+    :ivar units: unit of each field whose values had their unit split off (only with
+                 metadata_format="typed"), keyed by field
+    :vartype units: dict[str, str]
+    """
+
+    def __init__(self, columns=None, num_frames=0, kinds=None):
+        dict.__init__(self, {} if columns is None else columns)
+        self.num_frames = num_frames
+        self._kinds = {} if kinds is None else kinds
+
+    @property
+    def units(self):
+        units = {}
+        for key, kind in self._kinds.items():
+            if (kind[0] == "number" and kind[2] is not None):
+                units[key] = kind[2]
+        return units
+
+    def __repr__(self):
+        return "ColumnarMetadata(%d frames, %d fields)" % (self.num_frames, len(self))
+
+    def row(self, frame):
+        """
+        Get the metadata of a single frame, as a dictionary of typed values
+
+        :param frame: frame index
+        :type frame: int
+
+        :return: metadata dictionary
+        :rtype: dict
+        """
+        metadata_dict = {}
+        for key, column in self.items():
+            if (np.ma.is_masked(column[frame]) is False):
+                metadata_dict[key] = column[frame]
+        return metadata_dict
+
+    def values_of(self, key):
+        # get the original values of a field for each frame, with MISSING for frames
+        # that don't have it
+        #
+        # NOTE: numbers that are kept along with their original values (see __build_column)
+        # already have MISSING for those frames, and may have other frames masked out too
+        kind = self._kinds[key]
+        values = original_values(self[key], kind)
+        if (kind[0] == "number" and kind[4] is not None):
+            return values
+        mask = np.ma.getmask(self[key])
+        if (mask is not np.ma.nomask):
+            for i in np.flatnonzero(mask):
+                values[i] = MISSING
+        return values
+
+    def to_records(self):
+        """
+        Get the metadata in the default format, as a dictionary for each frame holding
+        the values as they were in the files
+
+        :return: metadata dictionaries
+        :rtype: list[dict]
+        """
+        metadata_dict_list = [{} for _ in range(0, self.num_frames)]
+        for key in self.keys():
+            for i, value in enumerate(self.values_of(key)):
+                if (value is not MISSING):
+                    metadata_dict_list[i][key] = value
+        return metadata_dict_list
+
+
+class FrameMetadata(collections.abc.MutableMapping):
+    """
+    Metadata of a frame with metadata_format="compact", behaving like a dictionary
+    keyed by metadata field
+
+    The fields, and the values that are the same in all the frames of a file, are
+    kept once in a schema shared by those frames. Changing a frame's metadata gives
+    it its own dictionary, leaving the other frames as they were. Use dict() to get
+    a plain dictionary (ie. for json.dumps()).
+    """
+
+    __slots__ = ("_schema", "_values", "_dict")
+
+    def __init__(self, schema, values):
+        # NOTE: the schema is a tuple of the fields in order, and a dictionary giving
+        # (True, value) for each shared field, or (False, index into values) otherwise
+        self._schema = schema
+        self._values = values
+        self._dict = None
+
+    def __getitem__(self, key):
+        if (self._dict is not None):
+            return self._dict[key]
+        shared, value = self._schema[1][key]
+        if (shared is True):
+            return value
+        return self._values[value]
+
+    def __setitem__(self, key, value):
+        if (self._dict is None):
+            self._dict = self.copy()
+        self._dict[key] = value
+
+    def __delitem__(self, key):
+        if (self._dict is None):
+            self._dict = self.copy()
+        del self._dict[key]
+
+    def __contains__(self, key):
+        if (self._dict is not None):
+            return key in self._dict
+        return key in self._schema[1]
+
+    def __iter__(self):
+        if (self._dict is not None):
+            return iter(self._dict)
+        return iter(self._schema[0])
+
+    def __len__(self):
+        if (self._dict is not None):
+            return len(self._dict)
+        return len(self._schema[0])
+
+    def __repr__(self):
+        return repr(self.copy())
+
+    def copy(self):
+        """
+        Get the metadata as a plain dictionary
+
+        :return: metadata dictionary
+        :rtype: dict
+        """
+        if (self._dict is not None):
+            return self._dict.copy()
+        return dict([(key, self[key]) for key in self._schema[0]])
+
+
+class LazyMetadata(collections.abc.MutableMapping):
+    """
+    Metadata of a frame with metadata_format="lazy", behaving like a dictionary keyed
+    by metadata field, that isn't decoded until it's first used
+
+    The frame header is kept as it was read, and the first time the metadata is looked
+    at it's decoded into a dictionary, which is kept instead. Use dict() to get a plain
+    dictionary (ie. for json.dumps()).
+
+    :ivar decoded: whether the metadata has been decoded yet
+    :vartype decoded: bool
+    """
+
+    __slots__ = ("_decode", "_args", "_dict")
+
+    def __init__(self, decode=None, args=None, metadata_dict=None):
+        self._decode = decode
+        self._args = args
+        self._dict = metadata_dict
+
+    @property
+    def decoded(self):
+        return self._args is None
+
+    def _metadata_dict(self):
+        # decode the metadata the first time it's used
+        #
+        # NOTE: the header is only dropped once the dictionary is in place, so that a frame
+        # used by several threads at once is at worst decoded twice
+        args = self._args
+        if (args is not None):
+            self._dict = self._decode(*args)
+            self._args = None
+        return self._dict
+
+    def __getitem__(self, key):
+        return self._metadata_dict()[key]
+
+    def __setitem__(self, key, value):
+        self._metadata_dict()[key] = value
+
+    def __delitem__(self, key):
+        del self._metadata_dict()[key]
+
+    def __contains__(self, key):
+        return key in self._metadata_dict()
+
+    def __iter__(self):
+        return iter(self._metadata_dict())
+
+    def __len__(self):
+        return len(self._metadata_dict())
+
+    def __repr__(self):
+        return repr(self._metadata_dict())
+
+    def copy(self):
+        """
+        Get the metadata as a plain dictionary
+
+        :return: metadata dictionary
+        :rtype: dict
+        """
+        return self._metadata_dict().copy()
+
+
+def check_format(metadata_format):
+    """
+    Check the metadata_format parameter of a read function
+
+    :return: metadata format
+    :rtype: str
+    """
+    if (metadata_format not in FORMATS):
+        raise ValueError("Unknown metadata format '%s', must be one of: %s" % (metadata_format, ", ".join(FORMATS)))
+    return metadata_format
+
+
+def __number_match(value, field):
+    # match a value of a known numeric field, or None if it isn't a number of the field's dtype
+    match = __NUMBER_REGEX.match(value)
+    if (match is None or (match.group(5) is not None and field[1] is False)):
+        return None
+    if (field[0] == "int64" and (match.group(4) is not None or len(match.group(2)) > __INT_MAX_DIGITS)):
+        return None
+    return match
+
+
+def __number_kind(key, values, typed):
+    # work out how to store a known numeric field, or None if it's kept as strings
+    #
+    # NOTE: the values can be turned back into strings from their numbers if they're all
+    # written the same way (same decimal places and unit), and each number is held exactly
+    field = __NUMBER_FIELDS.get(key)
+    if (field is None or (field[1] is True and typed is False)):
+        return None
+    formats = set()
+    units = set()
+    exact = True
+    for v in values:
+        match = __number_match(v, field)
+        if (match is None):
+            exact = False
+            continue
+        decimals = None if match.group(4) is None else len(match.group(4))
+        formats.add((decimals, match.group(5) or ""))
+        units.add((match.group(5) or "").strip())
+        if (match.group(1) == "-0" or (field[0] == "float64" and len(match.group(2)) + (decimals or 0) > __FLOAT_MAX_DIGITS)):
+            exact = False
+    value_format = formats.pop() if (exact is True and len(formats) == 1) else None
+    unit = units.pop() if (field[1] is True and len(units) == 1) else None
+    return ("number", field, unit, value_format, None)
+
+
+def __column_kind(key, values, typed):
+    # work out how to store a column holding the given values (without any missing ones)
+    if (all([isinstance(v, str) for v in values]) is True):
+        match = __TIMESTAMP_REGEX.match(values[0])
+        if (match is not None):
+            suffix = match.group(1) or ""
+            if (all([v.endswith(suffix) and __TIMESTAMP_REGEX.match(v) is not None for v in values]) is True
+                    and all([len(v) == __TIMESTAMP_LENGTH + len(suffix) for v in values]) is True):
+                return ("timestamp", suffix)
+        kind = __number_kind(key, values, typed)
+        if (kind is not None):
+            return kind
+        return ("str", None)
+    if (all([isinstance(v, datetime.datetime) and v.tzinfo is None for v in values]) is True):
+        return ("datetime", None)
+    return ("object", None)
+
+
+def __to_array(values, kind):
+    # convert the values of a column to an array, missing values are given a placeholder
+    if (kind[0] == "timestamp"):
+        return np.array(["NaT" if v is MISSING else v[0:__TIMESTAMP_LENGTH] for v in values], dtype="datetime64[us]")
+    elif (kind[0] == "number" and kind[3] is not None):
+        # NOTE: the values are all written the same way, so the unit is cut off each one, and
+        # all the numbers are then converted at once
+        suffix_length = len(kind[3][1])
+        return np.array(["0" if v is MISSING else v[0:len(v) - suffix_length] for v in values]).astype(kind[1][0])
+    elif (kind[0] == "number"):
+        numbers = []
+        for v in values:
+            match = None if v is MISSING else __number_match(v, kind[1])
+            numbers.append("0" if match is None else match.group(1))
+        return np.array(numbers).astype(kind[1][0])
+    elif (kind[0] == "str"):
+        return np.array(["" if v is MISSING else v for v in values], dtype=str)
+    elif (kind[0] == "datetime"):
+        return np.array([None if v is MISSING else v for v in values], dtype="datetime64[us]")
+    array = np.empty(len(values), dtype=object)
+    for i in range(0, len(values)):
+        array[i] = None if values[i] is MISSING else values[i]
+    return array
+
+
+def original_values(column, kind):
+    # turn a column back into the values as they were in the files
+    data = np.ma.getdata(column)
+    if (kind[0] == "timestamp"):
+        return [v.replace("T", " ") + kind[1] for v in np.datetime_as_string(data, unit="us").tolist()]
+    elif (kind[0] == "number" and kind[3] is not None):
+        value_format = ("%d" if kind[3][0] is None else "%%.%df" % (kind[3][0])) + kind[3][1]
+        return [value_format % (v) for v in data.tolist()]
+    elif (kind[0] == "number"):
+        return list(kind[4])
+    return data.tolist()
+
+
+def __build_column(key, values, typed):
+    # build a column from the values of a field for each frame
+    #
+    # NOTE: numbers that can't be turned back into their strings keep the strings in their
+    # kind, and any that aren't numbers are masked out along with the missing values
+    present = [v for v in values if v is not MISSING]
+    kind = __column_kind(key, present, typed)
+    if (kind[0] == "number" and kind[3] is None):
+        kind = kind[0:4] + (tuple(values), )
+    array = __to_array(values, kind)
+    if (kind[0] == "number" and kind[3] is None):
+        mask = np.array([v is MISSING or __number_match(v, kind[1]) is None for v in values], dtype=bool)
+        if (bool(mask.any()) is True):
+            array = np.ma.MaskedArray(array, mask=mask)
+    elif (len(present) < len(values)):
+        array = np.ma.MaskedArray(array, mask=np.array([v is MISSING for v in values], dtype=bool))
+    return array, kind
+
+
+def from_dicts(metadata_dict_list, typed=False):
+    """
+    Build a ColumnarMetadata from a list of metadata dictionaries, in one pass over
+    the frames
+
+    :param typed: split the units off values that are a number followed by a unit,
+                  defaults to False
+    :type typed: bool, optional
+
+    :return: columnar metadata
+    :rtype: ColumnarMetadata
+    """
+    num_frames = len(metadata_dict_list)
+    field_values = {}
+    for i in range(0, num_frames):
+        for key, value in metadata_dict_list[i].items():
+            values = field_values.get(key)
+            if (values is None):
+                values = [MISSING] * num_frames
+                field_values[key] = values
+            values[i] = value
+    columns = {}
+    kinds = {}
+    for key, values in field_values.items():
+        columns[key], kinds[key] = __build_column(key, values, typed)
+    return ColumnarMetadata(columns, num_frames, kinds)
+
+
+def __concatenate_tables(tables, typed):
+    # join the tables of several files together
+    keys = []
+    for table in tables:
+        for key in table.keys():
+            if (key not in keys):
+                keys.append(key)
+    columns = {}
+    kinds = {}
+    for key in keys:
+        table_kinds = set([table._kinds[key] for table in tables if key in table])
+        if (len(table_kinds) == 1):
+            # same kind of column in every file, join the arrays
+            kind = table_kinds.pop()
+            arrays = []
+            for table in tables:
+                if (key in table):
+                    arrays.append(table[key])
+                elif (table.num_frames > 0):
+                    arrays.append(np.ma.MaskedArray(__to_array([MISSING] * table.num_frames, kind), mask=True))
+            if (any([np.ma.isMaskedArray(a) for a in arrays]) is True):
+                columns[key] = np.ma.concatenate(arrays)
+            else:
+                columns[key] = np.concatenate(arrays)
+            kinds[key] = kind
+        else:
+            # the files disagree on how to store it, so start again from the original values
+            values = []
+            for table in tables:
+                values.extend(table.values_of(key) if key in table else [MISSING] * table.num_frames)
+            columns[key], kinds[key] = __build_column(key, values, typed)
+    return ColumnarMetadata(columns, sum([table.num_frames for table in tables]), kinds)
+
+
+def __same_value(value, other):
+    # check if two values are the same, only comparing the types whose comparisons give a bool
+    if (value is other):
+        return True
+    if (type(value) is not type(other) or isinstance(value, (str, bytes, int, float, datetime.datetime, np.generic)) is False):
+        return False
+    return bool(value == other)
+
+
+def to_compact(metadata_dict_list):
+    """
+    Build the FrameMetadata of a file's frames from their metadata dictionaries, with
+    one schema for each set of fields
+
+    :return: metadata of each frame
+    :rtype: list[FrameMetadata]
+    """
+    # group the frames by their fields
+    frame_groups = {}
+    for i in range(0, len(metadata_dict_list)):
+        keys = tuple(metadata_dict_list[i].keys())
+        if (keys in frame_groups):
+            frame_groups[keys].append(i)
+        else:
+            frame_groups[keys] = [i]
+
+    # build a schema for each group, and keep the values that vary in each frame
+    #
+    # NOTE: a frame that is the only one with its fields keeps all its values, so that its
+    # schema is the same as the other files' (see __share_schemas)
+    compact_list = [None] * len(metadata_dict_list)
+    for keys, frames in frame_groups.items():
+        fields = {}
+        varying_keys = []
+        for key in keys:
+            value = metadata_dict_list[frames[0]][key]
+            if (len(frames) > 1 and all([__same_value(metadata_dict_list[i][key], value) for i in frames[1:]]) is True):
+                fields[key] = (True, value)
+            else:
+                fields[key] = (False, len(varying_keys))
+                varying_keys.append(key)
+        schema = (keys, fields)
+        for i in frames:
+            metadata_dict = metadata_dict_list[i]
+            compact_list[i] = FrameMetadata(schema, tuple([metadata_dict[key] for key in varying_keys]))
+    return compact_list
+
+
+def __shared_value(strings, value):
+    # get the same object for all equal strings
+    if (type(value) is str):
+        return strings.setdefault(value, value)
+    return value
+
+
+def __share_schemas(parts):
+    # join the frames of several files, sharing the schemas that are the same in different
+    # files (the workers build them for each file separately), and the strings that are equal
+    strings = {}
+    file_schemas = {}
+    schemas = {}
+    compact_list = []
+    for part in parts:
+        for frame_metadata in part:
+            if (id(frame_metadata._schema) in file_schemas):
+                schema = file_schemas[id(frame_metadata._schema)][1]
+            else:
+                keys = tuple([__shared_value(strings, key) for key in frame_metadata._schema[0]])
+                fields = {}
+                for key in keys:
+                    shared, value = frame_metadata._schema[1][key]
+                    fields[key] = (shared, __shared_value(strings, value) if shared is True else value)
+
+                # NOTE: equal strings are the same object by now, so shared values are
+                # compared by identity, same as in to_compact() for anything else
+                signature = (keys, tuple([(fields[key][0], id(fields[key][1]) if fields[key][0] is True else fields[key][1]) for key in keys]))
+                if (signature not in schemas):
+                    schemas[signature] = (keys, fields)
+                schema = schemas[signature]
+                file_schemas[id(frame_metadata._schema)] = (frame_metadata._schema, schema)
+            frame_metadata._schema = schema
+            frame_metadata._values = tuple([__shared_value(strings, value) for value in frame_metadata._values])
+            compact_list.append(frame_metadata)
+    return compact_list
+
+
+def convert(metadata_dict_list, metadata_format):
+    """
+    Convert the metadata dictionaries of a file to the given format (used by the workers)
+    """
+    if (metadata_format in ["columnar", "typed"]):
+        return from_dicts(metadata_dict_list, typed=(metadata_format == "typed"))
+    elif (metadata_format == "compact"):
+        return to_compact(metadata_dict_list)
+    elif (metadata_format == "lazy"):
+        # NOTE: frames that were decoded as they were read (ie. PNG and H5 metadata, or PGM
+        # headers that had to be checked) are given as already decoded
+        return [m if isinstance(m, LazyMetadata) is True else LazyMetadata(metadata_dict=m) for m in metadata_dict_list]
+    return metadata_dict_list
+
+
+def combine(parts, metadata_format):
+    """
+    Join the metadata of several files, each in the given format, into one
+
+    :return: metadata, in the given format
+    :rtype: list[dict], ColumnarMetadata, list[FrameMetadata], or list[LazyMetadata]
+    """
+    if (metadata_format in ["columnar", "typed"]):
+        parts = [p for p in parts if isinstance(p, ColumnarMetadata) is True and p.num_frames > 0]
+        if (len(parts) == 0):
+            return ColumnarMetadata()
+        if (len(parts) == 1):
+            return parts[0]
+        return __concatenate_tables(parts, metadata_format == "typed")
+    elif (metadata_format == "compact"):
+        return __share_schemas(parts)
+    metadata_dict_list = []
+    for p in parts:
+        metadata_dict_list.extend(p)
+    return metadata_dict_list
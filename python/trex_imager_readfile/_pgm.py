@@ -0,0 +1,1295 @@
+"""
+Shared engine for reading stacked PGM files (used by the blueline, nir,
+spectrograph and rgb readers)
+
+A stacked PGM file is a sequence of frames, each of which looks like:
+
+    P5\\n
+    #"<key>" <value>\\n      (repeated, one line per metadata entry)
+    <width> <height>\\n
+    65535\\n
+    <width * height * 2 bytes of big endian pixel data>
+
+Instead of walking the file line by line, the whole file is loaded into a
+single buffer and the frame boundaries are located with bytes.find(). Each
+frame then only costs a few slice operations. With lazy_metadata, each frame
+header is kept as it was read, and is only parsed the first time its metadata
+is used (see parse_header_metadata).
+
+PGM.gz files can also have a sidecar gzip index (see _gzindex), which stores
+the frame positions along with decompression checkpoints, so that frames can
+be read without decompressing the whole file.
+
+PGM.gz files can also be decoded as a pipeline (see decode), where a second
+thread reads and decompresses the file a chunk at a time while the frames that
+have arrived are parsed and copied out, so that I/O waits, zlib, and the
+copies overlap instead of running one after the other.
+"""
+
+import mmap
+import os
+import queue
+import signal
+import threading
+import zlib
+import numpy as np
+from multiprocessing import Pool
+from . import _decompress
+from . import _engine
+from . import _gzindex
+from . import _metadata
+
+# globals
+__MAXVAL_MARKER = b"\n65535\n"
+__MAXVAL_MARKER_LEN = len(__MAXVAL_MARKER)
+__METADATA_LINE_PREFIX = b'#"'
+__TIMESTAMP_KEY = b'#"Image request start"'
+__MIN_HEADER_SIZE = len(b"P5\n1 1\n65535\n")
+__PROBE_READ_SIZE = 65536  # enough to hold the first frame header
+__GZIP_WBITS = 31  # zlib window bits for gzip header and trailer
+__INDEX_SUFFIX = ".idx"
+__PIPELINE_READ_SIZE = 262144  # compressed bytes read at a time by the pipeline's decompression thread
+__PIPELINE_CHUNK_SIZE = 1048576  # most decompressed bytes handed over at a time
+__PIPELINE_QUEUE_SIZE = 4  # most decompressed chunks waiting to be parsed
+__PIPELINE_PUT_TIMEOUT = 0.1  # seconds between checks of whether the pipeline has been stopped
+
+
+def uids_from_filename(filename):
+    """
+    Derive the site and device UIDs from a filename, used when the
+    metadata doesn't include them (ie. dark frames, or unstacked files)
+    """
+    site_uid = ""
+    device_uid = ""
+    file_split = os.path.basename(filename).split('_')
+    if (len(file_split) == 5):
+        # is a regular file
+        site_uid = file_split[2]
+        device_uid = file_split[3]
+    elif (len(file_split) > 5):
+        # is likely a dark frame or a unstacked frame
+        site_uid = file_split[3]
+        device_uid = file_split[4]
+    return site_uid, device_uid
+
+
+def load(filename, use_mmap=False, gzip_backend="zlib", gzip_verify=True):
+    """
+    Read the entire (decompressed) contents of a PGM or PGM.gz file into a
+    single bytes object
+
+    With use_mmap, uncompressed PGM files are memory mapped instead of read,
+    and a read-only mmap object is returned. Call release() on the result
+    once finished with it. PGM.gz files are decompressed using the given
+    backend (see _decompress).
+    """
+    if (filename.endswith("pgm.gz")):
+        contents, _ = _decompress.decompress_file(filename, backend=gzip_backend, verify=gzip_verify)
+        return contents
+    if (use_mmap is True and filename.endswith("pgm")):
+        with open(filename, mode='rb') as fp:
+            return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    with open(filename, mode='rb') as fp:
+        return fp.read()
+
+
+def release(buffer):
+    """
+    Release a buffer returned by load(), closing it if it's memory mapped
+    """
+    if (isinstance(buffer, mmap.mmap) is True):
+        try:
+            buffer.close()
+        except BufferError:
+            # there are still arrays using the mapping, it'll be closed once they're gone
+            pass
+
+
+def __parse_frame_header(buffer, position):
+    # find the header of the frame starting at position, returning None if there isn't one
+    #
+    # the max value line always directly precedes the pixel data
+    maxval_idx = buffer.find(__MAXVAL_MARKER, position)
+    if (maxval_idx == -1):
+        return None
+
+    # the dimensions line is directly before the max value line, and marks the
+    # end of the frame header
+    header_end = buffer.rfind(b"\n", position, maxval_idx) + 1
+    if (header_end == 0):
+        header_end = position
+    try:
+        dimensions = buffer[header_end:maxval_idx].split()
+        width = int(dimensions[0])
+        height = int(dimensions[1])
+    except Exception as e:
+        raise ValueError("unable to parse image dimensions: %s" % (str(e))) from e
+
+    # return
+    return header_end, width, height, maxval_idx + __MAXVAL_MARKER_LEN
+
+
+def scan(buffer, max_frames=None):
+    """
+    Find all frames in a buffer of stacked PGM images, or only the first max_frames
+
+    :return: list of frames as tuples of (header_start, header_end, width, height,
+             pixel_start), and an error message if the buffer ended part way
+             through a frame ('' otherwise)
+    :rtype: list[tuple], str
+    """
+    frames = []
+    error_message = ""
+    position = 0
+    buffer_len = len(buffer)
+    while (position < buffer_len):
+        try:
+            frame_header = __parse_frame_header(buffer, position)
+        except Exception as e:
+            error_message = "image data read failure: %s" % (str(e))
+            break
+        if (frame_header is None):
+            break
+        header_end, width, height, pixel_start = frame_header
+
+        # make sure the full pixel block is present
+        pixel_end = pixel_start + width * height * 2  # 16-bit image depth
+        if (pixel_end > buffer_len):
+            error_message = "image data read failure: expected %d bytes of image data, found %d" % (
+                pixel_end - pixel_start,
+                buffer_len - pixel_start,
+            )
+            break
+
+        # add frame
+        frames.append((position, header_end, width, height, pixel_start))
+        position = pixel_end
+
+        # stop once enough frames have been found
+        if (max_frames is not None and len(frames) >= max_frames):
+            break
+
+    # return
+    return frames, error_message
+
+
+def probe(filename, frames=None, gzip_index=False, start=None, end=None):
+    """
+    Get the frame dimensions of a PGM file and an upper bound on the number of
+    frames in it, reading only the start (and for gzipped files, the end) of the file
+
+    The number of frames is estimated from the uncompressed file size; for PGM.gz
+    files that's the ISIZE field in the gzip trailer. Frame headers vary in length
+    (the first one is usually much longer than the rest), so the estimate assumes
+    every frame has the smallest possible header. Frame headers are tiny compared to
+    the pixel data, so this is almost always exact.
+
+    If gzip_index is set and the file already has an index, the frame dimensions
+    and exact number of frames are taken from the index instead. The number returned
+    is how many of those frames the frames selection (see _engine.frame_selection)
+    picks out, and if the index is used, how many of them are also in the time window.
+
+    :return: frame shape (height, width), number of frames
+    :rtype: tuple, int
+    """
+    # use the index if there is one
+    if (gzip_index is not False and filename.endswith("pgm.gz")):
+        index = _gzindex.load(index_filename(filename, gzip_index), filename, windows=False)
+        if (index is not None and len(index["frames"]) > 0):
+            timestamps = index["timestamps"].tolist()
+            num_frames = 0
+            for i in _engine.frame_indices(frames, len(index["frames"])):
+                if (_engine.in_time_window(timestamps[i], start, end) is True):
+                    num_frames += 1
+            return (int(index["frames"][0][3]), int(index["frames"][0][2])), num_frames
+
+    # read the start of the file, and get the uncompressed size
+    with open(filename, mode='rb') as fp:
+        head = fp.read(__PROBE_READ_SIZE)
+        if (filename.endswith("pgm.gz")):
+            fp.seek(-4, os.SEEK_END)
+            total_size = int.from_bytes(fp.read(4), "little")
+            head = zlib.decompressobj(__GZIP_WBITS).decompress(head)
+        elif (filename.endswith("pgm")):
+            total_size = os.fstat(fp.fileno()).st_size
+        else:
+            raise ValueError("Unrecognized file type")
+
+    # parse the first frame header
+    frame_header = __parse_frame_header(head, 0)
+    if (frame_header is None):
+        raise ValueError("no image data")
+    _, width, height, _ = frame_header
+
+    # estimate number of frames, and how many of them are selected
+    num_frames = max(1, total_size // (width * height * 2 + __MIN_HEADER_SIZE))
+    num_frames = len(_engine.frame_indices(frames, num_frames))
+
+    # return
+    return (height, width), num_frames
+
+
+def frame_timestamp(buffer, frame):
+    """
+    Get the 'Image request start' timestamp of a frame, without parsing the rest of
+    its metadata
+
+    :return: timestamp, or None if the frame doesn't have one
+    :rtype: datetime.datetime
+    """
+    key_idx = buffer.find(__TIMESTAMP_KEY, frame[0], frame[1])
+    if (key_idx == -1):
+        return None
+    line_end = buffer.find(b"\n", key_idx, frame[1])
+    return _engine.parse_timestamp(bytes(buffer[key_idx + len(__TIMESTAMP_KEY):line_end]))
+
+
+def index_filename(filename, gzip_index=True):
+    """
+    Get the filename of the sidecar gzip index for a PGM.gz file. The index
+    is kept next to the file, unless gzip_index is a directory to keep it in.
+    """
+    if (isinstance(gzip_index, str) is True):
+        return os.path.join(gzip_index, "%s%s" % (os.path.basename(filename), __INDEX_SUFFIX))
+    return "%s%s" % (filename, __INDEX_SUFFIX)
+
+
+def __build_index(filename, span):
+    # build an index, adding the frame positions and timestamps to it
+    index, contents = _gzindex.build(filename, span=span)
+    frames, error_message = scan(contents)
+    index["frames"] = np.array(frames, dtype=np.int64).reshape((len(frames), 5))
+    index["timestamps"] = np.array([frame_timestamp(contents, frame) for frame in frames], dtype="datetime64[us]")
+    index["error_message"] = error_message
+    return index, contents
+
+
+def get_index(filename, gzip_index=True, build=True, span=_gzindex.DEFAULT_SPAN):
+    """
+    Get the gzip index for a PGM.gz file, loading it from its sidecar file, or if
+    there isn't one (or it's out of date) building and saving it
+
+    :return: index dictionary (None if there's no usable index), and the decompressed
+             contents of the file if the index had to be built (None otherwise)
+    :rtype: dict, bytearray
+    """
+    if (_gzindex.available() is False):
+        return None, None
+    contents = None
+    index = _gzindex.load(index_filename(filename, gzip_index), filename)
+    if (index is None):
+        if (build is False):
+            return None, None
+        try:
+            index, contents = __build_index(filename, span)
+        except Exception:
+            return None, None
+        try:
+            _gzindex.save(index, index_filename(filename, gzip_index))
+        except OSError:
+            # the index is still usable if it can't be saved (ie. read-only data directory)
+            pass
+    index["frames"] = [tuple(frame) for frame in index["frames"].tolist()]
+    index["timestamps"] = index["timestamps"].tolist()
+    index["error_message"] = str(index["error_message"])
+    return index, contents
+
+
+def __build_index_worker(task):
+    # build the index for a single file
+    try:
+        if (task["filename"].endswith("pgm.gz") is False):
+            raise ValueError("only PGM.gz files can be indexed")
+        index = None
+        if (task["overwrite"] is False):
+            index = _gzindex.load(index_filename(task["filename"], task["gzip_index"]), task["filename"], windows=False)
+        if (index is None):
+            index, _ = __build_index(task["filename"], task["span"])
+            _gzindex.save(index, index_filename(task["filename"], task["gzip_index"]))
+        return ""
+    except Exception as e:
+        if (task["quiet"] is False):
+            print("Failed to index file '%s' " % (task["filename"]))
+        return "failed to index file: %s" % (str(e))
+
+
+def build_index(file_list, workers=1, index_dir=None, span=_gzindex.DEFAULT_SPAN, overwrite=False, quiet=False):
+    """
+    Build gzip indexes for a set of PGM.gz files ahead of time
+
+    An index lets frames of a PGM.gz file be read without decompressing the whole
+    file. Each index is saved in a sidecar file named after the PGM.gz file with a
+    '.idx' suffix, and is used by read functions called with gzip_index set, and
+    by open_indexed(). Files that already have an up to date index are skipped.
+
+    :param file_list: filename or list of filenames
+    :type file_list: str
+    :param workers: number of worker processes to spawn, defaults to 1
+    :type workers: int, optional
+    :param index_dir: directory to save the indexes in, defaults to next to each file
+    :type index_dir: str, optional
+    :param span: approximate number of uncompressed bytes between decompression
+                 checkpoints; smaller values give faster frame access but larger
+                 index files, defaults to 262144
+    :type span: int, optional
+    :param overwrite: rebuild indexes that already exist, defaults to False
+    :type overwrite: bool, optional
+    :param quiet: reduce output while indexing files
+    :type quiet: bool, optional
+
+    :return: index filenames, and problematic files
+    :rtype: list[str], list[dict]
+    """
+    # if input is just a single file name in a string, convert to a list to be fed to the workers
+    if isinstance(file_list, str):
+        file_list = [file_list]
+    if (_gzindex.available() is False):
+        raise RuntimeError("gzip indexes are not supported on this system (zlib library not found)")
+    if (index_dir is not None):
+        os.makedirs(index_dir, exist_ok=True)
+
+    # set up the tasks
+    tasks = []
+    for f in file_list:
+        tasks.append({
+            "filename": f,
+            "gzip_index": index_dir if index_dir is not None else True,
+            "span": span,
+            "overwrite": overwrite,
+            "quiet": quiet,
+        })
+
+    # build indexes
+    if (workers > 1):
+        try:
+            # set up process pool (ignore SIGINT before spawning pool so child processes inherit SIGINT handler)
+            original_sigint_handler = signal.signal(signal.SIGINT, signal.SIG_IGN)
+            pool = Pool(processes=workers)
+            signal.signal(signal.SIGINT, original_sigint_handler)  # restore SIGINT handler
+        except ValueError:
+            # likely the call is being used within a context that doesn't support the usage
+            # of signals in this way, proceed without it
+            pool = Pool(processes=workers)
+        try:
+            results = pool.map(__build_index_worker, tasks)
+        except KeyboardInterrupt:
+            pool.terminate()  # gracefully kill children
+            return [], []
+        else:
+            pool.close()
+            pool.join()
+    else:
+        results = [__build_index_worker(t) for t in tasks]
+
+    # check results
+    index_file_list = []
+    problematic_file_list = []
+    for i in range(0, len(tasks)):
+        if (results[i] == ""):
+            index_file_list.append(index_filename(tasks[i]["filename"], tasks[i]["gzip_index"]))
+        else:
+            problematic_file_list.append({
+                "filename": tasks[i]["filename"],
+                "error_message": results[i],
+            })
+
+    # return
+    return index_file_list, problematic_file_list
+
+
+def frame_pixels(buffer, frame, dtype):
+    """
+    Get a frame's pixel data as a (height, width) array view into the buffer
+    """
+    width = frame[2]
+    height = frame[3]
+    return np.frombuffer(buffer, dtype=dtype, count=width * height, offset=frame[4]).reshape((height, width))
+
+
+def parse_metadata(buffer, frame, site_uid=None, device_uid=None, duplicates_as_list=False):
+    """
+    Parse the metadata lines of a single frame header into a dictionary
+
+    When site_uid and device_uid are given, they are injected into the dictionary
+    if the header doesn't include them. If the header does include them, they are
+    returned so they can be carried forward to the next frame.
+
+    :return: metadata dictionary, site UID, device UID, list of lines that failed
+             to decode along with the error
+    :rtype: dict, str, str, list[tuple]
+    """
+    metadata_dict = {}
+    failed_lines = []
+    for line in buffer[frame[0]:frame[1]].split(b"\n"):
+        # metadata lines start with #"<key>"
+        if (line.startswith(__METADATA_LINE_PREFIX) is False):
+            continue
+        try:
+            line_decoded = line.decode("ascii")
+        except Exception as e:
+            # skip metadata line if it can't be decoded, likely corrupt file
+            failed_lines.append((line, e))
+            continue
+
+        # split the key and value out of the metadata line
+        line_decoded_split = line_decoded.split('"')
+        key = line_decoded_split[1]
+        value = line_decoded_split[2].strip()
+
+        # add entry to dictionary
+        if (duplicates_as_list is True and key in metadata_dict):
+            # key already exists, turn existing value into list and append new value
+            if (isinstance(metadata_dict[key], list)):
+                metadata_dict[key].append(value)
+            else:
+                metadata_dict[key] = [metadata_dict[key], value]
+        else:
+            metadata_dict[key] = value
+
+        # set the site/device uids, or inject the site and device UIDs if they are missing
+        if (site_uid is not None):
+            if ("Site unique ID" not in metadata_dict):
+                metadata_dict["Site unique ID"] = site_uid
+            else:
+                site_uid = metadata_dict["Site unique ID"]
+        if (device_uid is not None):
+            if ("Imager unique ID" not in metadata_dict):
+                metadata_dict["Imager unique ID"] = device_uid
+            else:
+                device_uid = metadata_dict["Imager unique ID"]
+
+    # return
+    return metadata_dict, site_uid, device_uid, failed_lines
+
+
+def parse_header_metadata(header, site_uid=None, device_uid=None, duplicates_as_list=False):
+    """
+    Parse the metadata lines of a frame header that was kept as it was read (see
+    lazy_metadata of decode) into a dictionary
+
+    :return: metadata dictionary
+    :rtype: dict
+    """
+    metadata_dict, _, _, _ = parse_metadata(
+        header,
+        (0, len(header)),
+        site_uid=site_uid,
+        device_uid=device_uid,
+        duplicates_as_list=duplicates_as_list,
+    )
+    return metadata_dict
+
+
+def __carried_uid(header, key, uid):
+    # get the UID that parse_metadata() would carry forward from a frame header
+    if (uid is None):
+        return None
+    position = header.rfind(b'\n#"' + key + b'"')
+    if (position == -1):
+        return uid
+    line_end = header.find(b"\n", position + 1)
+    if (line_end == -1):
+        line_end = len(header)
+    return header[position + 1:line_end].decode("ascii").split('"')[2].strip()
+
+
+def __keep_header(frame_buffer, frame, site_uid, device_uid, duplicates_as_list):
+    # keep a frame header to be parsed the first time its metadata is used, returning its
+    # LazyMetadata (None if it has to be parsed now), and the site and device UIDs to carry
+    # forward
+    #
+    # NOTE: parse_metadata() carries forward the last value a header gives for each UID, so
+    # only those lines are looked at now. Headers that aren't ASCII are parsed now, so that
+    # the lines that fail to decode are reported as usual, as are headers giving the UIDs
+    # with duplicates_as_list when there are UIDs to inject (which they could be turned into
+    # lists along with).
+    header = bytes(frame_buffer[frame[0]:frame[1]])
+    has_uids = (b'\n#"Site unique ID"' in header or b'\n#"Imager unique ID"' in header)
+    injects_uids = (site_uid is not None or device_uid is not None)
+    if (header.isascii() is False or header.startswith(__METADATA_LINE_PREFIX) is True
+            or (has_uids is True and duplicates_as_list is True and injects_uids is True)):
+        return None, site_uid, device_uid
+    lazy_metadata = _metadata.LazyMetadata(parse_header_metadata, (header, site_uid, device_uid, duplicates_as_list))
+    if (has_uids is True):
+        site_uid = __carried_uid(header, b"Site unique ID", site_uid)
+        device_uid = __carried_uid(header, b"Imager unique ID", device_uid)
+    return lazy_metadata, site_uid, device_uid
+
+
+def __selection_end(selection):
+    # get the number of frames from the start of the file that a selection needs, or None
+    # if that depends on how many frames the file has (ie. it counts back from the end)
+    if (selection is None):
+        return None
+    if (isinstance(selection, slice) is True):
+        if (selection.step is None or selection.step > 0):
+            return selection.stop if (selection.stop is not None and selection.stop >= 0) else None
+        return selection.start + 1 if (selection.start is not None and selection.start >= 0) else None
+    if (len(selection) > 0 and min(selection) < 0):
+        return None
+    return max(selection) + 1 if len(selection) > 0 else 0
+
+
+def __load_start(filename, num_frames=None, end=None, gzip_backend="zlib", gzip_verify=True):
+    # decompress only as much of the start of a PGM.gz file as is needed to hold its first
+    # num_frames frames, or its frames before the end of the time window (frames are in
+    # time order), doubling the amount decompressed each time it's not enough. Also returns
+    # whether the whole file ended up being decompressed, and the backend that was used.
+    with open(filename, mode='rb') as fp:
+        contents = fp.read()
+    decompressor, backend = _decompress.decompressobj(gzip_backend)
+    buffer = bytearray()
+    size = __PROBE_READ_SIZE
+    while True:
+        buffer += decompressor.decompress(contents, size)
+        contents = decompressor.unconsumed_tail
+        if (decompressor.eof is True or len(contents) == 0):
+            break
+        frames, _ = scan(buffer, max_frames=num_frames)
+        if (num_frames is not None and len(frames) >= num_frames):
+            break
+        if (end is not None and len(frames) > 0):
+            timestamp = frame_timestamp(buffer, frames[-1])
+            if (timestamp is not None and timestamp >= end):
+                break
+        size = len(buffer)
+    if (decompressor.eof is True and len(decompressor.unused_data.lstrip(b"\x00")) > 0):
+        # more than one gzip member, just decompress the whole file
+        buffer, backend = _decompress.decompress_file(filename, backend=gzip_backend, verify=gzip_verify)
+        return buffer, True, backend
+    return buffer, (decompressor.eof is True or len(contents) == 0), backend
+
+
+def __indexed_frames(filename, index, frames, pixels=True):
+    # decompress the part of the file each frame is in using the index, yielding the buffer
+    # and the frame's position in it. Without pixels, only the frame headers are decompressed.
+    #
+    # NOTE: the buffer starts at the index checkpoint before the frame, so it's reused for
+    # following frames whenever they're in it too
+    buffer = None
+    base = 0
+    for frame in frames:
+        start = frame[0]
+        end = frame[4] + frame[2] * frame[3] * 2 if pixels is True else frame[1]
+        if (buffer is None or start < base or end > base + len(buffer)):
+            buffer, base = _gzindex.read_range(filename, index, start, end)
+        yield buffer, (frame[0] - base, frame[1] - base, frame[2], frame[3], frame[4] - base)
+
+
+def __find_frames(filename, frames=None, use_mmap=False, gzip_index=False, start=None, end=None, gzip_backend="zlib", gzip_verify=True):
+    # read a PGM file (or its gzip index) and find the frames picked out by the frames
+    # selection and time window
+    #
+    # NOTE: at least the first frame is always read, so that the file gets checked. PGM.gz
+    # files are only partly decompressed if the frames that are needed don't depend on how
+    # many frames the file has.
+    #
+    # returns the index (only if the frames are read using it, in which case the buffer is
+    # None), the buffer, all frames found, the selected frames, any scan error message, and
+    # the name of the decompression backend used (None for uncompressed files)
+    selection_end = __selection_end(frames)
+    if (selection_end is not None):
+        selection_end = max(selection_end, 1)
+    index = None
+    buffer = None
+    complete = True
+    backend = None
+    if (gzip_index is not False and filename.endswith("pgm.gz")):
+        index, buffer = get_index(filename, gzip_index)
+        backend = "gzip index" if index is not None else None
+    if (index is not None and buffer is None):
+        file_frames = index["frames"]
+        scan_error_message = index["error_message"] if selection_end is None or selection_end > len(file_frames) else ""
+    else:
+        if (buffer is None and filename.endswith("pgm.gz") and (selection_end is not None or (end is not None and frames is None))):
+            buffer, complete, backend = __load_start(
+                filename,
+                num_frames=selection_end,
+                end=end,
+                gzip_backend=gzip_backend,
+                gzip_verify=gzip_verify,
+            )
+        elif (buffer is None and filename.endswith("pgm.gz")):
+            buffer, backend = _decompress.decompress_file(filename, backend=gzip_backend, verify=gzip_verify)
+        elif (buffer is None):
+            buffer = load(filename, use_mmap=use_mmap)
+        file_frames, scan_error_message = scan(buffer, max_frames=selection_end)
+        if (complete is False):
+            # the last frame is only partly decompressed
+            scan_error_message = ""
+
+    # pick out the selected frames
+    frame_list = []
+    for i in _engine.frame_indices(frames, len(file_frames)):
+        if (start is not None or end is not None):
+            timestamp = index["timestamps"][i] if (index is not None and buffer is None) else frame_timestamp(buffer, file_frames[i])
+            if (_engine.in_time_window(timestamp, start, end) is False):
+                continue
+        frame_list.append(file_frames[i])
+
+    # return
+    return index, buffer, file_frames, frame_list, scan_error_message, backend
+
+
+def __decode_frame(filename, frame_buffer, frame, destination, dtype, site_uid, device_uid, no_metadata, quiet, duplicates_as_list,
+                   lazy_metadata=False):
+    # decode a single frame into destination, returning its metadata dictionary (None if the
+    # frame was skipped), the site and device UIDs to carry forward, and an error message
+    # ('' if there was no problem)
+    #
+    # check dimensions
+    #
+    # NOTE: all frames are expected to have the same dimensions
+    if (frame[2] != destination.shape[1] or frame[3] != destination.shape[0]):
+        if (quiet is False):
+            print("Failed reading image data frame: unexpected image dimensions %dx%d" % (frame[2], frame[3]))
+        return None, site_uid, device_uid, "image data read failure: unexpected image dimensions %dx%d" % (frame[2], frame[3])
+
+    # process metadata
+    error_message = ""
+    metadata_dict = None
+    if (no_metadata is True):
+        metadata_dict = {}
+    elif (lazy_metadata is True):
+        metadata_dict, site_uid, device_uid = __keep_header(frame_buffer, frame, site_uid, device_uid, duplicates_as_list)
+    if (metadata_dict is None):
+        metadata_dict, site_uid, device_uid, failed_lines = parse_metadata(
+            frame_buffer,
+            frame,
+            site_uid=site_uid,
+            device_uid=device_uid,
+            duplicates_as_list=duplicates_as_list,
+        )
+        for line, e in failed_lines:
+            if (quiet is False):
+                print("Error decoding metadata line: %s (line='%s', file='%s')" % (str(e), line, filename))
+            error_message = "error decoding metadata line: %s" % (str(e))
+
+    # copy pixel data into its place in the stack, converting to native byte order and
+    # the output dtype
+    _engine.convert_frames(destination, frame_pixels(frame_buffer, frame, dtype))
+    return metadata_dict, site_uid, device_uid, error_message
+
+
+def __decode_pipelined(filename, images, dtype, site_uid, device_uid, no_metadata, quiet, duplicates_as_list, gzip_backend, lazy_metadata):
+    # decode a whole PGM.gz file as a pipeline (see decode), returning the same as decode()
+    metadata_dict_list = []
+    problematic = False
+    error_message = ""
+    state = {"error_message": "", "exception": None}
+
+    # process each frame as it arrives
+    #
+    # NOTE: the number of frames isn't known up front, so any that don't fit are gathered
+    # up and stacked at the end
+    capacity = images.shape[2]
+    overflow_list = []
+    num_frames = 0
+    for frame_buffer, frame in __pipelined_frames(filename, gzip_backend, state):
+        if (num_frames < capacity):
+            destination = images[:, :, num_frames]
+        elif (len(overflow_list) > 0):
+            destination = np.empty(overflow_list[0].shape, dtype=images.dtype)
+        else:
+            destination = np.empty((images.shape[0], images.shape[1]) if capacity > 0 else (frame[3], frame[2]), dtype=images.dtype)
+        metadata_dict, site_uid, device_uid, frame_error_message = __decode_frame(
+            filename,
+            frame_buffer,
+            frame,
+            destination,
+            dtype,
+            site_uid,
+            device_uid,
+            no_metadata,
+            quiet,
+            duplicates_as_list,
+            lazy_metadata=lazy_metadata,
+        )
+        if (frame_error_message != ""):
+            problematic = True
+            error_message = frame_error_message
+        if (metadata_dict is None):
+            continue  # skip to next frame
+        if (num_frames >= capacity):
+            overflow_list.append(destination)
+        metadata_dict_list.append(metadata_dict)
+        num_frames += 1
+    frame_buffer = None
+
+    # check that the file was read
+    if (state["exception"] is not None):
+        if (quiet is False):
+            print("Failed to open file '%s' " % (filename))
+        return 0, [], True, "failed to open file: %s" % (str(state["exception"])), None, None
+    if (state["error_message"] != ""):
+        if (quiet is False):
+            print("Failed reading image data frame: %s" % (state["error_message"]))
+        problematic = True
+        if (error_message == ""):
+            error_message = state["error_message"]
+    if (num_frames == 0):
+        if (quiet is False):
+            print("Error reading image file: found no image data")
+        problematic = True
+        error_message = "no image data"
+
+    # stack any frames that didn't fit
+    overflow_images = None
+    if (len(overflow_list) > 0):
+        overflow_images = np.stack(overflow_list, axis=-1)
+
+    # return
+    backend = "zlib" if gzip_backend == "pigz" else gzip_backend
+    return num_frames, metadata_dict_list, problematic, error_message, overflow_images, backend
+
+
+def __pipeline_put(chunks, stop, item):
+    # put an item on the pipeline's queue, giving up if the pipeline is stopped while waiting
+    while (stop.is_set() is False):
+        try:
+            chunks.put(item, timeout=__PIPELINE_PUT_TIMEOUT)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def __pipeline_decompress(filename, gzip_backend, chunks, stop):
+    # read and decompress a PGM.gz file a chunk at a time, putting the decompressed chunks
+    # on the queue, followed by None once done (or the exception if it failed)
+    #
+    # NOTE: a file can have more than one gzip member (with optional zero padding between
+    # them), so a new decompressor is started whenever one reaches the end of its member
+    try:
+        decompressor, _ = _decompress.decompressobj(gzip_backend)
+        with open(filename, mode='rb') as fp:
+            # ask the kernel to start reading the whole file in the background, so that
+            # reading from storage overlaps with decompressing the chunks that are in
+            if (hasattr(os, "posix_fadvise") is True):
+                try:
+                    os.posix_fadvise(fp.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+                except OSError:
+                    pass
+            while (stop.is_set() is False):
+                contents = fp.read(__PIPELINE_READ_SIZE)
+                if (len(contents) == 0):
+                    break
+                while (len(contents) > 0):
+                    if (decompressor.eof is True):
+                        contents = contents.lstrip(b"\x00")
+                        if (len(contents) == 0):
+                            break
+                        decompressor, _ = _decompress.decompressobj(gzip_backend)
+                    chunk = decompressor.decompress(contents, __PIPELINE_CHUNK_SIZE)
+                    contents = decompressor.unused_data if decompressor.eof is True else decompressor.unconsumed_tail
+                    if (len(chunk) > 0 and __pipeline_put(chunks, stop, chunk) is False):
+                        return
+        if (decompressor.eof is False and stop.is_set() is False):
+            raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+        __pipeline_put(chunks, stop, None)
+    except Exception as e:
+        __pipeline_put(chunks, stop, e)
+
+
+def __pipelined_frames(filename, gzip_backend, state):
+    # decompress a PGM.gz file in a separate thread, yielding each frame as (buffer, frame)
+    # as soon as all of it has arrived. Any error message (like scan()), and any
+    # decompression error are recorded in the state dictionary.
+    #
+    # NOTE: each buffer holds the frames that arrived in one go, so the views yielded into
+    # it stay valid while the next chunks arrive
+    chunks = queue.Queue(maxsize=__PIPELINE_QUEUE_SIZE)
+    stop = threading.Event()
+    decompress_thread = threading.Thread(target=__pipeline_decompress, args=(filename, gzip_backend, chunks, stop), daemon=True)
+    decompress_thread.start()
+    try:
+        buffer = b""
+        while True:
+            chunk = chunks.get()
+            if (isinstance(chunk, Exception) is True):
+                state["exception"] = chunk
+                return
+            if (chunk is not None):
+                buffer = buffer + chunk
+
+            # find the frames that have fully arrived
+            position = 0
+            while (position < len(buffer)):
+                try:
+                    frame_header = __parse_frame_header(buffer, position)
+                except Exception as e:
+                    state["error_message"] = "image data read failure: %s" % (str(e))
+                    return
+                if (frame_header is None):
+                    break
+                header_end, width, height, pixel_start = frame_header
+                pixel_end = pixel_start + width * height * 2  # 16-bit image depth
+                if (pixel_end > len(buffer)):
+                    if (chunk is None):
+                        state["error_message"] = "image data read failure: expected %d bytes of image data, found %d" % (
+                            pixel_end - pixel_start,
+                            len(buffer) - pixel_start,
+                        )
+                    break
+                yield buffer, (position, header_end, width, height, pixel_start)
+                position = pixel_end
+            if (chunk is None):
+                return
+            buffer = buffer[position:]
+    finally:
+        stop.set()
+        decompress_thread.join()
+
+
+def decode(filename, images, dtype, site_uid=None, device_uid=None, frames=None, no_metadata=False, quiet=False,
+           duplicates_as_list=False, use_mmap=False, gzip_index=False, start=None, end=None, gzip_backend="zlib", gzip_verify=True,
+           pipeline=False, lazy_metadata=False):
+    """
+    Read a single stacked PGM file, writing the frames into images[:, :, 0:n]
+
+    The pixel data is read as the given (big endian) dtype, and is converted to the
+    dtype of the images array as it is copied in (see _engine.convert_frames). Frames
+    that don't fit are returned in a separate overflow array. With use_mmap, uncompressed
+    files are memory mapped and the pixel data is copied straight out of the mapping.
+    With gzip_index, PGM.gz files are read using their index (building it if needed), so
+    only the parts of the file holding the selected frames are decompressed. Otherwise
+    they're decompressed using gzip_backend, checking the gzip trailers unless gzip_verify
+    is False (see _decompress).
+
+    With pipeline, PGM.gz files that are read in full (no frame selection, time window,
+    or gzip index) are decompressed a chunk at a time in a second thread, while the frames
+    that have arrived are parsed and copied in, so that I/O waits, zlib, and the copies
+    overlap. The whole decompressed file is never held in memory at once. The gzip trailers
+    are always checked, and pigz isn't used (zlib is used instead).
+
+    With lazy_metadata, each frame header is kept as it was read, and is only parsed the
+    first time its metadata is used (the metadata dictionaries are LazyMetadata instead,
+    see parse_header_metadata).
+
+    Only the frames picked out by the frames selection (see _engine.frame_selection)
+    are read. Unselected frames are skipped without parsing their metadata or copying
+    their pixel data, uncompressed files are memory mapped so that unselected pixel data
+    isn't read from disk, and PGM.gz files are only decompressed as far as the last
+    selected frame. The same goes for frames outside the time window from start to end
+    (see _engine.time_window), which is checked using each frame's 'Image request start'
+    timestamp.
+
+    :return: number of frames, metadata dictionaries, problematic flag, error message,
+             overflow images (None if all frames fit), name of the decompression backend
+             used (None for uncompressed files)
+    :rtype: int, list[dict], bool, str, numpy.ndarray, str
+    """
+    # init
+    metadata_dict_list = []
+    problematic = False
+    error_message = ""
+    overflow_images = None
+
+    # check file extension to see if it's gzipped or not
+    if (filename.endswith("pgm.gz") is False and filename.endswith("pgm") is False):
+        if (quiet is False):
+            print("Unrecognized file type: %s" % (filename))
+        return 0, metadata_dict_list, True, "Unrecognized file type", overflow_images, None
+
+    # decode the file as a pipeline, if it's being read in full
+    if (pipeline is True and filename.endswith("pgm.gz") and frames is None and start is None and end is None and gzip_index is False):
+        return __decode_pipelined(filename, images, dtype, site_uid, device_uid, no_metadata, quiet, duplicates_as_list, gzip_backend, lazy_metadata)
+
+    # read the file, and find the selected frames
+    try:
+        index, buffer, file_frames, frame_list, scan_error_message, backend = __find_frames(
+            filename,
+            frames=frames,
+            use_mmap=(use_mmap is True or frames is not None or start is not None or end is not None),
+            gzip_index=gzip_index,
+            start=start,
+            end=end,
+            gzip_backend=gzip_backend,
+            gzip_verify=gzip_verify,
+        )
+    except Exception as e:
+        if (quiet is False):
+            print("Failed to open file '%s' " % (filename))
+        return 0, metadata_dict_list, True, "failed to open file: %s" % (str(e)), overflow_images, None
+    if (scan_error_message != ""):
+        if (quiet is False):
+            print("Failed reading image data frame: %s" % (scan_error_message))
+        problematic = True
+        error_message = scan_error_message
+
+    # get the site and device UIDs
+    #
+    # NOTE: the site and device UIDs in the first frame's header are carried forward to the
+    # following frames, so it's parsed for them even when it isn't selected
+    uid_frame_list = []
+    if (no_metadata is False and len(frame_list) > 0 and frame_list[0] != file_frames[0]):
+        uid_frame_list = [file_frames[0]]
+    if (index is not None and buffer is None):
+        frame_source = __indexed_frames(filename, index, uid_frame_list + frame_list)
+    else:
+        frame_source = ((buffer, frame) for frame in uid_frame_list + frame_list)
+    if (len(uid_frame_list) > 0):
+        uid_buffer, uid_frame = next(frame_source)
+        _, site_uid, device_uid, _ = parse_metadata(uid_buffer, uid_frame, site_uid=site_uid, device_uid=device_uid)
+        uid_buffer = None
+
+    # set up space for any frames beyond what was estimated
+    image_height = images.shape[0]
+    image_width = images.shape[1]
+    capacity = images.shape[2]
+    if (len(frame_list) > capacity):
+        overflow_height = image_height if capacity > 0 else frame_list[0][3]
+        overflow_width = image_width if capacity > 0 else frame_list[0][2]
+        overflow_images = np.empty((overflow_height, overflow_width, len(frame_list) - capacity), dtype=images.dtype)
+
+    # process each frame
+    num_frames = 0
+    for frame_buffer, frame in frame_source:
+        if (num_frames < capacity):
+            destination = images[:, :, num_frames]
+        else:
+            destination = overflow_images[:, :, num_frames - capacity]
+        metadata_dict, site_uid, device_uid, frame_error_message = __decode_frame(
+            filename,
+            frame_buffer,
+            frame,
+            destination,
+            dtype,
+            site_uid,
+            device_uid,
+            no_metadata,
+            quiet,
+            duplicates_as_list,
+            lazy_metadata=lazy_metadata,
+        )
+        if (frame_error_message != ""):
+            problematic = True
+            error_message = frame_error_message
+        if (metadata_dict is None):
+            continue  # skip to next frame
+        metadata_dict_list.append(metadata_dict)
+        num_frames += 1
+
+    # close the file
+    frame_source = None
+    frame_buffer = None
+    if (buffer is not None):
+        release(buffer)
+
+    # trim any overflow space that wasn't used
+    if (overflow_images is not None):
+        if (num_frames <= capacity):
+            overflow_images = None
+        elif (num_frames - capacity < overflow_images.shape[2]):
+            overflow_images = overflow_images[:, :, 0:num_frames - capacity]
+
+    # check to see if the image is empty
+    #
+    # NOTE: a file that has frames but none that were selected isn't a problem
+    if (len(file_frames) == 0 or (num_frames == 0 and len(frame_list) > 0)):
+        if (quiet is False):
+            print("Error reading image file: found no image data")
+        problematic = True
+        error_message = "no image data"
+
+    # return
+    return num_frames, metadata_dict_list, problematic, error_message, overflow_images, backend
+
+
+def read_metadata(filename, site_uid=None, device_uid=None, frames=None, quiet=False, duplicates_as_list=False, gzip_index=False,
+                  start=None, end=None, gzip_backend="zlib", gzip_verify=True, lazy_metadata=False):
+    """
+    Read the metadata of a single stacked PGM file, without reading any pixel data
+
+    The frames are found the same way as in decode(), by skipping over each frame's
+    pixel data using its dimensions, but no arrays are built. Uncompressed files are
+    memory mapped so the pixel data isn't read from disk, and with gzip_index, only
+    the frame headers of PGM.gz files are decompressed. With lazy_metadata, the frame
+    headers are kept to be parsed when they're first used, same as in decode().
+
+    :return: metadata dictionaries, problematic flag, error message, name of the
+             decompression backend used (None for uncompressed files)
+    :rtype: list[dict], bool, str, str
+    """
+    # init
+    metadata_dict_list = []
+    problematic = False
+    error_message = ""
+
+    # check file extension to see if it's gzipped or not
+    if (filename.endswith("pgm.gz") is False and filename.endswith("pgm") is False):
+        if (quiet is False):
+            print("Unrecognized file type: %s" % (filename))
+        return metadata_dict_list, True, "Unrecognized file type", None
+
+    # read the file, and find the selected frames
+    try:
+        index, buffer, file_frames, frame_list, scan_error_message, backend = __find_frames(
+            filename,
+            frames=frames,
+            use_mmap=True,
+            gzip_index=gzip_index,
+            start=start,
+            end=end,
+            gzip_backend=gzip_backend,
+            gzip_verify=gzip_verify,
+        )
+    except Exception as e:
+        if (quiet is False):
+            print("Failed to open file '%s' " % (filename))
+        return metadata_dict_list, True, "failed to open file: %s" % (str(e)), None
+    if (scan_error_message != ""):
+        if (quiet is False):
+            print("Failed reading image data frame: %s" % (scan_error_message))
+        problematic = True
+        error_message = scan_error_message
+
+    # get the site and device UIDs
+    uid_frame_list = []
+    if (len(frame_list) > 0 and frame_list[0] != file_frames[0]):
+        uid_frame_list = [file_frames[0]]
+    if (index is not None and buffer is None):
+        frame_source = __indexed_frames(filename, index, uid_frame_list + frame_list, pixels=False)
+    else:
+        frame_source = ((buffer, frame) for frame in uid_frame_list + frame_list)
+    if (len(uid_frame_list) > 0):
+        uid_buffer, uid_frame = next(frame_source)
+        _, site_uid, device_uid, _ = parse_metadata(uid_buffer, uid_frame, site_uid=site_uid, device_uid=device_uid)
+        uid_buffer = None
+
+    # parse each frame header
+    for frame_buffer, frame in frame_source:
+        if (lazy_metadata is True):
+            metadata_dict, site_uid, device_uid = __keep_header(frame_buffer, frame, site_uid, device_uid, duplicates_as_list)
+            if (metadata_dict is not None):
+                metadata_dict_list.append(metadata_dict)
+                continue
+        metadata_dict, site_uid, device_uid, failed_lines = parse_metadata(
+            frame_buffer,
+            frame,
+            site_uid=site_uid,
+            device_uid=device_uid,
+            duplicates_as_list=duplicates_as_list,
+        )
+        for line, e in failed_lines:
+            if (quiet is False):
+                print("Error decoding metadata line: %s (line='%s', file='%s')" % (str(e), line, filename))
+            problematic = True
+            error_message = "error decoding metadata line: %s" % (str(e))
+        metadata_dict_list.append(metadata_dict)
+
+    # close the file
+    frame_source = None
+    frame_buffer = None
+    if (buffer is not None):
+        release(buffer)
+
+    # check to see if the file is empty
+    if (len(file_frames) == 0):
+        if (quiet is False):
+            print("Error reading image file: found no image data")
+        problematic = True
+        error_message = "no image data"
+
+    # return
+    return metadata_dict_list, problematic, error_message, backend
+
+
+class MappedFile:
+    """
+    Memory mapped uncompressed stacked PGM file, for fast random access to frames
+
+    The file is scanned once when opened. Indexing returns a frame as a read-only
+    (height, width) numpy array in the file's big endian byte order, which is a view
+    onto the mapped file; pixel data is only read from disk when it's accessed. Use
+    frame(index, native=True) to get a native byte order copy instead. Metadata is
+    parsed the first time it's accessed.
+
+    Closing the file releases the mapping once no frame views remain.
+    """
+
+    def __init__(self, filename, dtype, site_uid=None, device_uid=None, duplicates_as_list=False):
+        if (filename.endswith("pgm") is False):
+            raise ValueError("Memory mapping is only supported for uncompressed PGM files: %s" % (filename))
+        self.filename = filename
+        self.__dtype = dtype
+        self.__site_uid = site_uid
+        self.__device_uid = device_uid
+        self.__duplicates_as_list = duplicates_as_list
+        self.__metadata_dict_list = None
+        self.__buffer = load(filename, use_mmap=True)
+        self.frames, self.error_message = scan(self.__buffer)
+        self.problematic = (self.error_message != "")
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, index):
+        return self.frame(index)
+
+    def __iter__(self):
+        for i in range(0, len(self.frames)):
+            yield self.frame(i)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def frame(self, index, native=False):
+        """
+        Get a single frame as a (height, width) array
+
+        :param index: frame index
+        :type index: int
+        :param native: return a copy in native byte order instead of a view onto
+                       the mapped file, defaults to False
+        :type native: bool, optional
+
+        :return: frame
+        :rtype: numpy.ndarray
+        """
+        pixels = frame_pixels(self.__buffer, self.frames[index], self.__dtype)
+        if (native is True):
+            return pixels.astype(self.__dtype.newbyteorder('='))
+        return pixels
+
+    @property
+    def metadata(self):
+        """
+        Metadata dictionaries for all frames, parsed on first access
+        """
+        if (self.__metadata_dict_list is None):
+            metadata_dict_list = []
+            site_uid = self.__site_uid
+            device_uid = self.__device_uid
+            for frame in self.frames:
+                metadata_dict, site_uid, device_uid, _ = parse_metadata(
+                    self.__buffer,
+                    frame,
+                    site_uid=site_uid,
+                    device_uid=device_uid,
+                    duplicates_as_list=self.__duplicates_as_list,
+                )
+                metadata_dict_list.append(metadata_dict)
+            self.__metadata_dict_list = metadata_dict_list
+        return self.__metadata_dict_list
+
+    def close(self):
+        """
+        Close the file
+        """
+        release(self.__buffer)
+
+
+class IndexedFile:
+    """
+    Stacked PGM.gz file opened with a gzip index, for random access to frames
+
+    The index is loaded from its sidecar file, or built and saved if there isn't
+    one yet (which decompresses the whole file once). Each frame is then read by
+    decompressing from the nearest index checkpoint before it, rather than from the
+    start of the file. Indexing returns a frame as a (height, width) numpy array in
+    native byte order.
+
+    If gzip indexes aren't supported on this system, the whole file is decompressed
+    into memory when opened instead.
+    """
+
+    def __init__(self, filename, dtype, site_uid=None, device_uid=None, duplicates_as_list=False, gzip_index=True):
+        if (filename.endswith("pgm.gz") is False):
+            raise ValueError("Gzip indexes are only supported for PGM.gz files: %s" % (filename))
+        self.filename = filename
+        self.__dtype = dtype
+        self.__site_uid = site_uid
+        self.__device_uid = device_uid
+        self.__duplicates_as_list = duplicates_as_list
+        self.__index, contents = get_index(filename, gzip_index)
+        if (self.__index is None):
+            contents = load(filename)
+            self.frames, self.error_message = scan(contents)
+        else:
+            self.frames = self.__index["frames"]
+            self.error_message = self.__index["error_message"]
+        self.problematic = (self.error_message != "")
+
+        # keep the most recently decompressed part of the file, starting with the whole
+        # file if it had to be decompressed to build the index
+        self.__buffer = contents
+        self.__buffer_base = 0
+
+    @property
+    def indexed(self):
+        """
+        True if frames are read using a gzip index
+        """
+        return self.__index is not None
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, index):
+        return self.frame(index)
+
+    def __iter__(self):
+        for i in range(0, len(self.frames)):
+            yield self.frame(i)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __read_frame(self, index):
+        # get a buffer holding the frame, and the frame's position in that buffer
+        frame = self.frames[index]
+        start = frame[0]
+        end = frame[4] + frame[2] * frame[3] * 2
+        if (self.__buffer is None or start < self.__buffer_base or end > self.__buffer_base + len(self.__buffer)):
+            self.__buffer, self.__buffer_base = _gzindex.read_range(self.filename, self.__index, start, end)
+        base = self.__buffer_base
+        return self.__buffer, (frame[0] - base, frame[1] - base, frame[2], frame[3], frame[4] - base)
+
+    def frame(self, index):
+        """
+        Get a single frame as a (height, width) array in native byte order
+
+        :param index: frame index
+        :type index: int
+
+        :return: frame
+        :rtype: numpy.ndarray
+        """
+        buffer, frame = self.__read_frame(index)
+        return frame_pixels(buffer, frame, self.__dtype).astype(self.__dtype.newbyteorder('='))
+
+    def frame_metadata(self, index):
+        """
+        Get the metadata dictionary for a single frame
+
+        The site and device UIDs are taken from the filename if the frame's header
+        doesn't include them.
+
+        :param index: frame index
+        :type index: int
+
+        :return: metadata dictionary
+        :rtype: dict
+        """
+        buffer, frame = self.__read_frame(index)
+        metadata_dict, _, _, _ = parse_metadata(
+            buffer,
+            frame,
+            site_uid=self.__site_uid,
+            device_uid=self.__device_uid,
+            duplicates_as_list=self.__duplicates_as_list,
+        )
+        return metadata_dict
+
+    def close(self):
+        """
+        Close the file
+        """
+        self.__buffer = None
@@ -0,0 +1,242 @@
+"""
+Long-lived worker pools, for reading many small sets of files
+
+Each read function normally starts its own pool of workers and shuts it down
+again when it's done. When reads are made over and over (ie. in a service
+handling requests), starting the workers can take longer than the read itself.
+A Reader starts its workers once, and every read made through it shares them.
+"""
+
+import threading
+from . import _decompress
+from . import _engine
+from . import blueline
+from . import nir
+from . import rgb
+from . import spectrograph
+
+
+class Reader:
+    """
+    Pool of worker processes or threads that stays running between reads
+
+    The read functions for every instrument are available as methods (ie.
+    read_nir(), read_nir_metadata(), aread_nir(), aiter_nir_frames()), and take
+    the same parameters as the module functions, apart from workers and backend which are set for the
+    reader as a whole. The pool is started the first time it's needed.
+
+    The workers are reused between reads, so the modules, libraries, and memory
+    they've already loaded stay loaded. Each worker also keeps the buffer it reads
+    compressed files into (see _decompress.keep_buffer()), though the decompressed
+    data is still allocated for each file. A reader can be used from several
+    threads at once, and reads from different threads share its workers.
+
+    Use it as a context manager, or call close() when done with it, to shut down
+    the workers once the reads in progress have finished. If a read is interrupted
+    (KeyboardInterrupt), or gives up on files (see timeout_per_file of nir.read()),
+    a new pool is started for the reads that come after it. The old pool keeps
+    going for any other reads still using it, and is stopped once they're done,
+    killing worker processes that are stuck on files that were given up on.
+    """
+
+    def __init__(self, workers=1, backend="auto", chunksize=1):
+        """
+        :param workers: number of worker processes (or threads) in each pool, or "auto" for
+                        one per CPU this process can use; with one worker, reads are run
+                        in the calling thread, defaults to 1
+        :type workers: int or str, optional
+        :param backend: run the workers as "process"es or "thread"s, with "auto" using
+                        processes (see nir.read()), defaults to "auto"
+        :type backend: str, optional
+        :param chunksize: number of files handed to a worker at a time. Larger chunks cut
+                          the overhead of many small files, at the cost of evening out the
+                          work between workers less well, defaults to 1
+        :type chunksize: int, optional
+        """
+        if (backend != "auto"):
+            _engine.worker_backend(backend)
+        self.workers = _engine.available_cpus() if workers == "auto" else workers
+        self.backend = backend
+        self.chunksize = chunksize
+        self.__pools = {}
+        self.__pool_reads = {}  # number of reads using each pool, keyed by id
+        self.__discarded_pools = {}  # pools to stop once no reads are using them, keyed by id
+        self.__condition = threading.Condition()
+        self.__closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _pool(self, backend):
+        """
+        Get the pool for a backend, starting it if needed, for a read to use until it
+        calls _release_pool() (used by the read functions)
+        """
+        with self.__condition:
+            if (self.__closed is True):
+                raise ValueError("Reader is closed")
+            if (backend not in self.__pools):
+                self.__pools[backend] = _engine.create_pool(self.workers, backend, initializer=_decompress.keep_buffer)
+            pool = self.__pools[backend]
+            self.__pool_reads[id(pool)] = self.__pool_reads.get(id(pool), 0) + 1
+            return pool
+
+    def _release_pool(self, pool):
+        """
+        Finish using a pool from _pool(), stopping it if it was discarded and no other
+        reads are using it (used by the read functions)
+        """
+        with self.__condition:
+            self.__pool_reads[id(pool)] -= 1
+            if (self.__pool_reads[id(pool)] > 0):
+                return
+            del self.__pool_reads[id(pool)]
+            self.__condition.notify_all()
+            backend = self.__discarded_pools.pop(id(pool), None)
+        if (backend is not None):
+            self.__stop_pool(backend, pool)
+
+    def _discard_pool(self, backend, pool):
+        """
+        Stop using a pool for new reads because a read was interrupted or gave up on
+        files, so that a new one is started for the next read. The pool is stopped once
+        the reads using it are done (used by the read functions)
+        """
+        with self.__condition:
+            if (self.__pools.get(backend) is pool):
+                del self.__pools[backend]
+            self.__discarded_pools[id(pool)] = backend
+
+    def __stop_pool(self, backend, pool):
+        # stop a discarded pool
+        #
+        # NOTE: worker processes may still be stuck on files that were given up on, so
+        # they're killed. Threads can't be, so any that are stuck are left to finish the
+        # file they're on.
+        if (backend == "thread"):
+            pool.close()
+        else:
+            pool.terminate()
+
+    def __read_args(self, kwargs):
+        # add the reader's settings to the parameters of a read
+        for key in ["workers", "backend", "reader"]:
+            if (key in kwargs):
+                raise TypeError("'%s' is set when the Reader is created, and can't be passed to its read functions" % (key))
+        if (self.__closed is True):
+            raise ValueError("Reader is closed")
+        kwargs.update({"workers": self.workers, "backend": self.backend, "reader": self})
+        return kwargs
+
+    def read_blueline(self, file_list, **kwargs):
+        """
+        Read blueline files using this reader's workers, see blueline.read()
+        """
+        return blueline.read(file_list, **self.__read_args(kwargs))
+
+    def read_blueline_metadata(self, file_list, **kwargs):
+        """
+        Read the metadata of blueline files using this reader's workers, see blueline.read_metadata()
+        """
+        return blueline.read_metadata(file_list, **self.__read_args(kwargs))
+
+    async def aread_blueline(self, file_list, **kwargs):
+        """
+        Read blueline files using this reader's workers without blocking the event loop, see blueline.aread()
+        """
+        return await blueline.aread(file_list, **self.__read_args(kwargs))
+
+    def aiter_blueline_frames(self, file_list, **kwargs):
+        """
+        Asynchronously iterate over the frames of blueline files read using this reader's workers, see blueline.aiter_frames()
+        """
+        return blueline.aiter_frames(file_list, **self.__read_args(kwargs))
+
+    def read_nir(self, file_list, **kwargs):
+        """
+        Read NIR files using this reader's workers, see nir.read()
+        """
+        return nir.read(file_list, **self.__read_args(kwargs))
+
+    def read_nir_metadata(self, file_list, **kwargs):
+        """
+        Read the metadata of NIR files using this reader's workers, see nir.read_metadata()
+        """
+        return nir.read_metadata(file_list, **self.__read_args(kwargs))
+
+    async def aread_nir(self, file_list, **kwargs):
+        """
+        Read NIR files using this reader's workers without blocking the event loop, see nir.aread()
+        """
+        return await nir.aread(file_list, **self.__read_args(kwargs))
+
+    def aiter_nir_frames(self, file_list, **kwargs):
+        """
+        Asynchronously iterate over the frames of NIR files read using this reader's workers, see nir.aiter_frames()
+        """
+        return nir.aiter_frames(file_list, **self.__read_args(kwargs))
+
+    def read_rgb(self, file_list, **kwargs):
+        """
+        Read RGB files using this reader's workers, see rgb.read()
+        """
+        return rgb.read(file_list, **self.__read_args(kwargs))
+
+    def read_rgb_metadata(self, file_list, **kwargs):
+        """
+        Read the metadata of RGB files using this reader's workers, see rgb.read_metadata()
+        """
+        return rgb.read_metadata(file_list, **self.__read_args(kwargs))
+
+    async def aread_rgb(self, file_list, **kwargs):
+        """
+        Read RGB files using this reader's workers without blocking the event loop, see rgb.aread()
+        """
+        return await rgb.aread(file_list, **self.__read_args(kwargs))
+
+    def aiter_rgb_frames(self, file_list, **kwargs):
+        """
+        Asynchronously iterate over the frames of RGB files read using this reader's workers, see rgb.aiter_frames()
+        """
+        return rgb.aiter_frames(file_list, **self.__read_args(kwargs))
+
+    def read_spectrograph(self, file_list, **kwargs):
+        """
+        Read spectrograph files using this reader's workers, see spectrograph.read()
+        """
+        return spectrograph.read(file_list, **self.__read_args(kwargs))
+
+    def read_spectrograph_metadata(self, file_list, **kwargs):
+        """
+        Read the metadata of spectrograph files using this reader's workers, see spectrograph.read_metadata()
+        """
+        return spectrograph.read_metadata(file_list, **self.__read_args(kwargs))
+
+    async def aread_spectrograph(self, file_list, **kwargs):
+        """
+        Read spectrograph files using this reader's workers without blocking the event loop, see spectrograph.aread()
+        """
+        return await spectrograph.aread(file_list, **self.__read_args(kwargs))
+
+    def aiter_spectrograph_frames(self, file_list, **kwargs):
+        """
+        Asynchronously iterate over the frames of spectrograph files read using this reader's workers, see spectrograph.aiter_frames()
+        """
+        return spectrograph.aiter_frames(file_list, **self.__read_args(kwargs))
+
+    def close(self):
+        """
+        Shut down the workers, waiting for any reads in progress to finish
+        """
+        with self.__condition:
+            self.__closed = True
+            while (len(self.__pool_reads) > 0):
+                self.__condition.wait()
+            pools = list(self.__pools.values())
+            self.__pools = {}
+        for pool in pools:
+            pool.close()
+            pool.join()
@@ -1,20 +1,22 @@
 import os
 import datetime
-import gzip
 import shutil
-import signal
 import tarfile
 import random
 import string
 import cv2
 import h5py
 import numpy as np
+from multiprocessing.pool import ThreadPool
 from pathlib import Path
-from multiprocessing import Pool
+from . import _aio
+from . import _decompress
+from . import _engine
+from . import _metadata
+from . import _pgm
 
 # static globals
-__RGB_PGM_EXPECTED_HEIGHT = 480
-__RGB_PGM_EXPECTED_WIDTH = 553
+__RGB_PGM_OUTPUT_DT = np.dtype("uint16")
 __RGB_PGM_DT = np.dtype("uint16")
 __RGB_PGM_DT = __RGB_PGM_DT.newbyteorder('>')  # force big endian byte ordering
 __RGB_PNG_DT = np.dtype("uint8")
@@ -22,106 +24,241 @@ __RGB_H5_DT = np.dtype("uint8")
 __PNG_METADATA_PROJECT_UID = "trex"
 
 
-def __trex_readfile_worker(file_obj):
+def __png_frame_shape(png_bytes):
+    # the image dimensions are in the IHDR chunk, which always comes first in a PNG file
+    if (png_bytes[12:16] != b"IHDR"):
+        raise ValueError("not a PNG file")
+    image_width = int.from_bytes(png_bytes[16:20], "big")
+    image_height = int.from_bytes(png_bytes[20:24], "big")
+    return (image_height, image_width, 3)  # always read in as 3-channel colour
+
+
+def __png_timestamp(filename):
+    # get the timestamp of a PNG frame from its filename
+    #
+    # NOTE: this is called for every frame, so the fields are sliced out of the filename
+    # instead of being parsed by strptime (which is several times slower). The digits are
+    # checked to keep strptime's strictness.
+    file_split = os.path.basename(filename).split('_')
+    date = file_split[0]
+    time_of_day = file_split[1]
+    if ("burst" in filename or "mode-b"):
+        fraction = file_split[2]
+    else:
+        fraction = "0"
+    if (len(date) != 8 or len(time_of_day) != 6 or len(fraction) < 1 or len(fraction) > 6 or (date + time_of_day + fraction).isdigit() is False
+            or (date + time_of_day + fraction).isascii() is False):
+        raise ValueError("unexpected PNG filename '%s'" % (os.path.basename(filename)))
+    return datetime.datetime(
+        int(date[0:4]),
+        int(date[4:6]),
+        int(date[6:8]),
+        int(time_of_day[0:2]),
+        int(time_of_day[2:4]),
+        int(time_of_day[4:6]),
+        int(fraction.ljust(6, "0")),
+    )
+
+
+def __png_metadata(filename):
+    # get the metadata of a PNG frame, which is all in its filename
+    file_split = os.path.basename(filename).split('_')
+    site_uid = file_split[3]
+    device_uid = file_split[4]
+    exposure = "%.03f ms" % (float(file_split[5][:-2]))
+    mode_uid = file_split[6][:-4]
+
+    # set timestamp
+    timestamp = __png_timestamp(filename)
+
+    # return
+    return {
+        "Project unique ID": __PNG_METADATA_PROJECT_UID,
+        "Site unique ID": site_uid,
+        "Imager unique ID": device_uid,
+        "Mode unique ID": mode_uid,
+        "Image request start": timestamp,
+        "Subframe requested exposure": exposure,
+    }
+
+
+def __png_select_frames(file_list, options):
+    # get the PNG frames to read, from the frame selection and time window
+    file_list = [file_list[i] for i in _engine.frame_indices(options["frames"], len(file_list))]
+    if (options["start"] is not None or options["end"] is not None):
+        selected_file_list = []
+        for f in file_list:
+            try:
+                timestamp = __png_timestamp(f)
+            except Exception:
+                timestamp = None
+            if (_engine.in_time_window(timestamp, options["start"], options["end"]) is True):
+                selected_file_list.append(f)
+        file_list = selected_file_list
+    return file_list
+
+
+def __rgb_probe(file, options):
+    # get frame shape, dtype, and number of frames without decoding any images
+    if (file.endswith("pgm") or file.endswith("pgm.gz")):
+        frame_shape, num_frames = _pgm.probe(
+            file,
+            frames=options["frames"],
+            gzip_index=options["gzip_index"],
+            start=options["start"],
+            end=options["end"],
+        )
+        return frame_shape, __RGB_PGM_OUTPUT_DT, num_frames
+    elif (file.endswith("png.tar")):
+        with tarfile.open(file) as tf:
+            member_list = sorted(tf.getnames())
+            frame_shape = __png_frame_shape(tf.extractfile(member_list[0]).read(24))
+        return frame_shape, __RGB_PNG_DT, len(__png_select_frames(member_list, options))
+    elif (file.endswith("png")):
+        with open(file, 'rb') as fp:
+            frame_shape = __png_frame_shape(fp.read(24))
+        return frame_shape, __RGB_PNG_DT, len(__png_select_frames([file], options))
+    elif (file.endswith("h5")):
+        with h5py.File(file, 'r') as f:
+            return f["data"]["images"].shape[0:3], __RGB_H5_DT, len(__h5_select_indices(f, options))
+    raise ValueError("Unrecognized file type")
+
+
+def __trex_readfile_worker(file, images, options):
     # init
-    images = np.array([])
-    metadata_dict_list = []
-    problematic = False
-    error_message = ""
-    image_width = 0
-    image_height = 0
-    image_channels = 0
-    image_dtype = np.dtype("uint8")
+    file_obj = dict(options, filename=file)
 
     # check file extension to know how to process
-    try:
-        if (file_obj["filename"].endswith("pgm") or file_obj["filename"].endswith("pgm.gz")):
-            return __rgb_readfile_worker_pgm(file_obj)
-        elif (file_obj["filename"].endswith("png") or file_obj["filename"].endswith("png.tar")):
-            return __rgb_readfile_worker_png(file_obj)
-        elif (file_obj["filename"].endswith("h5")):
-            return __rgb_readfile_worker_h5(file_obj)
-        else:
-            if (file_obj["quiet"] is False):
-                print("Unrecognized file type: %s" % (file_obj["filename"]))
-            problematic = True
-            error_message = "Unrecognized file type"
-    except Exception as e:
+    if (file_obj["filename"].endswith("pgm") or file_obj["filename"].endswith("pgm.gz")):
+        return __rgb_readfile_worker_pgm(file_obj, images)
+    elif (file_obj["filename"].endswith("png") or file_obj["filename"].endswith("png.tar")):
+        return __rgb_readfile_worker_png(file_obj, images)
+    elif (file_obj["filename"].endswith("h5")):
+        return __rgb_readfile_worker_h5(file_obj, images)
+    else:
         if (file_obj["quiet"] is False):
-            print("Failed to process file '%s' " % (file_obj["filename"]))
-        problematic = True
-        error_message = "failed to process file: %s" % (str(e))
-    return images, metadata_dict_list, problematic, file_obj["filename"], error_message, \
-        image_width, image_height, image_channels, image_dtype
+            print("Unrecognized file type: %s" % (file_obj["filename"]))
+        return 0, [], True, "Unrecognized file type", None, None
+
+
+def __h5_select_frames(dataset, indices):
+    # read the selected frames (on the last axis) of a dataset, using a hyperslab so
+    # that unselected frames aren't read from the file
+    #
+    # NOTE: h5py only supports increasing indices, so read each selected frame once in
+    # order, and then rearrange them if needed
+    if (len(indices) == 0):
+        return dataset[..., 0:0]
+    unique_indices = sorted(set(indices))
+    step = unique_indices[1] - unique_indices[0] if len(unique_indices) > 1 else 1
+    if (unique_indices == list(range(unique_indices[0], unique_indices[-1] + 1, step))):
+        data = dataset[..., unique_indices[0]:unique_indices[-1] + 1:step]
+    else:
+        data = dataset[..., unique_indices]
+    if (unique_indices != indices):
+        positions = {}
+        for i in range(0, len(unique_indices)):
+            positions[unique_indices[i]] = i
+        data = data[..., [positions[i] for i in indices]]
+    return data
+
+
+def __h5_select_indices(f, options):
+    # get the indices of the H5 frames to read, from the frame selection and time window
+    shape = f["data"]["images"].shape
+    num_frames = 1 if len(shape) == 3 else shape[3]
+    indices = _engine.frame_indices(options["frames"], num_frames)
+    if (options["start"] is not None or options["end"] is not None):
+        # NOTE: the frame timestamps are a small dataset of their own, so they're read
+        # without touching the image data
+        timestamps = f["data"]["timestamp"][:]
+        selected_indices = []
+        for i in indices:
+            timestamp = timestamps[0] if len(shape) == 3 else timestamps[i]
+            if (isinstance(timestamp, (bytes, str)) is True):
+                timestamp = _engine.parse_timestamp(timestamp)
+            else:
+                timestamp = datetime.datetime.fromtimestamp(float(timestamp), datetime.timezone.utc).replace(tzinfo=None)
+            if (_engine.in_time_window(timestamp, options["start"], options["end"]) is True):
+                selected_indices.append(i)
+        indices = selected_indices
+    return indices
+
+
+def __h5_metadata(f, indices):
+    # read the metadata of the H5 frames at the given indices
+    file_metadata = {}
+    for key, value in f["metadata"]["file"].attrs.items():
+        file_metadata[key] = value
+    metadata_dict_list = []
+    for i in indices:
+        this_frame_metadata = file_metadata.copy()
+        for key, value in f["metadata"]["frame"]["frame%d" % (i)].attrs.items():
+            this_frame_metadata[key] = value
+        metadata_dict_list.append(this_frame_metadata)
+    return metadata_dict_list
 
 
-def __rgb_readfile_worker_h5(file_obj):
+def __rgb_readfile_worker_h5(file_obj, images):
     # init
-    images = np.array([])
     metadata_dict_list = []
     problematic = False
     error_message = ""
-    image_width = 0
-    image_height = 0
-    image_channels = 0
-    image_dtype = __RGB_H5_DT
 
     # open H5 file
     f = h5py.File(file_obj["filename"], 'r')
 
     # get images and timestamps
-    if (file_obj["first_frame"] is True):
-        # get only first frame
-        images = f["data"]["images"][:, :, :, 0]
-        timestamps = [f["data"]["timestamp"][0]]
+    dataset = f["data"]["images"]
+    if (len(dataset.shape) == 3):
+        # single frame
+        indices = __h5_select_indices(f, file_obj)
+        frames = dataset[:]
+        frames = frames.reshape(frames.shape + (1, ))[..., indices]  # force reshape to 4 dimensions
+        timestamps = [f["data"]["timestamp"][0]] * len(indices)
     else:
-        # get all frames
-        images = f["data"]["images"][:]
-        timestamps = f["data"]["timestamp"][:]
+        # get selected frames
+        indices = __h5_select_indices(f, file_obj)
+        frames = __h5_select_frames(dataset, indices)
+        timestamps = __h5_select_frames(f["data"]["timestamp"], indices)
+    num_frames = frames.shape[-1]
+    overflow_images = _engine.store_frames(images, frames)
+    frames = None
 
     # read metadata
-    file_metadata = {}
     if (file_obj["no_metadata"] is True):
         metadata_dict_list = [{}] * len(timestamps)
     else:
-        # get file metadata
-        for key, value in f["metadata"]["file"].attrs.items():
-            file_metadata[key] = value
-
-        # read frame metadata
-        for i in range(0, len(timestamps)):
-            this_frame_metadata = file_metadata.copy()
-            for key, value in f["metadata"]["frame"]["frame%d" % (i)].attrs.items():
-                this_frame_metadata[key] = value
-            metadata_dict_list.append(this_frame_metadata)
+        metadata_dict_list = __h5_metadata(f, indices)
 
     # close H5 file
     f.close()
 
-    # set image vars and reshape if multiple images
-    image_height = images.shape[0]
-    image_width = images.shape[1]
-    image_channels = images.shape[2]
-    if (len(images.shape) == 3):
-        # force reshape to 4 dimensions
-        images = images.reshape((image_height, image_width, image_channels, 1))
-
     # return
-    return images, metadata_dict_list, problematic, file_obj["filename"], error_message, \
-        image_width, image_height, image_channels, image_dtype
+    return num_frames, metadata_dict_list, problematic, error_message, overflow_images, None
+
+
+def __png_decode_frame(task):
+    # decode a PNG frame into its place in the stack (on last axis), returning it if it
+    # doesn't fit, and any error
+    filename, images, index = task
+    try:
+        image_np = cv2.imread(filename, cv2.IMREAD_COLOR)
+        image_np = cv2.cvtColor(image_np, cv2.COLOR_RGB2BGR)
+        if (index < images.shape[-1]):
+            _engine.convert_frames(images[..., index], image_np)
+            return None, None
+        return image_np, None
+    except Exception as e:
+        return None, e
 
 
-def __rgb_readfile_worker_png(file_obj):
+def __rgb_readfile_worker_png(file_obj, images):
     # init
-    images = np.array([])
     metadata_dict_list = []
     problematic = False
-    is_first = True
     error_message = ""
-    image_width = 0
-    image_height = 0
-    image_channels = 0
-    image_dtype = __RGB_PNG_DT
+    overflow_list = []
     working_dir_created = False
 
     # set up working dir
@@ -134,11 +271,14 @@ def __rgb_readfile_worker_png(file_obj):
         try:
             tf = tarfile.open(file_obj["filename"])
             file_list = sorted(tf.getnames())
-            if (file_obj["first_frame"] is True):
-                file_list = [file_list[0]]
-                tf.extract(file_list[0], path=this_working_dir)
-            else:
+            num_members = len(file_list)
+            if (file_obj["frames"] is None and file_obj["start"] is None and file_obj["end"] is None):
                 tf.extractall(path=this_working_dir)
+            else:
+                # only extract the selected frames
+                file_list = __png_select_frames(file_list, file_obj)
+                for member in file_list:
+                    tf.extract(member, path=this_working_dir)
             for i in range(0, len(file_list)):
                 file_list[i] = "%s/%s" % (this_working_dir, file_list[i])
             tf.close()
@@ -159,281 +299,177 @@ def __rgb_readfile_worker_png(file_obj):
                 tf.close()
             except Exception:
                 pass
-            return images, metadata_dict_list, problematic, file_obj["filename"], error_message, \
-                image_width, image_height, image_channels, image_dtype
+            return 0, metadata_dict_list, problematic, error_message, None, None
     else:
         # regular png
         file_list = [file_obj["filename"]]
+        num_members = 1
+        file_list = __png_select_frames(file_list, file_obj)
 
-    # read each png file
-    for f in file_list:
+    # process metadata
+    #
+    # NOTE: a frame that fails here stops the file being read any further
+    num_selected = len(file_list)
+    for i in range(0, len(file_list)):
         if (file_obj["no_metadata"] is True):
             metadata_dict_list.append({})
         else:
-            # process metadata
             try:
-                # set metadata values
-                file_split = os.path.basename(f).split('_')
-                site_uid = file_split[3]
-                device_uid = file_split[4]
-                exposure = "%.03f ms" % (float(file_split[5][:-2]))
-                mode_uid = file_split[6][:-4]
-
-                # set timestamp
-                if ("burst" in f or "mode-b"):
-                    timestamp = datetime.datetime.strptime("%sT%s.%s" % (file_split[0], file_split[1], file_split[2]), "%Y%m%dT%H%M%S.%f")
-                else:
-                    timestamp = datetime.datetime.strptime("%sT%s" % (file_split[0], file_split[1]), "%Y%m%dT%H%M%S")
-
-                # set the metadata dict
-                metadata_dict = {
-                    "Project unique ID": __PNG_METADATA_PROJECT_UID,
-                    "Site unique ID": site_uid,
-                    "Imager unique ID": device_uid,
-                    "Mode unique ID": mode_uid,
-                    "Image request start": timestamp,
-                    "Subframe requested exposure": exposure,
-                }
-                metadata_dict_list.append(metadata_dict)
+                metadata_dict_list.append(__png_metadata(file_list[i]))
             except Exception as e:
                 if (file_obj["quiet"] is False):
-                    print("Failed to read metadata from file '%s' " % (f))
+                    print("Failed to read metadata from file '%s' " % (file_list[i]))
                 problematic = True
                 error_message = "failed to read metadata: %s" % (str(e))
+                num_selected = i
                 break
 
-        # read png file
-        try:
-            # read file
-            image_np = cv2.imread(f, cv2.IMREAD_COLOR)
-            image_np = cv2.cvtColor(image_np, cv2.COLOR_RGB2BGR)
-            image_height = image_np.shape[0]
-            image_width = image_np.shape[1]
-            image_channels = image_np.shape[2] if len(image_np.shape) > 2 else 1
-            if (image_channels > 1):
-                image_matrix = np.reshape(image_np, (image_height, image_width, image_channels, 1))
-            else:
-                image_matrix = np.reshape(image_np, (image_height, image_width, 1))
+    # read each png file
+    #
+    # NOTE: OpenCV releases the GIL while decoding, so the frames of a PNG.tar file can be
+    # decoded by several threads at once, each into its own slice of the images
+    decode_tasks = [(file_list[i], images, i) for i in range(0, num_selected)]
+    if (file_obj["png_threads"] > 1 and len(decode_tasks) > 1):
+        with ThreadPool(processes=min(file_obj["png_threads"], len(decode_tasks))) as pool:
+            decode_results = pool.map(__png_decode_frame, decode_tasks)
+    else:
+        decode_results = map(__png_decode_frame, decode_tasks)
 
-            # initialize image stack
-            if (is_first is True):
-                images = image_matrix
-                is_first = False
-            else:
-                if (image_channels > 1):
-                    images = np.concatenate([images, image_matrix], axis=3)  # concatenate (on last axis)
-                else:
-                    images = np.dstack([images, image_matrix])  # depth stack images (on last axis)
-        except Exception as e:
+    # move the frames that were read together, dropping any that failed
+    num_frames = 0
+    kept_metadata_dict_list = []
+    for i, (image_np, e) in enumerate(decode_results):
+        if (e is not None):
             if (file_obj["quiet"] is False):
                 print("Failed reading image data frame: %s" % (str(e)))
-            metadata_dict_list.pop()  # remove corresponding metadata entry
             problematic = True
             error_message = "image data read failure: %s" % (str(e))
             continue  # skip to next frame
+        if (image_np is not None):
+            # frame that didn't fit in the images
+            if (num_frames < images.shape[-1]):
+                _engine.convert_frames(images[..., num_frames], image_np)
+            else:
+                overflow_list.append(image_np)
+        elif (num_frames != i):
+            images[..., num_frames] = images[..., i]
+        kept_metadata_dict_list.append(metadata_dict_list[i])
+        num_frames += 1
+    metadata_dict_list = kept_metadata_dict_list
 
     # cleanup
     #
     # NOTE: we only clean up the working dir if we created it
-    if (working_dir_created is True):
+    if (working_dir_created is True and os.path.exists(this_working_dir) is True):
         shutil.rmtree(this_working_dir)
 
     # check to see if the image is empty
-    if (images.size == 0):
+    #
+    # NOTE: a file that has frames but none that were selected isn't a problem
+    if (num_members == 0 or (num_frames == 0 and len(file_list) > 0)):
         if (file_obj["quiet"] is False):
             print("Error reading image file: found no image data")
         problematic = True
         error_message = "no image data"
 
-    # return
-    return images, metadata_dict_list, problematic, file_obj["filename"], error_message, \
-        image_width, image_height, image_channels, image_dtype
-
+    # stack any frames that didn't fit
+    overflow_images = None
+    if (len(overflow_list) > 0):
+        overflow_images = np.empty(overflow_list[0].shape + (len(overflow_list), ), dtype=images.dtype)
+        _engine.convert_frames(overflow_images, np.stack(overflow_list, axis=-1))
 
-def __rgb_readfile_worker_pgm(file_obj):
-    # init
-    images = np.array([])
-    metadata_dict_list = []
-    is_first = True
-    metadata_dict = {}
-    site_uid = ""
-    device_uid = ""
-    problematic = False
-    error_message = ""
-    image_width = __RGB_PGM_EXPECTED_WIDTH
-    image_height = __RGB_PGM_EXPECTED_HEIGHT
-    image_channels = 1
-    image_dtype = np.dtype("uint16")
-
-    # Set metadata values
-    file_split = os.path.basename(file_obj["filename"]).split('_')
-    site_uid = file_split[3]
-    device_uid = file_split[4]
+    # return
+    return num_frames, metadata_dict_list, problematic, error_message, overflow_images, None
 
-    # check file extension to see if it's gzipped or not
-    try:
-        if file_obj["filename"].endswith("pgm.gz"):
-            unzipped = gzip.open(file_obj["filename"], mode='rb')
-        elif file_obj["filename"].endswith("pgm"):
-            unzipped = open(file_obj["filename"], mode='rb')
-        else:
-            if (file_obj["quiet"] is False):
-                print("Unrecognized file type: %s" % (file_obj["filename"]))
-            problematic = True
-            error_message = "Unrecognized file type"
-            try:
-                unzipped.close()
-            except Exception:
-                pass
-            return images, metadata_dict_list, problematic, file_obj["filename"], error_message, \
-                image_width, image_height, image_channels, image_dtype
-    except Exception as e:
-        if (file_obj["quiet"] is False):
-            print("Failed to open file '%s' " % (file_obj["filename"]))
-        problematic = True
-        error_message = "failed to open file: %s" % (str(e))
-        try:
-            unzipped.close()
-        except Exception:
-            pass
-        return images, metadata_dict_list, problematic, file_obj["filename"], error_message, \
-            image_width, image_height, image_channels, image_dtype
 
+def __rgb_readfile_worker_pgm(file_obj, images):
     # read the file
-    prev_line = None
-    line = None
-    while True:
-        # break out depending on first_frame param
-        if (file_obj["first_frame"] is True and is_first is False):
-            break
-
-        # read a line
-        try:
-            prev_line = line
-            line = unzipped.readline()
-        except Exception as e:
-            if (file_obj["quiet"] is False):
-                print("Error reading before image data in file '%s'" % (file_obj["filename"]))
-            problematic = True
-            metadata_dict_list = []
-            images = np.array([])
-            error_message = "error reading before image data: %s" % (str(e))
+    #
+    # NOTE: the pixel data is read using a different dtype that what we return on purpose.
+    return _pgm.decode(
+        file_obj["filename"],
+        images,
+        __RGB_PGM_DT,
+        frames=file_obj["frames"],
+        no_metadata=file_obj["no_metadata"],
+        quiet=file_obj["quiet"],
+        duplicates_as_list=True,
+        use_mmap=file_obj["mmap"],
+        gzip_index=file_obj["gzip_index"],
+        start=file_obj["start"],
+        end=file_obj["end"],
+        gzip_backend=file_obj["gzip_backend"],
+        gzip_verify=file_obj["gzip_verify"],
+        pipeline=file_obj["pipeline"],
+        lazy_metadata=(file_obj["metadata_format"] == "lazy"),
+    )
+
+
+def __rgb_metadata_worker(file, options):
+    # check file extension to know how to process
+    if (file.endswith("pgm") or file.endswith("pgm.gz")):
+        return _pgm.read_metadata(
+            file,
+            frames=options["frames"],
+            quiet=options["quiet"],
+            duplicates_as_list=True,
+            gzip_index=options["gzip_index"],
+            start=options["start"],
+            end=options["end"],
+            gzip_backend=options["gzip_backend"],
+            gzip_verify=options["gzip_verify"],
+            lazy_metadata=(options["metadata_format"] == "lazy"),
+        )
+    elif (file.endswith("png") or file.endswith("png.tar")):
+        # the metadata is all in the PNG filenames, so tar files only need their member
+        # names listed, and nothing is extracted
+        if (file.endswith("png.tar")):
             try:
-                unzipped.close()
-            except Exception:
-                pass
-            return images, metadata_dict_list, problematic, file_obj["filename"], error_message, \
-                image_width, image_height, image_channels, image_dtype
-
-        # break loop at end of file
-        if (line == b''):
-            break
-
-        # magic number; this is not a metadata or image line, exclude
-        if (line.startswith(b'P5\n')):
-            continue
-
-        # process line
-        if (line.startswith(b'#"')):
-            if (file_obj["no_metadata"] is True):
-                metadata_dict = {}
-                metadata_dict_list.append(metadata_dict)
-            else:
-                # metadata lines start with #"<key>"
-                try:
-                    line_decoded = line.decode("ascii")
-                except Exception as e:
-                    # skip metadata line if it can't be decoded, likely corrupt file
-                    if (file_obj["quiet"] is False):
-                        print("Error decoding metadata line: %s (line='%s', file='%s')" % (str(e), line, file_obj["filename"]))
-                    problematic = True
-                    error_message = "error decoding metadata line: %s" % (str(e))
-                    continue
-
-                # split the key and value out of the metadata line
-                line_decoded_split = line_decoded.split('"')
-                key = line_decoded_split[1]
-                value = line_decoded_split[2].strip()
-
-                # add entry to dictionary
-                if (key in metadata_dict):
-                    # key already exists, turn existing value into list and append new value
-                    if (isinstance(metadata_dict[key], list)):
-                        # is a list already
-                        metadata_dict[key].append(value)
-                    else:
-                        metadata_dict[key] = [metadata_dict[key], value]
-                else:
-                    # normal metadata value
-                    metadata_dict[key] = value
-
-                # split dictionaries up per frame, exposure plus initial readout is
-                # always the end of metadata for frame
-                if (key.startswith("Effective image exposure")):
-                    metadata_dict_list.append(metadata_dict)
-                    metadata_dict = {}
-        elif line == b'65535\n':
-            # there are 2 lines between "exposure plus read out" and the image
-            # data, the first is the image dimensions and the second is the max
-            # value
-            #
-            # check the previous line to get the dimensions of the image
-            prev_line_split = prev_line.decode("ascii").strip().split()
-            image_width = int(prev_line_split[0])
-            image_height = int(prev_line_split[1])
-            bytes_to_read = image_width * image_height * 2  # 16-bit image depth
-
-            # read image
+                with tarfile.open(file) as tf:
+                    member_list = sorted(tf.getnames())
+            except Exception as e:
+                if (options["quiet"] is False):
+                    print("Failed to open file '%s' " % (file))
+                return [], True, "failed to open file: %s" % (str(e)), None
+        else:
+            member_list = [file]
+        metadata_dict_list = []
+        for f in __png_select_frames(member_list, options):
             try:
-                # read the image size in bytes from the file
-                image_bytes = unzipped.read(bytes_to_read)
-
-                # format bytes into numpy array of unsigned shorts (2byte numbers, 0-65536),
-                # effectively an array of pixel values
-                #
-                # NOTE: this is set to a different dtype that what we return on purpose.
-                image_np = np.frombuffer(image_bytes, dtype=__RGB_PGM_DT)
-
-                # change 1d numpy array into matrix with correctly located pixels
-                image_matrix = np.reshape(image_np, (image_height, image_width, 1))
+                metadata_dict_list.append(__png_metadata(f))
             except Exception as e:
-                if (file_obj["quiet"] is False):
-                    print("Failed reading image data frame: %s" % (str(e)))
-                metadata_dict_list.pop()  # remove corresponding metadata entry
-                problematic = True
-                error_message = "image data read failure: %s" % (str(e))
-                continue  # skip to next frame
-
-            # initialize image stack
-            if (is_first is True):
-                images = image_matrix
-                is_first = False
-            else:
-                images = np.dstack([images, image_matrix])  # depth stack images (on 3rd axis)
-
-    # close gzip file
-    unzipped.close()
-
-    # set the site/device uids, or inject the site and device UIDs if they are missing
-    if ("Site unique ID" not in metadata_dict):
-        metadata_dict["Site unique ID"] = site_uid
-
-    if ("Imager unique ID" not in metadata_dict):
-        metadata_dict["Imager unique ID"] = device_uid
-
-    # check to see if the image is empty
-    if (images.size == 0):
-        if (file_obj["quiet"] is False):
-            print("Error reading image file: found no image data")
-        problematic = True
-        error_message = "no image data"
-
-    # return
-    return images, metadata_dict_list, problematic, file_obj["filename"], error_message, \
-        image_width, image_height, image_channels, image_dtype
-
-
-def read(file_list, workers=1, first_frame=False, no_metadata=False, tar_tempdir=None, quiet=False):
+                if (options["quiet"] is False):
+                    print("Failed to read metadata from file '%s' " % (f))
+                return metadata_dict_list, True, "failed to read metadata: %s" % (str(e)), None
+        return metadata_dict_list, False, "", None
+    elif (file.endswith("h5")):
+        # only the metadata attributes (and frame timestamps, for a time window) are read
+        with h5py.File(file, 'r') as f:
+            return __h5_metadata(f, __h5_select_indices(f, options)), False, "", None
+    else:
+        if (options["quiet"] is False):
+            print("Unrecognized file type: %s" % (file))
+        return [], True, "Unrecognized file type", None
+
+
+def __png_threads(png_threads, workers, cpus, file_list):
+    # the number of threads used to decode the frames of each PNG.tar file, by default
+    # splitting the CPUs (or for a set number of workers, the workers) between the files
+    # being read at once, so that a single file is decoded by all of them
+    if (png_threads is not None):
+        if (isinstance(png_threads, bool) is True or isinstance(png_threads, int) is False):
+            raise TypeError("png_threads must be an int")
+        if (png_threads < 1):
+            raise ValueError("png_threads must be at least 1")
+        return png_threads
+    busy_workers = max(min(workers, len(file_list)), 1)
+    return max(1, cpus // busy_workers)
+
+
+def read(file_list, workers=1, first_frame=False, no_metadata=False, tar_tempdir=None, quiet=False, mmap=False, gzip_index=False, frames=None,
+         start=None, end=None, output_dtype=None, gzip_backend="auto", gzip_verify=True, backend="auto", reader=None,
+         timeout_per_file=None, deadline=None, cancel_event=None, png_threads=None, pipeline=False,
+         metadata_format="dicts"):
     """
     Read in a single H5 or PNG.tar file, or an array of them. All files
     must be the same type. This also works for reading in PGM or untarred PNG
@@ -441,9 +477,14 @@ def read(file_list, workers=1, first_frame=False, no_metadata=False, tar_tempdir
 
     :param file_list: filename or list of filenames
     :type file_list: str
-    :param workers: number of worker processes to spawn, defaults to 1
-    :type workers: int, optional
-    :param first_frame: only read the first frame for each file, defaults to False
+    :param workers: number of worker processes (or threads, see backend) to use, or "auto" to
+                    pick one from the CPUs and memory available (taking CPU affinity and
+                    container limits into account), the number and size of the files, and
+                    the backend. The choice is logged to the "trex_imager_readfile" logger at
+                    debug level, defaults to 1
+    :type workers: int or str, optional
+    :param first_frame: only read the first frame for each file (takes precedence over the
+                        frames parameter), defaults to False
     :type first_frame: bool, optional
     :param no_metadata: exclude reading of metadata (performance optimization if
                         the metadata is not needed), defaults to False
@@ -452,123 +493,291 @@ def read(file_list, workers=1, first_frame=False, no_metadata=False, tar_tempdir
     :type tar_tempdir: str, optional
     :param quiet: reduce output while reading data
     :type quiet: bool, optional
-
-    :return: images, metadata dictionaries, and problematic files
-    :rtype: numpy.ndarray, list[dict], list[dict]
+    :param mmap: memory map uncompressed PGM files instead of reading them into memory
+                 (performance optimization for local uncompressed data), defaults to False
+    :type mmap: bool, optional
+    :param gzip_index: read PGM.gz files using gzip indexes, building any that are missing,
+                       so that reading only some frames doesn't decompress the whole file;
+                       True keeps the indexes next to the files, or give a directory to keep
+                       them in, defaults to False
+    :type gzip_index: bool or str, optional
+    :param frames: frames to read from each file, as a slice (ie. slice(0, 10), or slice(None, None, 10)
+                   for every 10th frame), a frame index, or a list of frame indices; negative indices
+                   count back from the end of each file, and indices past the end are skipped. Frames
+                   that aren't selected are skipped without being decoded where possible, defaults to
+                   None (all frames)
+    :type frames: slice or int or list[int], optional
+    :param start: only read frames with a timestamp at or after this time (UTC), defaults
+                  to None (no limit)
+    :type start: datetime.datetime, optional
+    :param end: only read frames with a timestamp before this time (UTC), defaults to None
+                (no limit)
+    :type end: datetime.datetime, optional
+    :param output_dtype: dtype of the returned images (ie. "uint16", "float32", "float16", or "uint8"),
+                         converted to as each frame is copied in. 16-bit data is scaled down to
+                         fit in uint8 (keeping the top 8 bits of each value), other dtypes keep
+                         the pixel values as they are. Integer dtypes that can't hold every value
+                         of the data (ie. "int16" for 16-bit data) raise a ValueError. Defaults to
+                         None (uint8 for H5 and PNG files, uint16 for PGM files)
+    :type output_dtype: str or numpy.dtype, optional
+    :param gzip_backend: library used to decompress PGM.gz files; "auto" picks the fastest one
+                         installed out of "isal", "zlib-ng", and "zlib" (the standard library).
+                         "pigz" runs the external pigz program. The backend used for each file is
+                         logged to the "trex_imager_readfile" logger at debug level, defaults to "auto"
+    :type gzip_backend: str, optional
+    :param gzip_verify: check the CRC32 and size in the trailer of PGM.gz files; set to False to
+                        skip the check for trusted data, defaults to True
+    :type gzip_verify: bool, optional
+    :param backend: run the workers as separate "process"es, or as "thread"s that write straight
+                    into the output array without sending any data between processes. Only
+                    decompression and PNG decoding run outside the GIL, and h5py only lets one
+                    thread into the HDF5 library at a time, so whether threads are faster
+                    depends on the files and the system. "auto" uses processes, defaults to "auto"
+    :type backend: str, optional
+    :param reader: run the workers on this Reader's long-lived pool instead of starting
+                   new ones for this read (see trex_imager_readfile.Reader, which sets this
+                   along with workers and backend), defaults to None
+    :type reader: trex_imager_readfile.Reader, optional
+    :param timeout_per_file: give up on any file that takes longer than this many seconds to
+                             read (ie. one stuck on a hung network filesystem), and carry on
+                             with the rest, defaults to None (no limit)
+    :type timeout_per_file: float, optional
+    :param deadline: give up on any files that haven't been read by this time, given as a
+                     number of seconds from now or a datetime (naive datetimes are local
+                     time), defaults to None (no limit)
+    :type deadline: float or datetime.datetime, optional
+    :param cancel_event: give up on any files that haven't been read once this event is set
+                         (ie. a threading.Event set from another thread), defaults to None.
+                         With one worker and no timeout or deadline, it's checked between
+                         files, so the file being read is finished first
+    :type cancel_event: threading.Event, optional
+    :param png_threads: number of threads used to decode the frames of each PNG.tar file
+                        (OpenCV decodes outside of the GIL). Defaults to None, which splits
+                        the workers between the files being read at once (ie. one file read
+                        with workers=8 is decoded by 8 threads, and 8 or more files by 1
+                        thread each). For workers="auto", the CPUs are split instead
+    :type png_threads: int, optional
+    :param pipeline: decode PGM.gz files that are read in full as a pipeline, with a second
+                     thread reading and decompressing each file a chunk at a time while the
+                     frames that have arrived are parsed and copied in. I/O waits (ie. on a
+                     network filesystem), decompression, and copying then overlap, and the
+                     whole decompressed file is never held in memory. The gzip trailers are
+                     always checked, defaults to False
+    :type pipeline: bool, optional
+    :param metadata_format: return the metadata as "dicts", a list with a dictionary for each
+                            frame, or "columnar", a ColumnarMetadata holding a NumPy array for
+                            each field with an entry per frame, built in the workers as each
+                            file is read. Timestamps are converted to datetime64[us], and a
+                            fixed list of known numeric fields to int64 or float64 (identifiers
+                            stay strings), and its to_records() gives back the original strings;
+                            frames without a field are masked out of its column. "typed" also
+                            converts the known fields whose values are a number followed by a
+                            unit (ie. "5001.0000 ms", or "-64C"), with the units kept in its
+                            units attribute. "compact" is a list of
+                            FrameMetadata that behave like the dictionaries, but keep each
+                            file's fields, and the values that are the same in all of its
+                            frames, once. "lazy" is a list of LazyMetadata that behave like
+                            the dictionaries, but keep each PGM frame header as it was read,
+                            and only decode it the first time the frame's metadata is used
+                            (the metadata of PNG and H5 files is decoded as it's read),
+                            defaults to "dicts"
+    :type metadata_format: str, optional
+
+    Files that are given up on are returned as problematic files, along with the frames
+    of the files that were read.
+
+    :return: images, metadata (see metadata_format), and problematic files
+    :rtype: numpy.ndarray, list[dict] or ColumnarMetadata, list[dict]
     """
     # set tar path
     if (tar_tempdir is None):
         tar_tempdir = Path("%s/.trex_imager_readfile" % (str(Path.home())))
     os.makedirs(tar_tempdir, exist_ok=True)
 
-    # if input is just a single file name in a string, convert to a list to be fed to the workers
+    # get the number of workers
+    #
+    # NOTE: for workers="auto", the workers are picked here rather than by the read, so that
+    # the CPUs can be split between the PNG decoding threads of the workers
     if isinstance(file_list, str):
         file_list = [file_list]
-
-    # convert to object, injecting other data we need for processing
-    processing_list = []
-    for f in file_list:
-        processing_list.append({
-            "filename": f,
+    backend = _engine.worker_backend(backend)
+    cpus = _engine.available_cpus() if workers == "auto" else workers
+    workers = _engine.worker_count(workers, file_list, backend)
+
+    # read files
+    start, end = _engine.time_window(start, end)
+    return _engine.read(
+        file_list,
+        __rgb_probe,
+        __trex_readfile_worker,
+        {
             "tar_tempdir": tar_tempdir,
-            "first_frame": first_frame,
+            "frames": _engine.frame_selection(frames, first_frame),
+            "start": start,
+            "end": end,
             "no_metadata": no_metadata,
             "quiet": quiet,
-        })
+            "mmap": mmap,
+            "gzip_index": gzip_index,
+            "output_dtype": _engine.output_dtype(output_dtype),
+            "gzip_backend": _decompress.select(gzip_backend),
+            "gzip_verify": gzip_verify,
+            "png_threads": __png_threads(png_threads, workers, cpus, file_list),
+            "pipeline": pipeline,
+            "metadata_format": _metadata.check_format(metadata_format),
+        },
+        workers=workers,
+        backend=backend,
+        reader=reader,
+        limits=_engine.read_limits(timeout_per_file, deadline, cancel_event),
+        default_dtype=__RGB_PNG_DT,
+    )
+
+
+def read_metadata(file_list, workers=1, first_frame=False, quiet=False, gzip_index=False, frames=None, start=None, end=None,
+                  gzip_backend="auto", gzip_verify=True, backend="auto", reader=None,
+                  timeout_per_file=None, deadline=None, cancel_event=None, metadata_format="dicts"):
+    """
+    Read in only the metadata of a single H5 or PNG.tar file, or an array of them,
+    without reading any pixel data (performance optimization if the images are not
+    needed). This also works for PGM or untarred PNG files.
 
-    # check workers
-    if (workers > 1):
-        try:
-            # set up process pool (ignore SIGINT before spawning pool so child processes inherit SIGINT handler)
-            original_sigint_handler = signal.signal(signal.SIGINT, signal.SIG_IGN)
-            pool = Pool(processes=workers)
-            signal.signal(signal.SIGINT, original_sigint_handler)  # restore SIGINT handler
-        except ValueError:
-            # likely the read call is being used within a context that doesn't support the usage
-            # of signals in this way, proceed without it
-            pool = Pool(processes=workers)
-
-        # call readfile function, run each iteration with a single input file from file_list
-        # NOTE: structure of data - data[file][metadata dictionary lists = 1, images = 0][frame]
-        pool_data = []
-        try:
-            pool_data = pool.map(__trex_readfile_worker, processing_list)
-        except KeyboardInterrupt:
-            pool.terminate()  # gracefully kill children
-            return np.empty((0, 0, 0, 0)), [], []
-        else:
-            pool.close()
-            pool.join()
-    else:
-        # don't bother using multiprocessing with one worker, just call the worker function directly
-        pool_data = []
-        for p in processing_list:
-            pool_data.append(__trex_readfile_worker(p))
-
-    # set sizes
-    image_width = pool_data[0][5]
-    image_height = pool_data[0][6]
-    image_channels = pool_data[0][7]
-    image_dtype = pool_data[0][8]
-
-    # derive number of frames to prepare for
-    total_num_frames = 0
-    for i in range(0, len(pool_data)):
-        if (pool_data[i][2] is True):
-            continue
-        if (image_channels > 1):
-            total_num_frames += pool_data[i][0].shape[3]
-        else:
-            total_num_frames += pool_data[i][0].shape[2]
+    Takes the same parameters as read(), without no_metadata, tar_tempdir, and mmap. H5
+    files only have their metadata attributes read, PNG.tar files only have their member
+    names listed (nothing is extracted), and PGM files have their pixel data skipped over.
 
-    # pre-allocate array sizes
-    if (image_channels > 1):
-        images = np.empty([image_height, image_width, image_channels, total_num_frames], dtype=image_dtype)
-    else:
-        images = np.empty([image_height, image_width, total_num_frames], dtype=image_dtype)
-    metadata_dict_list = [{}] * total_num_frames
-    problematic_file_list = []
-
-    # populate data
-    list_position = 0
-    for i in range(0, len(pool_data)):
-        # check if file was problematic
-        if (pool_data[i][2] is True):
-            problematic_file_list.append({
-                "filename": pool_data[i][3],
-                "error_message": pool_data[i][4],
-            })
-            continue
-
-        # check if any data was read in
-        if (len(pool_data[i][1]) == 0):
-            continue
-
-        # find actual number of frames, this may differ from predicted due to dropped frames, end
-        # or start of imaging
-        if (image_channels > 1):
-            this_num_frames = pool_data[i][0].shape[3]
-        else:
-            this_num_frames = pool_data[i][0].shape[2]
+    :param file_list: filename or list of filenames
+    :type file_list: str
+    :param workers: number of worker processes (or threads, see backend) to use, or "auto",
+                    see read(), defaults to 1
+    :type workers: int or str, optional
+    :param first_frame: only read the first frame for each file (takes precedence over the
+                        frames parameter), defaults to False
+    :type first_frame: bool, optional
+    :param quiet: reduce output while reading data
+    :type quiet: bool, optional
+    :param gzip_index: read PGM.gz files using gzip indexes, see read(), defaults to False
+    :type gzip_index: bool or str, optional
+    :param frames: frames to read from each file, see read(), defaults to None (all frames)
+    :type frames: slice or int or list[int], optional
+    :param start: only read frames with a timestamp at or after this time (UTC), defaults
+                  to None (no limit)
+    :type start: datetime.datetime, optional
+    :param end: only read frames with a timestamp before this time (UTC), defaults to None
+                (no limit)
+    :type end: datetime.datetime, optional
+    :param gzip_backend: library used to decompress PGM.gz files, see read(), defaults to "auto"
+    :type gzip_backend: str, optional
+    :param gzip_verify: check the CRC32 and size in the trailer of PGM.gz files, defaults to True
+    :type gzip_verify: bool, optional
+    :param backend: run the workers as "process"es or "thread"s, see read(), defaults to "auto"
+    :type backend: str, optional
+    :param reader: run the workers on this Reader's long-lived pool, see read(), defaults to None
+    :type reader: trex_imager_readfile.Reader, optional
+    :param timeout_per_file: give up on any file that takes longer than this many seconds, see
+                             read(), defaults to None (no limit)
+    :type timeout_per_file: float, optional
+    :param deadline: give up on any files that haven't been read by this time, see read(),
+                     defaults to None (no limit)
+    :type deadline: float or datetime.datetime, optional
+    :param cancel_event: give up on any files that haven't been read once this event is set,
+                         defaults to None
+    :type cancel_event: threading.Event, optional
+    :param metadata_format: return the metadata as "dicts", "columnar", "typed", "compact", or "lazy", see read(),
+                            defaults to "dicts"
+    :type metadata_format: str, optional
+
+    :return: metadata (see metadata_format), and problematic files
+    :rtype: list[dict] or ColumnarMetadata, list[dict]
+    """
+    start, end = _engine.time_window(start, end)
+    return _engine.read_metadata(
+        file_list,
+        __rgb_metadata_worker,
+        {
+            "frames": _engine.frame_selection(frames, first_frame),
+            "start": start,
+            "end": end,
+            "quiet": quiet,
+            "gzip_index": gzip_index,
+            "gzip_backend": _decompress.select(gzip_backend),
+            "gzip_verify": gzip_verify,
+            "metadata_format": _metadata.check_format(metadata_format),
+        },
+        workers=workers,
+        backend=_engine.worker_backend(backend),
+        reader=reader,
+        limits=_engine.read_limits(timeout_per_file, deadline, cancel_event),
+    )
+
+
+async def aread(file_list, **kwargs):
+    """
+    Read in a single H5 or PNG.tar file, or an array of them without blocking the event loop (asyncio)
 
-        # metadata dictionary list at data[][1]
-        metadata_dict_list[list_position:list_position + this_num_frames] = pool_data[i][1]
-        if (image_channels > 1):
-            images[:, :, :, list_position:list_position + this_num_frames] = pool_data[i][0]
-        else:
-            images[:, :, list_position:list_position + this_num_frames] = pool_data[i][0]
-        list_position = list_position + this_num_frames  # advance list position
+    Takes the same parameters as read(), apart from cancel_event. The read is run on
+    a pool of threads shared by all asynchronous reads (see
+    trex_imager_readfile.set_max_concurrent_reads()), and cancelling the task awaiting
+    it stops the read.
 
-    # trim unused elements from predicted array sizes
-    metadata_dict_list = metadata_dict_list[0:list_position]
-    if (image_channels > 1):
-        images = np.delete(images, range(list_position, total_num_frames), axis=3)
-    else:
-        images = np.delete(images, range(list_position, total_num_frames), axis=2)
+    :return: images, metadata (see metadata_format), and problematic files
+    :rtype: numpy.ndarray, list[dict] or ColumnarMetadata, list[dict]
+    """
+    return await _aio.run(read, file_list, kwargs)
 
-    # ensure entire array views as the desired dtype
-    images = images.astype(image_dtype)
 
-    # return
-    pool_data = None
-    return images, metadata_dict_list, problematic_file_list
+def aiter_frames(file_list, **kwargs):
+    """
+    Asynchronously iterate over the frames in a single H5 or PNG.tar file, or an array of them, as (image, metadata)
+    for each frame (asyncio)
+
+    Takes the same parameters as read(), apart from cancel_event. Files are read one at a
+    time, like aread(), with the next file being read while the frames of the current
+    one are used. Files that couldn't be read are added to the iterator's
+    problematic_files list. Use it as an async context manager (or call its aclose()) to
+    stop reading ahead when leaving the loop early.
+
+    :return: frame iterator
+    :rtype: AsyncIterator[tuple[numpy.ndarray, dict]]
+    """
+    return _aio.FrameIterator(read, file_list, kwargs)
+
+
+def open_mmap(file):
+    """
+    Memory map a single uncompressed PGM file, for fast random access to its frames
+
+    The file is scanned once when opened. Frames are returned as read-only views onto
+    the mapped file (big endian uint16), so pixel data is only read from disk when it
+    is accessed. Metadata is parsed the first time it is accessed. Only PGM files can
+    be memory mapped; PNG and H5 files are compressed.
+
+    :param file: filename of an uncompressed PGM file
+    :type file: str
+
+    :return: the mapped file; index it to get frames, and use the 'metadata' attribute
+             to get metadata dictionaries. Can be used as a context manager.
+    :rtype: MappedFile
+    """
+    return _pgm.MappedFile(file, __RGB_PGM_DT, duplicates_as_list=True)
+
+
+def open_indexed(file, index_dir=None):
+    """
+    Open a single PGM.gz file using a gzip index, for fast random access to its frames
+
+    The index is loaded from the sidecar file next to the PGM.gz file (or in index_dir),
+    or built and saved if it doesn't exist yet. Frames are then read by decompressing
+    only the part of the file they're in. Only PGM.gz files can be indexed.
+
+    :param file: filename of a PGM.gz file
+    :type file: str
+    :param index_dir: directory the index is kept in, defaults to next to the file
+    :type index_dir: str, optional
+
+    :return: the opened file; index it to get frames (native byte order uint16), and use
+             frame_metadata() to get metadata dictionaries. Can be used as a context manager.
+    :rtype: IndexedFile
+    """
+    gzip_index = index_dir if index_dir is not None else True
+    return _pgm.IndexedFile(file, __RGB_PGM_DT, duplicates_as_list=True, gzip_index=gzip_index)
@@ -1,299 +1,356 @@
-import gzip
 import numpy as np
-import signal
-import os
-from multiprocessing import Pool
-from functools import partial
+from . import _aio
+from . import _decompress
+from . import _engine
+from . import _metadata
+from . import _pgm
 
 # globals
 __SPECTROGRAPH_EXPECTED_HEIGHT = 1024
 __SPECTROGRAPH_EXPECTED_WIDTH = 256
+__SPECTROGRAPH_OUTPUT_DT = np.dtype("uint16")
 __SPECTROGRAPH_DT = np.dtype("uint16")
 __SPECTROGRAPH_DT = __SPECTROGRAPH_DT.newbyteorder('>')  # force big endian byte ordering
 
 
-def __spectrograph_readfile_worker(file, first_frame=False, no_metadata=False, quiet=False):
-    # init
-    images = np.array([])
-    metadata_dict_list = []
-    is_first = True
-    metadata_dict = {}
-    site_uid = ""
-    device_uid = ""
-    problematic = False
-    error_message = ""
+def __spectrograph_probe(file, options):
+    frame_shape, num_frames = _pgm.probe(
+        file,
+        frames=options["frames"],
+        gzip_index=options["gzip_index"],
+        start=options["start"],
+        end=options["end"],
+    )
+    return frame_shape, __SPECTROGRAPH_OUTPUT_DT, num_frames
 
+
+def __spectrograph_readfile_worker(file, images, options):
     # set site UID and device UID in case we need it (ie. dark frames, or unstacked files)
-    file_split = os.path.basename(file).split('_')
-    if (len(file_split) == 5):
-        # is a regular file
-        site_uid = file_split[2]
-        device_uid = file_split[3]
-    elif (len(file_split) > 5):
-        # is likely a dark frame or a unstacked frame
-        site_uid = file_split[3]
-        device_uid = file_split[4]
-
-    # check file extension to see if it's gzipped or not
-    try:
-        if file.endswith("pgm.gz"):
-            unzipped = gzip.open(file, mode='rb')
-        elif file.endswith("pgm"):
-            unzipped = open(file, mode='rb')
-        else:
-            if (quiet is False):
-                print("Unrecognized file type: %s" % (file))
-            problematic = True
-            error_message = "Unrecognized file type"
-            try:
-                unzipped.close()
-            except Exception:
-                pass
-            return images, metadata_dict_list, problematic, file, error_message
-    except Exception as e:
-        if (quiet is False):
-            print("Failed to open file '%s' " % (file))
-        problematic = True
-        error_message = "failed to open file: %s" % (str(e))
-        try:
-            unzipped.close()
-        except Exception:
-            pass
-        return images, metadata_dict_list, problematic, file, error_message
+    site_uid, device_uid = _pgm.uids_from_filename(file)
 
     # read the file
-    prev_line = None
-    line = None
-    while True:
-        # break out depending on first_frame param
-        if (first_frame is True and is_first is False):
-            break
-
-        # read a line
-        try:
-            prev_line = line
-            line = unzipped.readline()
-        except Exception as e:
-            if (quiet is False):
-                print("Error reading before image data in file '%s'" % (file))
-            problematic = True
-            metadata_dict_list = []
-            images = np.array([])
-            error_message = "error reading before image data: %s" % (str(e))
-            try:
-                unzipped.close()
-            except Exception:
-                pass
-            return images, metadata_dict_list, problematic, file, error_message
-
-        # break loop at end of file
-        if (line == b''):
-            break
-
-        # magic number; this is not a metadata or image line, exclude
-        if (line.startswith(b'P5\n')):
-            continue
-
-        # process line
-        if (line.startswith(b'#"')):
-            if (no_metadata is True):
-                metadata_dict = {}
-                metadata_dict_list.append(metadata_dict)
-            else:
-                # metadata lines start with #"<key>"
-                try:
-                    line_decoded = line.decode("ascii")
-                except Exception as e:
-                    # skip metadata line if it can't be decoded, likely corrupt file
-                    if (quiet is False):
-                        print("Error decoding metadata line: %s (line='%s', file='%s')" % (str(e), line, file))
-                    problematic = True
-                    error_message = "error decoding metadata line: %s" % (str(e))
-                    continue
-
-                # split the key and value out of the metadata line
-                line_decoded_split = line_decoded.split('"')
-                key = line_decoded_split[1]
-                value = line_decoded_split[2].strip()
-
-                # add entry to dictionary
-                metadata_dict[key] = value
-
-                # set the site/device uids, or inject the site and device UIDs if they are missing
-                if ("Site unique ID" not in metadata_dict):
-                    metadata_dict["Site unique ID"] = site_uid
-                else:
-                    site_uid = metadata_dict["Site unique ID"]
-                if ("Imager unique ID" not in metadata_dict):
-                    metadata_dict["Imager unique ID"] = device_uid
-                else:
-                    device_uid = metadata_dict["Imager unique ID"]
-
-                # split dictionaries up per frame, exposure plus initial readout is
-                # always the end of metadata for frame
-                if (key.startswith("Exposure plus readout")):
-                    metadata_dict_list.append(metadata_dict)
-                    metadata_dict = {}
-        elif line == b'65535\n':
-            # there are 2 lines between "exposure plus read out" and the image
-            # data, the first is the image dimensions and the second is the max
-            # value
-            #
-            # check the previous line to get the dimensions of the image
-            prev_line_split = prev_line.decode("ascii").strip().split()
-            image_width = int(prev_line_split[0])
-            image_height = int(prev_line_split[1])
-            bytes_to_read = image_width * image_height * 2  # 16-bit image depth
-
-            # read image
-            try:
-                # read the image size in bytes from the file
-                image_bytes = unzipped.read(bytes_to_read)
-
-                # format bytes into numpy array of unsigned shorts (2byte numbers, 0-65536),
-                # effectively an array of pixel values
-                image_np = np.frombuffer(image_bytes, dtype=__SPECTROGRAPH_DT)
-
-                # change 1d numpy array into matrix with correctly located pixels
-                image_matrix = np.reshape(image_np, (image_height, image_width, 1))
-            except Exception as e:
-                if (quiet is False):
-                    print("Failed reading image data frame: %s" % (str(e)))
-                metadata_dict_list.pop()  # remove corresponding metadata entry
-                problematic = True
-                error_message = "image data read failure: %s" % (str(e))
-                continue  # skip to next frame
-
-            # initialize image stack
-            if (is_first is True):
-                images = image_matrix
-                is_first = False
-            else:
-                images = np.dstack([images, image_matrix])  # depth stack images (on 3rd axis)
-
-    # close gzip file
-    unzipped.close()
-
-    # check to see if the image is empty
-    if (images.size == 0):
-        if (quiet is False):
-            print("Error reading image file: found no image data")
-        problematic = True
-        error_message = "no image data"
-
-    # return
-    return images, metadata_dict_list, problematic, file, error_message
-
-
-def read(file_list, workers=1, first_frame=False, no_metadata=False, quiet=False):
+    return _pgm.decode(
+        file,
+        images,
+        __SPECTROGRAPH_DT,
+        site_uid=site_uid,
+        device_uid=device_uid,
+        frames=options["frames"],
+        no_metadata=options["no_metadata"],
+        quiet=options["quiet"],
+        use_mmap=options["mmap"],
+        gzip_index=options["gzip_index"],
+        start=options["start"],
+        end=options["end"],
+        gzip_backend=options["gzip_backend"],
+        gzip_verify=options["gzip_verify"],
+        pipeline=options["pipeline"],
+        lazy_metadata=(options["metadata_format"] == "lazy"),
+    )
+
+
+def __spectrograph_metadata_worker(file, options):
+    # set site UID and device UID in case we need it (ie. dark frames, or unstacked files)
+    site_uid, device_uid = _pgm.uids_from_filename(file)
+
+    # read the file's metadata
+    return _pgm.read_metadata(
+        file,
+        site_uid=site_uid,
+        device_uid=device_uid,
+        frames=options["frames"],
+        quiet=options["quiet"],
+        gzip_index=options["gzip_index"],
+        start=options["start"],
+        end=options["end"],
+        gzip_backend=options["gzip_backend"],
+        gzip_verify=options["gzip_verify"],
+        lazy_metadata=(options["metadata_format"] == "lazy"),
+    )
+
+
+def read(file_list, workers=1, first_frame=False, no_metadata=False, quiet=False, mmap=False, gzip_index=False, frames=None, start=None, end=None,
+         output_dtype=None, gzip_backend="auto", gzip_verify=True, backend="auto", reader=None,
+         timeout_per_file=None, deadline=None, cancel_event=None, pipeline=False,
+         metadata_format="dicts"):
     """
     Read in a single PGM file or set of PGM files
 
     :param file_list: filename or list of filenames
     :type file_list: str
-    :param workers: number of worker processes to spawn, defaults to 1
-    :type workers: int, optional
-    :param first_frame: only read the first frame for each file, defaults to False
+    :param workers: number of worker processes (or threads, see backend) to use, or "auto" to
+                    pick one from the CPUs and memory available (taking CPU affinity and
+                    container limits into account), the number and size of the files, and
+                    the backend. The choice is logged to the "trex_imager_readfile" logger at
+                    debug level, defaults to 1
+    :type workers: int or str, optional
+    :param first_frame: only read the first frame for each file (takes precedence over the
+                        frames parameter), defaults to False
     :type first_frame: bool, optional
     :param no_metadata: exclude reading of metadata (performance optimization if
                         the metadata is not needed), defaults to False
     :type no_metadata: bool, optional
     :param quiet: reduce output while reading data
     :type quiet: bool, optional
+    :param mmap: memory map uncompressed PGM files instead of reading them into memory
+                 (performance optimization for local uncompressed data), defaults to False
+    :type mmap: bool, optional
+    :param gzip_index: read PGM.gz files using gzip indexes, building any that are missing,
+                       so that reading only some frames doesn't decompress the whole file;
+                       True keeps the indexes next to the files, or give a directory to keep
+                       them in, defaults to False
+    :type gzip_index: bool or str, optional
+    :param frames: frames to read from each file, as a slice (ie. slice(0, 10), or slice(None, None, 10)
+                   for every 10th frame), a frame index, or a list of frame indices; negative indices
+                   count back from the end of each file, and indices past the end are skipped. Frames
+                   that aren't selected are skipped without being decoded where possible, defaults to
+                   None (all frames)
+    :type frames: slice or int or list[int], optional
+    :param start: only read frames with a timestamp at or after this time (UTC), defaults
+                  to None (no limit)
+    :type start: datetime.datetime, optional
+    :param end: only read frames with a timestamp before this time (UTC), defaults to None
+                (no limit)
+    :type end: datetime.datetime, optional
+    :param output_dtype: dtype of the returned images (ie. "uint16", "float32", "float16", or "uint8"),
+                         converted to as each frame is copied in. 16-bit data is scaled down to
+                         fit in uint8 (keeping the top 8 bits of each value), other dtypes keep
+                         the pixel values as they are. Integer dtypes that can't hold every value
+                         of the data (ie. "int16" for 16-bit data) raise a ValueError. Defaults to
+                         None (uint16)
+    :type output_dtype: str or numpy.dtype, optional
+    :param gzip_backend: library used to decompress PGM.gz files; "auto" picks the fastest one
+                         installed out of "isal", "zlib-ng", and "zlib" (the standard library).
+                         "pigz" runs the external pigz program. The backend used for each file is
+                         logged to the "trex_imager_readfile" logger at debug level, defaults to "auto"
+    :type gzip_backend: str, optional
+    :param gzip_verify: check the CRC32 and size in the trailer of PGM.gz files; set to False to
+                        skip the check for trusted data, defaults to True
+    :type gzip_verify: bool, optional
+    :param backend: run the workers as separate "process"es, or as "thread"s that write straight
+                    into the output array without sending any data between processes. Only
+                    decompression runs outside the GIL, so whether threads are faster depends
+                    on the files and the system. "auto" uses processes, defaults to "auto"
+    :type backend: str, optional
+    :param reader: run the workers on this Reader's long-lived pool instead of starting
+                   new ones for this read (see trex_imager_readfile.Reader, which sets this
+                   along with workers and backend), defaults to None
+    :type reader: trex_imager_readfile.Reader, optional
+    :param timeout_per_file: give up on any file that takes longer than this many seconds to
+                             read (ie. one stuck on a hung network filesystem), and carry on
+                             with the rest, defaults to None (no limit)
+    :type timeout_per_file: float, optional
+    :param deadline: give up on any files that haven't been read by this time, given as a
+                     number of seconds from now or a datetime (naive datetimes are local
+                     time), defaults to None (no limit)
+    :type deadline: float or datetime.datetime, optional
+    :param cancel_event: give up on any files that haven't been read once this event is set
+                         (ie. a threading.Event set from another thread), defaults to None.
+                         With one worker and no timeout or deadline, it's checked between
+                         files, so the file being read is finished first
+    :type cancel_event: threading.Event, optional
+    :param pipeline: decode PGM.gz files that are read in full as a pipeline, with a second
+                     thread reading and decompressing each file a chunk at a time while the
+                     frames that have arrived are parsed and copied in. I/O waits (ie. on a
+                     network filesystem), decompression, and copying then overlap, and the
+                     whole decompressed file is never held in memory. The gzip trailers are
+                     always checked, defaults to False
+    :type pipeline: bool, optional
+    :param metadata_format: return the metadata as "dicts", a list with a dictionary for each
+                            frame, or "columnar", a ColumnarMetadata holding a NumPy array for
+                            each field with an entry per frame, built in the workers as each
+                            file is read. Timestamps are converted to datetime64[us], and a
+                            fixed list of known numeric fields to int64 or float64 (identifiers
+                            stay strings), and its to_records() gives back the original strings;
+                            frames without a field are masked out of its column. "typed" also
+                            converts the known fields whose values are a number followed by a
+                            unit (ie. "5001.0000 ms", or "-64C"), with the units kept in its
+                            units attribute. "compact" is a list of
+                            FrameMetadata that behave like the dictionaries, but keep each
+                            file's fields, and the values that are the same in all of its
+                            frames, once. "lazy" is a list of LazyMetadata that behave like
+                            the dictionaries, but keep each PGM frame header as it was read,
+                            and only decode it the first time the frame's metadata is used,
+                            defaults to "dicts"
+    :type metadata_format: str, optional
+
+    Files that are given up on are returned as problematic files, along with the frames
+    of the files that were read.
+
+    :return: images, metadata (see metadata_format), and problematic files
+    :rtype: numpy.ndarray, list[dict] or ColumnarMetadata, list[dict]
+    """
+    start, end = _engine.time_window(start, end)
+    return _engine.read(
+        file_list,
+        __spectrograph_probe,
+        __spectrograph_readfile_worker,
+        {
+            "frames": _engine.frame_selection(frames, first_frame),
+            "start": start,
+            "end": end,
+            "no_metadata": no_metadata,
+            "quiet": quiet,
+            "mmap": mmap,
+            "gzip_index": gzip_index,
+            "output_dtype": _engine.output_dtype(output_dtype),
+            "gzip_backend": _decompress.select(gzip_backend),
+            "gzip_verify": gzip_verify,
+            "pipeline": pipeline,
+            "metadata_format": _metadata.check_format(metadata_format),
+        },
+        workers=workers,
+        backend=_engine.worker_backend(backend),
+        reader=reader,
+        limits=_engine.read_limits(timeout_per_file, deadline, cancel_event),
+        default_frame_shape=(__SPECTROGRAPH_EXPECTED_HEIGHT, __SPECTROGRAPH_EXPECTED_WIDTH),
+        default_dtype=__SPECTROGRAPH_OUTPUT_DT,
+    )
+
+
+def read_metadata(file_list, workers=1, first_frame=False, quiet=False, gzip_index=False, frames=None, start=None, end=None,
+                  gzip_backend="auto", gzip_verify=True, backend="auto", reader=None,
+                  timeout_per_file=None, deadline=None, cancel_event=None, metadata_format="dicts"):
+    """
+    Read in only the metadata of a single PGM file or set of PGM files, without reading
+    any pixel data (performance optimization if the images are not needed)
+
+    Takes the same parameters as read(), without no_metadata and mmap (uncompressed files
+    are always memory mapped, so their pixel data isn't read from disk).
+
+    :param file_list: filename or list of filenames
+    :type file_list: str
+    :param workers: number of worker processes (or threads, see backend) to use, or "auto",
+                    see read(), defaults to 1
+    :type workers: int or str, optional
+    :param first_frame: only read the first frame for each file (takes precedence over the
+                        frames parameter), defaults to False
+    :type first_frame: bool, optional
+    :param quiet: reduce output while reading data
+    :type quiet: bool, optional
+    :param gzip_index: read PGM.gz files using gzip indexes, see read(), defaults to False
+    :type gzip_index: bool or str, optional
+    :param frames: frames to read from each file, see read(), defaults to None (all frames)
+    :type frames: slice or int or list[int], optional
+    :param start: only read frames with a timestamp at or after this time (UTC), defaults
+                  to None (no limit)
+    :type start: datetime.datetime, optional
+    :param end: only read frames with a timestamp before this time (UTC), defaults to None
+                (no limit)
+    :type end: datetime.datetime, optional
+    :param gzip_backend: library used to decompress PGM.gz files, see read(), defaults to "auto"
+    :type gzip_backend: str, optional
+    :param gzip_verify: check the CRC32 and size in the trailer of PGM.gz files, defaults to True
+    :type gzip_verify: bool, optional
+    :param backend: run the workers as "process"es or "thread"s, see read(), defaults to "auto"
+    :type backend: str, optional
+    :param reader: run the workers on this Reader's long-lived pool, see read(), defaults to None
+    :type reader: trex_imager_readfile.Reader, optional
+    :param timeout_per_file: give up on any file that takes longer than this many seconds, see
+                             read(), defaults to None (no limit)
+    :type timeout_per_file: float, optional
+    :param deadline: give up on any files that haven't been read by this time, see read(),
+                     defaults to None (no limit)
+    :type deadline: float or datetime.datetime, optional
+    :param cancel_event: give up on any files that haven't been read once this event is set,
+                         defaults to None
+    :type cancel_event: threading.Event, optional
+    :param metadata_format: return the metadata as "dicts", "columnar", "typed", "compact", or "lazy", see read(),
+                            defaults to "dicts"
+    :type metadata_format: str, optional
+
+    :return: metadata (see metadata_format), and problematic files
+    :rtype: list[dict] or ColumnarMetadata, list[dict]
+    """
+    start, end = _engine.time_window(start, end)
+    return _engine.read_metadata(
+        file_list,
+        __spectrograph_metadata_worker,
+        {
+            "frames": _engine.frame_selection(frames, first_frame),
+            "start": start,
+            "end": end,
+            "quiet": quiet,
+            "gzip_index": gzip_index,
+            "gzip_backend": _decompress.select(gzip_backend),
+            "gzip_verify": gzip_verify,
+            "metadata_format": _metadata.check_format(metadata_format),
+        },
+        workers=workers,
+        backend=_engine.worker_backend(backend),
+        reader=reader,
+        limits=_engine.read_limits(timeout_per_file, deadline, cancel_event),
+    )
+
+
+async def aread(file_list, **kwargs):
+    """
+    Read in a single PGM file or set of PGM files without blocking the event loop (asyncio)
+
+    Takes the same parameters as read(), apart from cancel_event. The read is run on
+    a pool of threads shared by all asynchronous reads (see
+    trex_imager_readfile.set_max_concurrent_reads()), and cancelling the task awaiting
+    it stops the read.
+
+    :return: images, metadata (see metadata_format), and problematic files
+    :rtype: numpy.ndarray, list[dict] or ColumnarMetadata, list[dict]
+    """
+    return await _aio.run(read, file_list, kwargs)
+
+
+def aiter_frames(file_list, **kwargs):
+    """
+    Asynchronously iterate over the frames in a single PGM file or set of PGM files, as (image, metadata)
+    for each frame (asyncio)
+
+    Takes the same parameters as read(), apart from cancel_event. Files are read one at a
+    time, like aread(), with the next file being read while the frames of the current
+    one are used. Files that couldn't be read are added to the iterator's
+    problematic_files list. Use it as an async context manager (or call its aclose()) to
+    stop reading ahead when leaving the loop early.
+
+    :return: frame iterator
+    :rtype: AsyncIterator[tuple[numpy.ndarray, dict]]
+    """
+    return _aio.FrameIterator(read, file_list, kwargs)
+
+
+def open_mmap(file):
+    """
+    Memory map a single uncompressed PGM file, for fast random access to its frames
+
+    The file is scanned once when opened. Frames are returned as read-only views onto
+    the mapped file (big endian uint16), so pixel data is only read from disk when it
+    is accessed. Metadata is parsed the first time it is accessed.
+
+    :param file: filename of an uncompressed PGM file
+    :type file: str
+
+    :return: the mapped file; index it to get frames, and use the 'metadata' attribute
+             to get metadata dictionaries. Can be used as a context manager.
+    :rtype: MappedFile
+    """
+    site_uid, device_uid = _pgm.uids_from_filename(file)
+    return _pgm.MappedFile(file, __SPECTROGRAPH_DT, site_uid=site_uid, device_uid=device_uid)
+
+
+def open_indexed(file, index_dir=None):
+    """
+    Open a single PGM.gz file using a gzip index, for fast random access to its frames
+
+    The index is loaded from the sidecar file next to the PGM.gz file (or in index_dir),
+    or built and saved if it doesn't exist yet. Frames are then read by decompressing
+    only the part of the file they're in.
+
+    :param file: filename of a PGM.gz file
+    :type file: str
+    :param index_dir: directory the index is kept in, defaults to next to the file
+    :type index_dir: str, optional
 
-    :return: images, metadata dictionaries, and problematic files
-    :rtype: numpy.ndarray, list[dict], list[dict]
+    :return: the opened file; index it to get frames (native byte order uint16), and use
+             frame_metadata() to get metadata dictionaries. Can be used as a context manager.
+    :rtype: IndexedFile
     """
-    # if input is just a single file name in a string, convert to a list to be fed to the workers
-    if isinstance(file_list, str):
-        file_list = [file_list]
-
-    # check workers
-    if (workers > 1):
-        try:
-            # set up process pool (ignore SIGINT before spawning pool so child processes inherit SIGINT handler)
-            original_sigint_handler = signal.signal(signal.SIGINT, signal.SIG_IGN)
-            pool = Pool(processes=workers)
-            signal.signal(signal.SIGINT, original_sigint_handler)  # restore SIGINT handler
-        except ValueError:
-            # likely the read call is being used within a context that doesn't support the usage
-            # of signals in this way, proceed without it
-            pool = Pool(processes=workers)
-
-        # call readfile function, run each iteration with a single input file from file_list
-        # NOTE: structure of data - data[file][metadata dictionary lists = 1, images = 0][frame]
-        data = []
-        try:
-            data = pool.map(partial(
-                __spectrograph_readfile_worker,
-                first_frame=first_frame,
-                no_metadata=no_metadata,
-                quiet=quiet,
-            ), file_list)
-        except KeyboardInterrupt:
-            pool.terminate()  # gracefully kill children
-            return np.empty((0, 0, 0), dtype=__SPECTROGRAPH_DT), [], []
-        else:
-            pool.close()
-            pool.join()
-    else:
-        # don't bother using multiprocessing with one worker, just call the worker function directly
-        data = []
-        for f in file_list:
-            data.append(__spectrograph_readfile_worker(
-                f,
-                first_frame=first_frame,
-                no_metadata=no_metadata,
-                quiet=quiet,
-            ))
-
-    # derive number of frames to prepare for
-    total_num_frames = 0
-    image_width = __SPECTROGRAPH_EXPECTED_WIDTH
-    image_height = __SPECTROGRAPH_EXPECTED_HEIGHT
-    for i in range(0, len(data)):
-        if (data[i][2] is True):
-            continue
-        total_num_frames += data[i][0].shape[2]
-        image_height = data[i][0].shape[0]
-        image_width = data[i][0].shape[1]
-
-    # pre-allocate array sizes
-    images = np.empty([image_height, image_width, total_num_frames], dtype=__SPECTROGRAPH_DT)
-    metadata_dict_list = [{}] * total_num_frames
-    problematic_file_list = []
-
-    # populate data
-    list_position = 0
-    for i in range(0, len(data)):
-        # check if file was problematic
-        if (data[i][2] is True):
-            problematic_file_list.append({
-                "filename": data[i][3],
-                "error_message": data[i][4],
-            })
-            continue
-
-        # check if any data was read in
-        if (len(data[i][1]) == 0):
-            continue
-
-        # find actual number of frames, this may differ from predicted due to dropped frames, end
-        # or start of imaging
-        real_num_frames = data[i][0].shape[2]
-
-        # metadata dictionary list at data[][1]
-        metadata_dict_list[list_position:list_position + real_num_frames] = data[i][1]
-        images[:, :, list_position:list_position + real_num_frames] = data[i][0]  # image arrays at data[][0]
-        list_position = list_position + real_num_frames  # advance list position
-
-    # trim unused elements from predicted array sizes
-    metadata_dict_list = metadata_dict_list[0:list_position]
-    images = np.delete(images, range(list_position, total_num_frames), axis=2)
-
-    # ensure entire array views as uint16
-    images = images.astype(np.uint16)
-
-    # return
-    data = None
-    return images, metadata_dict_list, problematic_file_list
+    site_uid, device_uid = _pgm.uids_from_filename(file)
+    gzip_index = index_dir if index_dir is not None else True
+    return _pgm.IndexedFile(file, __SPECTROGRAPH_DT, site_uid=site_uid, device_uid=device_uid, gzip_index=gzip_index)